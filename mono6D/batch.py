@@ -0,0 +1,259 @@
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import hashlib
+import shutil
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from thread_limits import thread_env_vars
+
+def find_clips(pattern=None, manifest=None):
+    """
+    Collect the clips of a batch.
+    
+    Args:
+        pattern: Glob pattern matching RGB videos (e.g. "videos/*.mp4"), depth videos are skipped
+        manifest: Text file with one RGB video path per line, or a JSON list of paths
+    
+    Returns:
+        List of (name, rgb_path, depth_path) tuples, a video listed twice is kept once
+    """
+    paths = []
+    if pattern is not None:
+        paths += sorted(glob.glob(pattern))
+    if manifest is not None:
+        with open(manifest) as f:
+            if manifest.endswith('.json'):
+                paths += json.load(f)
+            else:
+                paths += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    
+    clips = []
+    seen = set()
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name.endswith('_depth') or os.path.abspath(path) in seen:
+            continue
+        seen.add(os.path.abspath(path))
+        depth_path = os.path.join(os.path.dirname(path), f"{name}_depth.mp4")
+        if not os.path.exists(depth_path):
+            print(f"Warning: no depth video for {path}, skipping")
+            continue
+        clips.append((name, os.path.abspath(path), os.path.abspath(depth_path)))
+    
+    return clips
+
+def workspace_names(clips):
+    """
+    Workspace folder of every clip.
+    
+    Clips with the same name in different folders would share a workspace and overwrite each
+    other's outputs, they get a suffix derived from their folder instead.
+    
+    Args:
+        clips: List of (name, rgb_path, depth_path) tuples
+    
+    Returns:
+        List of unique folder names, in the order of clips
+    """
+    counts = {}
+    for name, _, _ in clips:
+        counts[name] = counts.get(name, 0) + 1
+    
+    names = []
+    for name, rgb_path, _ in clips:
+        if counts[name] > 1:
+            folder_hash = hashlib.sha1(os.path.dirname(rgb_path).encode()).hexdigest()[:8]
+            name = f"{name}_{folder_hash}"
+        names.append(name)
+    return names
+
+def prepare_workspace(workspace, name, rgb_path, depth_path):
+    """Create the job folder with its own _input_videos (linked, or copied if links are not supported)"""
+    input_dir = os.path.join(workspace, "_input_videos")
+    os.makedirs(input_dir, exist_ok=True)
+    
+    for src, dst_name in [(rgb_path, f"{name}.mp4"), (depth_path, f"{name}_depth.mp4")]:
+        dst = os.path.join(input_dir, dst_name)
+        if os.path.lexists(dst):
+            os.remove(dst)
+        try:
+            os.symlink(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+
+def count_frames(path):
+    """Number of frames of a video"""
+    import cv2
+    video = cv2.VideoCapture(path)
+    frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    video.release()
+    return max(frames, 0)
+
+def run_job(name, rgb_path, depth_path, workspace, cores, options, video_options):
+    """
+    Run main_process for one clip inside its own workspace.
+    
+    Executed in a worker process that is used for this job only: the working directory
+    and the stdout/stderr file descriptors of the worker are redirected to the job workspace.
+    
+    Returns:
+        Dictionary with the job result
+    """
+    result = {'clip': name, 'workspace': workspace, 'status': 'ok', 'error': None,
+              'frames': 0, 'seconds': 0.0, 'fps': 0.0}
+    
+    start = time.perf_counter()
+    try:
+        prepare_workspace(workspace, name, rgb_path, depth_path)
+        os.chdir(workspace)
+        
+        # Redirect at the file descriptor level so native OpenCV/ffmpeg messages are captured too
+        log = open(os.path.join(workspace, "log.txt"), 'w')
+        os.dup2(log.fileno(), sys.stdout.fileno())
+        os.dup2(log.fileno(), sys.stderr.fileno())
+        
+        import cv2
+        cv2.setNumThreads(cores)
+        
+        from main import main_process
+        from video_io import video_params
+        from mesh_orientation import orientation_params
+        video_params.update(video_options)
+        # Face workers share the cores of the job
+        orientation_params['face_workers'] = max(1, min(orientation_params['face_workers'], cores))
+        
+        result['frames'] = count_frames(rgb_path)
+        # Concurrent stages share the cores of the job
+        main_process(name, **dict({'cpu_budget': cores}, **options))
+    except Exception:
+        result['status'] = 'failed'
+        result['error'] = traceback.format_exc()
+        print(result['error'])
+    finally:
+        # Exiting the worker joins its child processes, the persistent pools must be stopped first
+        if 'main' in sys.modules:
+            from video_io import shutdown_decoder_pool
+            from depth_improving import shutdown_cube_face_pool
+            from mesh_orientation import shutdown_face_pools
+            shutdown_decoder_pool()
+            shutdown_cube_face_pool()
+            shutdown_face_pools()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    
+    result['seconds'] = time.perf_counter() - start
+    if result['status'] == 'ok' and result['seconds'] > 0:
+        result['fps'] = result['frames'] / result['seconds']
+    
+    return result
+
+def run_batch(clips, workspace_root, jobs=1, cores_per_job=1, options=None, video_options=None):
+    """
+    Process many clips concurrently, each one isolated in workspace_root/<clip>.
+    
+    Args:
+        clips: List of (name, rgb_path, depth_path) tuples
+        workspace_root: Folder holding one workspace per clip (see workspace_names)
+        jobs: Number of clips processed at the same time
+        cores_per_job: Thread budget of each job (BLAS, OpenMP and OpenCV threads)
+        options: Keyword arguments for main_process
+        video_options: Overrides for video_io.video_params
+    
+    Returns:
+        List of job results in completion order
+    """
+    options = options or {}
+    video_options = video_options or {}
+    workspace_root = os.path.abspath(workspace_root)
+    os.makedirs(workspace_root, exist_ok=True)
+    
+    # Inherited by the spawned workers before they import numpy/scipy
+    for var in thread_env_vars:
+        os.environ[var] = str(cores_per_job)
+    
+    # The pipeline modules must be importable from the job workspaces
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [module_dir, os.environ.get("PYTHONPATH")]))
+    
+    results = []
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context, max_tasks_per_child=1) as executor:
+        futures = {
+            executor.submit(run_job, name, rgb_path, depth_path, os.path.join(workspace_root, workspace),
+                            cores_per_job, options, video_options): (name, workspace)
+            for (name, rgb_path, depth_path), workspace in zip(clips, workspace_names(clips))
+        }
+        for future in as_completed(futures):
+            name, workspace = futures[future]
+            try:
+                result = future.result()
+            except Exception:
+                # Worker crashed (e.g. killed), not raised inside main_process
+                result = {'clip': name, 'workspace': os.path.join(workspace_root, workspace), 'status': 'failed',
+                          'error': traceback.format_exc(), 'frames': 0, 'seconds': 0.0, 'fps': 0.0}
+            print(f"[{result['status']}] {workspace}: {result['frames']} frames in {result['seconds']:.1f}s")
+            results.append(result)
+    
+    return results
+
+def write_report(results, workspace_root):
+    """Print a summary and save it as batch_report.json and batch_report.csv in workspace_root"""
+    print("\nBATCH SUMMARY")
+    # Clips sharing a name are told apart by their workspace folder
+    for result in sorted(results, key=lambda r: r['workspace']):
+        print(f"{os.path.basename(result['workspace']):30s} {result['status']:7s} {result['frames']:6d} frames "
+              f"{result['seconds']:9.1f}s {result['fps']:7.3f} fps")
+    
+    failed = [os.path.basename(r['workspace']) for r in results if r['status'] != 'ok']
+    print(f"{len(results) - len(failed)}/{len(results)} clips succeeded")
+    if failed:
+        print(f"Failed: {', '.join(failed)} (see log.txt in their workspaces)")
+    
+    with open(os.path.join(workspace_root, "batch_report.json"), 'w') as f:
+        json.dump(results, f, indent=2)
+    
+    with open(os.path.join(workspace_root, "batch_report.csv"), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['clip', 'status', 'frames', 'seconds', 'fps', 'workspace'],
+                                extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(results)
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Process many 360° RGBD clips, each in its own workspace.")
+    parser.add_argument("--glob", dest="pattern", help="Glob pattern of RGB videos, e.g. 'videos/*.mp4'")
+    parser.add_argument("--manifest", help="Text file (one RGB video per line) or JSON list of RGB videos")
+    parser.add_argument("--workspace-root", default="_batch", help="Folder holding one workspace per clip")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of clips processed concurrently")
+    parser.add_argument("--cores-per-job", type=int, default=max(1, os.cpu_count() or 1),
+                        help="Thread budget of each job")
+    parser.add_argument("--inpaint-method", choices=["ns", "pyramid"], default=None)
+    parser.add_argument("--alpha-format", choices=["bgr", "gray"], default="bgr")
+    parser.add_argument("--video-backend", choices=["opencv", "ffmpeg"], default="opencv")
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--keep-temp", action="store_true")
+    parser.add_argument("--improve-depth", action="store_true")
+    args = parser.parse_args()
+    
+    if args.pattern is None and args.manifest is None:
+        parser.error("either --glob or --manifest is required")
+    
+    clips = find_clips(args.pattern, args.manifest)
+    print(f"Found {len(clips)} clips, running {args.jobs} at a time with {args.cores_per_job} cores each")
+    
+    options = {
+        'inpaint_method': args.inpaint_method,
+        'alpha_format': args.alpha_format,
+        'resume': args.resume,
+        'cleanup': not args.keep_temp,
+        'improve': args.improve_depth
+    }
+    results = run_batch(clips, args.workspace_root, args.jobs, args.cores_per_job, options,
+                        {'backend': args.video_backend})
+    write_report(results, os.path.abspath(args.workspace_root))
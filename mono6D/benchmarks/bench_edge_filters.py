@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import numpy as np
+import cv2
+
+# Modules live in the parent mono6D folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import render_frame
+from depth_improving import edge_aware_filter, params as depth_params
+
+# Frame sizes to benchmark (width, height), padded like finish_depth_frame does
+frame_sizes = {
+    '2K': (2048, 1024),
+    '4K': (4096, 2048)
+}
+
+filter_methods = ['joint_bilateral', 'guided', 'fgs', 'bilateral_grid']
+
+def make_inputs(width, height, seed=0):
+    """
+    Create a guide, a degraded depth map and its ground truth from the synthetic scene.
+
+    The depth is refined at a lower resolution in improve_depth and upsampled before the
+    edge-aware filter, so the ground truth is downscaled by 4, upscaled and made noisy.
+
+    Returns:
+        (guide, depth, ground_truth): float32 images in [0, 1]
+    """
+    rng = np.random.default_rng(seed)
+    rgb, depth = render_frame(width, height, 0.0)
+
+    guide = cv2.cvtColor(rgb, cv2.COLOR_BGR2GRAY).astype(np.float32) / 255.0
+    ground_truth = depth.astype(np.float32) / 255.0
+
+    degraded = cv2.resize(ground_truth, (width // 4, height // 4), interpolation=cv2.INTER_AREA)
+    degraded = cv2.resize(degraded, (width, height), interpolation=cv2.INTER_LINEAR)
+    degraded += 0.02 * rng.standard_normal((height, width)).astype(np.float32)
+
+    return guide, np.clip(degraded, 0, 1), ground_truth
+
+def read_clip_inputs(rgb_path, depth_path, frame_idx=0):
+    """Guide and depth of one frame of a clip (no ground truth)"""
+    rgb_video = cv2.VideoCapture(rgb_path)
+    depth_video = cv2.VideoCapture(depth_path)
+    rgb_video.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+    depth_video.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+    _, rgb = rgb_video.read()
+    _, depth = depth_video.read()
+    rgb_video.release()
+    depth_video.release()
+
+    depth = cv2.resize(depth[:, :, 0], (rgb.shape[1], rgb.shape[0]))
+    guide = cv2.cvtColor(rgb, cv2.COLOR_BGR2GRAY).astype(np.float32) / 255.0
+    return guide, depth.astype(np.float32) / 255.0, None
+
+def pad_like_pipeline(image, pad_size):
+    """Circular padding in x and symmetric padding in y, as in prepare_depth_frame"""
+    image = np.pad(image, ((0, 0), (pad_size, pad_size)), mode='wrap')
+    return np.pad(image, ((pad_size, pad_size), (0, 0)), mode='symmetric')
+
+def time_filter(depth, guide, method, repeats):
+    """Return the filtered depth and the best wall time in seconds over the given number of repeats"""
+    params = dict(depth_params, edge_filter=method)
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        filtered = edge_aware_filter(depth, guide, params)
+        best = min(best, time.perf_counter() - start)
+    return filtered, best
+
+def compare_filters(guide, depth, ground_truth, repeats):
+    """
+    Run every filter backend on one frame.
+
+    Returns:
+        Dictionary method -> (seconds, MAE to the joint bilateral reference,
+        MAE to the ground truth, MAE to the ground truth near depth edges)
+    """
+    pad_size = depth_params['pad_size']
+    guide = pad_like_pipeline(guide, pad_size)
+    depth = pad_like_pipeline(depth, pad_size)
+
+    if ground_truth is not None:
+        edges = cv2.Canny(np.round(ground_truth * 255).astype(np.uint8), 10, 30)
+        edges = cv2.dilate(edges, np.ones((5, 5), np.uint8)) > 0
+
+    results = {}
+    reference = None
+    for method in filter_methods:
+        filtered, seconds = time_filter(depth, guide, method, repeats)
+        filtered = filtered[pad_size:-pad_size, pad_size:-pad_size]
+        if reference is None:
+            reference = filtered
+
+        error = gt_error = edge_error = float('nan')
+        error = float(np.abs(filtered - reference).mean())
+        if ground_truth is not None:
+            gt_error = float(np.abs(filtered - ground_truth).mean())
+            edge_error = float(np.abs(filtered - ground_truth)[edges].mean())
+        results[method] = (seconds, error, gt_error, edge_error)
+
+    return results
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare the speed and quality of the edge-aware depth filters.")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of timed runs per filter")
+    parser.add_argument("--rgb", default=None, help="RGB video of a clip (default: synthetic scene)")
+    parser.add_argument("--depth", default=None, help="Depth video of the clip")
+    parser.add_argument("--frame", type=int, default=0, help="Frame of the clip to filter")
+    args = parser.parse_args()
+
+    if args.rgb is not None:
+        inputs = {os.path.basename(args.rgb): read_clip_inputs(args.rgb, args.depth, args.frame)}
+    else:
+        inputs = {f"{label} ({width}x{height})": make_inputs(width, height)
+                  for label, (width, height) in frame_sizes.items()}
+
+    for label, (guide, depth, ground_truth) in inputs.items():
+        print(label)
+        results = compare_filters(guide, depth, ground_truth, args.repeats)
+        reference_time = results['joint_bilateral'][0]
+        for method, (seconds, error, gt_error, edge_error) in results.items():
+            print(f"  {method:16s} {seconds:.3f}s ({reference_time / seconds:.1f}x), "
+                  f"vs reference {error:.4f}, vs ground truth {gt_error:.4f} (edges {edge_error:.4f})")
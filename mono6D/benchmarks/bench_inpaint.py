@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import numpy as np
+import cv2
+
+# Modules live in the parent mono6D folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inpainted_layer import inpaint_nans
+
+# Frame sizes to benchmark (width, height)
+frame_sizes = {
+    '2K': (2048, 1024),
+    '4K': (4096, 2048)
+}
+
+def make_background(width, height, seed=0):
+    """
+    Create a synthetic background channel with large disocclusion holes.
+    
+    Args:
+        width, height: Frame size
+        seed: Random seed
+        
+    Returns:
+        2D float32 array in [0, 1] with NaNs marking the holes
+    """
+    rng = np.random.default_rng(seed)
+    
+    # Smooth gradient plus some texture
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    channel = 0.5 + 0.25 * np.sin(x / width * 6 * np.pi) * np.cos(y / height * 4 * np.pi)
+    channel += 0.05 * rng.standard_normal((height, width)).astype(np.float32)
+    channel = np.clip(channel, 0, 1)
+    
+    # Holes hundreds of pixels wide, scaled with the frame size
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for _ in range(6):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        axes = (int(rng.integers(width // 40, width // 10)), int(rng.integers(height // 20, height // 6)))
+        cv2.ellipse(mask, center, axes, float(rng.integers(0, 180)), 0, 360, 255, -1)
+    
+    channel[mask > 0] = np.nan
+    return channel
+
+def time_method(channel, method, repeats):
+    """Return the best wall time in seconds over the given number of repeats"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        inpaint_nans(channel.copy(), method)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Compare full-resolution and pyramid inpainting runtimes.")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of timed runs per method")
+    args = parser.parse_args()
+    
+    for label, (width, height) in frame_sizes.items():
+        channel = make_background(width, height)
+        hole_fraction = np.isnan(channel).mean()
+        
+        t_ns = time_method(channel, 'ns', args.repeats)
+        t_pyr = time_method(channel, 'pyramid', args.repeats)
+        
+        print(f"{label} ({width}x{height}, {hole_fraction * 100:.1f}% holes): "
+              f"ns {t_ns:.3f}s, pyramid {t_pyr:.3f}s, speedup {t_ns / t_pyr:.1f}x")
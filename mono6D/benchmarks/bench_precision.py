@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+# Modules live in the parent mono6D folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import render_frame
+from depth_improving import (compute_frame_features, optimize_objective, optimize_objective_temporal,
+                             Coarse2FineTwoFrames, para, params as depth_params)
+
+# Processing sizes (width, height): 80% of 2K (bilinear upsampling) and 25% of 2K (BGU)
+frame_sizes = {
+    'downscale': (1638, 819),
+    'bgu': (512, 256)
+}
+
+precisions = ['float64', 'float32']
+
+def make_frames(width, height):
+    """Two consecutive synthetic frames as improve_depth sees them (RGB in [0, 1], uint8 depth)"""
+    rgb0, depth0 = render_frame(width, height, 0.0)
+    rgb1, depth1 = render_frame(width, height, 0.05)
+    return rgb0.astype(np.float32) / 255.0, depth0, rgb1.astype(np.float32) / 255.0, depth1
+
+def run_solve(frames, precision, temporal):
+    """
+    Run one refinement solve.
+
+    Returns:
+        (refined depth, seconds, peak traced memory in bytes)
+    """
+    rgb0, depth0, rgb1, depth1 = frames
+    params = dict(depth_params, precision=precision)
+    weights = compute_frame_features(rgb1, depth1, params)['weights']
+    mask = np.ones_like(depth1)
+    if temporal:
+        _, _, flows = Coarse2FineTwoFrames(rgb0, rgb1, para)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    if temporal:
+        result = optimize_objective_temporal(depth1, weights, mask, flows, depth0.astype(np.float32), params)
+    else:
+        result = optimize_objective(depth1, weights, mask, params)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, seconds, peak
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare float32 and float64 depth refinement solves.")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of timed runs per precision")
+    args = parser.parse_args()
+
+    for label, (width, height) in frame_sizes.items():
+        frames = make_frames(width, height)
+        for temporal in (False, True):
+            results = {}
+            for precision in precisions:
+                runs = [run_solve(frames, precision, temporal) for _ in range(args.repeats)]
+                results[precision] = (runs[0][0], min(r[1] for r in runs), max(r[2] for r in runs))
+
+            reference = results['float64'][0]
+            kind = 'temporal' if temporal else 'first frame'
+            print(f"{label} ({width}x{height}, {kind}):")
+            for precision, (result, seconds, peak) in results.items():
+                error = np.abs(result.astype(np.float64) - reference).max()
+                print(f"  {precision}: {seconds:.3f}s, peak {peak / 2**20:.0f} MiB, max diff to float64 {error:.2e}")
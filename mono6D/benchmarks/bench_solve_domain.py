@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import numpy as np
+
+# Modules live in the parent mono6D folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_precision import make_frames, frame_sizes
+from depth_improving import (compute_frame_features, optimize_objective, optimize_objective_temporal,
+                             Coarse2FineTwoFrames, cube_face_layout, para, params as depth_params)
+
+# Solve domain -> parameter overrides, the equirectangular solve is the reference
+domains = {
+    'equirect': {'solve_domain': 'equirect'},
+    'cubemap (1 process)': {'solve_domain': 'cubemap', 'cube_workers': 1},
+    'cubemap (6 processes)': {'solve_domain': 'cubemap', 'cube_workers': 6}
+}
+
+def make_padded_frames(width, height):
+    """
+    Two consecutive synthetic processing frames with the padding of prepare_depth_frame
+    (circular in x, symmetric in y), which the cubemap solve crops before projecting.
+    """
+    top, left, _, _ = cube_face_layout(height, width, depth_params)
+    frames = make_frames(width - 2 * left, height - 2 * top)
+
+    padded = []
+    for frame in frames:
+        pad_x = [(0, 0), (left, left)] + [(0, 0)] * (frame.ndim - 2)
+        pad_y = [(top, top), (0, 0)] + [(0, 0)] * (frame.ndim - 2)
+        padded.append(np.pad(np.pad(frame, pad_x, mode='wrap'), pad_y, mode='symmetric'))
+    return padded
+
+def run_solve(frames, overrides, temporal, repeats):
+    """
+    Run one refinement solve.
+
+    Returns:
+        (refined depth, best wall time in seconds)
+    """
+    rgb0, depth0, rgb1, depth1 = frames
+    params = dict(depth_params, **overrides)
+    weights = compute_frame_features(rgb1, depth1, params)['weights']
+    mask = np.ones_like(depth1)
+    if temporal:
+        _, _, flows = Coarse2FineTwoFrames(rgb0, rgb1, para)
+
+    def solve():
+        if temporal:
+            return optimize_objective_temporal(depth1, weights, mask, flows, depth0.astype(np.float32), params)
+        return optimize_objective(depth1, weights, mask, params)
+
+    # The first run starts the worker processes and builds the cached maps, it is not timed
+    result = solve()
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = solve()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+def region_errors(result, reference, params):
+    """Mean and maximum absolute difference inside the unpadded frame"""
+    height, width = reference.shape
+    top, left, _, _ = cube_face_layout(height, width, params)
+    diff = np.abs(result.astype(np.float64) - reference)[top:height - top, left:width - left]
+    return diff.mean(), diff.max()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare the equirectangular and cubemap depth refinement solves.")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of timed runs per domain")
+    args = parser.parse_args()
+
+    print(f"CPU cores: {os.cpu_count()}")
+    for label, (width, height) in frame_sizes.items():
+        frames = make_padded_frames(width, height)
+        for temporal in (False, True):
+            results = {name: run_solve(frames, overrides, temporal, args.repeats)
+                       for name, overrides in domains.items()}
+
+            reference, reference_time = results['equirect']
+            kind = 'temporal' if temporal else 'first frame'
+            print(f"{label} ({width}x{height}, {kind}):")
+            for name, (result, seconds) in results.items():
+                mean_error, max_error = region_errors(result, reference.astype(np.float64), depth_params)
+                print(f"  {name:22s} {seconds:.3f}s ({reference_time / seconds:.2f}x), "
+                      f"diff to equirect mean {mean_error:.3f} max {max_error:.2f}")
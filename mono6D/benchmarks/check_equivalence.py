@@ -0,0 +1,257 @@
+import os
+import sys
+import glob
+import numpy as np
+import cv2
+
+# Modules live in the parent mono6D folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import render_frame
+from mesh_orientation import (orientation_params, equirectangular_to_cubemap, depth_to_mesh, calculate_triangle_orientations,
+                              dense_triangle_orientations, adaptive_cells, adaptive_triangle_orientations)
+from cubic2equi import cubic2equi
+from compute_alpha import process_alpha_map, AlphaProcessor
+
+# Allowed drift per output in 8-bit levels: (max absolute error, mean absolute error).
+# The cube faces and orientations are bit-exact, so any difference is a bug. AlphaProcessor
+# applies the sigmoid as a 16-bit lookup table and is documented to differ by +-1 level; its
+# mean allows 5x the 0.001 reached on the synthetic frames (recorded clips: below 0.0002).
+tolerances = {
+    'cube_faces': (0, 0.0),
+    'orientation_faces': (0, 0.0),
+    'orientation_equi': (0, 0.0),
+    'alpha': (1, 0.005),
+    'bg_orientation_equi': (0, 0.0),
+    'bg_alpha': (1, 0.005)
+}
+
+# Allowed drift of the adaptive orientations against the dense fast path: 1.5x the maxima
+# and 2x the means reached at 2048x1024 on the synthetic frames and the recorded clips
+# (smaller frames refine every cell), i.e. orientation 3 levels (mean 0.018, pier) and
+# alpha 22 levels (mean 0.0096, pier). Flat cells are interpolated from the coarse mesh,
+# which shifts the orientation by a few levels; the steep alpha sigmoid amplifies this at
+# isolated pixels close to its midpoint.
+adaptive_tolerances = {
+    'orientation_faces': (5, 0.04),
+    'orientation_equi': (5, 0.04),
+    'alpha': (33, 0.02),
+    'bg_orientation_equi': (5, 0.04),
+    'bg_alpha': (33, 0.02)
+}
+
+# Recorded depth videos of the demo, checked with --recorded
+recorded_clips = sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))), '6dof_demo_exe', 'vids', '*_depth.mp4')))
+
+def run_chain(depth, backend):
+    """
+    Run the orientation and alpha kernels on one equirectangular depth frame.
+    
+    Mirrors process_frame and process_frame_orientations without the file round trip.
+    
+    Args:
+        depth: Equirectangular depth frame (uint8, grayscale)
+        backend: 'reference', 'fast' or 'adaptive' (fast kernels with adaptive orientations)
+    
+    Returns:
+        Dictionary output name -> uint8 array
+    """
+    adaptive = backend == 'adaptive'
+    if adaptive:
+        backend = 'fast'
+    
+    faces = equirectangular_to_cubemap(depth, backend=backend)
+    
+    orientation_faces = []
+    for face_idx, face_depth in enumerate(faces):
+        if adaptive:
+            orientation_map = adaptive_triangle_orientations(face_depth, face_idx)
+        elif backend == 'fast':
+            orientation_map = dense_triangle_orientations(face_depth, face_idx)
+        else:
+            mesh = depth_to_mesh(face_depth, face_idx, backend=backend)
+            orientation_map = calculate_triangle_orientations(mesh, face_depth.shape, backend=backend)
+        orientation_faces.append(np.clip(orientation_map * 255, 0, 255).astype(np.uint8))
+    
+    right, left, top, bottom, front, back = orientation_faces
+    top = cv2.rotate(top, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    bottom = cv2.rotate(bottom, cv2.ROTATE_90_CLOCKWISE)
+    cube = [cv2.cvtColor(face, cv2.COLOR_GRAY2BGR) for face in (top, bottom, left, right, front, back)]
+    equi = cv2.cvtColor(cubic2equi(*cube, backend=backend), cv2.COLOR_BGR2GRAY)
+    
+    if backend == 'reference':
+        alpha = process_alpha_map(equi, grayscale=True)
+    else:
+        alpha = AlphaProcessor(equi.shape[0], equi.shape[1], grayscale=True).process(equi)
+    
+    return {
+        'cube_faces': np.stack(faces),
+        'orientation_faces': np.stack(orientation_faces),
+        'orientation_equi': equi,
+        'alpha': alpha
+    }
+
+def compare(reference, fast):
+    """Maximum and mean absolute difference of two arrays"""
+    diff = np.abs(reference.astype(np.float64) - fast.astype(np.float64))
+    return float(diff.max()), float(diff.mean())
+
+def load_depth_frames(depth_path, num_frames, width):
+    """Read up to num_frames frames of a depth video as grayscale, resized to width x width/2"""
+    video = cv2.VideoCapture(depth_path)
+    if not video.isOpened():
+        raise ValueError(f"Could not open video file: {depth_path}")
+    
+    frames = []
+    while len(frames) < num_frames:
+        ret, frame = video.read()
+        if not ret:
+            break
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        frames.append(cv2.resize(frame, (width, width // 2), interpolation=cv2.INTER_AREA))
+    video.release()
+    return frames
+
+def check_equivalence(depth_frames, baseline='reference', candidate='fast', limits=None):
+    """
+    Compare two backends of run_chain on a list of depth frames.
+    
+    The per-pixel median of the depth frames is also run as a stand-in for the
+    background layer (bg_* outputs).
+    
+    Args:
+        depth_frames: List of equirectangular uint8 depth frames
+        baseline: Backend the candidate is compared against
+        candidate: Backend under test
+        limits: Tolerance dictionary selecting the compared outputs (default: tolerances)
+    
+    Returns:
+        Dictionary output name -> (max absolute error, mean absolute error) over all frames
+    """
+    if limits is None:
+        limits = tolerances
+    errors = {}
+    
+    def accumulate(prefix, depth):
+        reference = run_chain(depth, baseline)
+        fast = run_chain(depth, candidate)
+        for name in reference:
+            key = prefix + name
+            if key not in limits:
+                continue
+            max_err, mean_err = compare(reference[name], fast[name])
+            prev_max, prev_means = errors.get(key, (0.0, []))
+            errors[key] = (max(prev_max, max_err), prev_means + [mean_err])
+    
+    for frame_idx, depth in enumerate(depth_frames):
+        print(f"Comparing frame {frame_idx+1}/{len(depth_frames)}")
+        accumulate('', depth)
+    
+    background = np.median(np.stack(depth_frames), axis=0).astype(np.uint8)
+    print("Comparing background")
+    accumulate('bg_', background)
+    
+    return {key: (max_err, float(np.mean(means))) for key, (max_err, means) in errors.items()}
+
+def count_interpolated_cells(depth_frames):
+    """
+    Count the cells the adaptive orientations interpolate instead of refining.
+    
+    Returns:
+        (interpolated cells, total cells) over all cube faces of all frames
+    """
+    interpolated, total = 0, 0
+    for depth in depth_frames:
+        for face_depth in equirectangular_to_cubemap(depth, backend='fast'):
+            cells = adaptive_cells(face_depth)
+            if cells is None:
+                continue
+            interpolated += int(np.count_nonzero(~cells[1]))
+            total += cells[1].size
+    return interpolated, total
+
+def report(errors, limits=None, title="REFERENCE VS FAST"):
+    """
+    Print the errors against the tolerances.
+    
+    Returns:
+        List of outputs exceeding their tolerance
+    """
+    if limits is None:
+        limits = tolerances
+    failed = []
+    print(f"\n{title}")
+    for key, (max_err, mean_err) in errors.items():
+        max_tol, mean_tol = limits[key]
+        status = 'ok' if max_err <= max_tol and mean_err <= mean_tol else 'DRIFT'
+        print(f"{key:22s} max {max_err:7.2f} (tol {max_tol:5.2f})  mean {mean_err:8.5f} (tol {mean_tol:7.4f})  {status}")
+        if status != 'ok':
+            failed.append(key)
+    return failed
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Compare the fast kernels against the reference implementations.")
+    parser.add_argument("--depth-video", help="Recorded depth video to use instead of synthetic frames")
+    parser.add_argument("--recorded", action="store_true",
+                        help="Check every recorded depth video of the demo (6dof_demo_exe/vids) instead")
+    parser.add_argument("--width", type=int,
+                        help="Equirectangular frame width, height is width/2 (default: 512, 2048 with --adaptive)")
+    parser.add_argument("--frames", type=int, default=3, help="Number of frames to compare")
+    parser.add_argument("--max-tol", type=float, help="Override the maximum absolute error tolerance of all outputs")
+    parser.add_argument("--mean-tol", type=float, help="Override the mean absolute error tolerance of all outputs")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Compare the adaptive orientations against the dense fast path instead")
+    args = parser.parse_args()
+    
+    # Below 2048 the cube faces are so small that the adaptive path refines every cell
+    if args.width is None:
+        args.width = 2048 if args.adaptive else 512
+    
+    # The accuracy of the interpolation is checked on every face, also on the detailed faces
+    # that adaptive_triangle_orientations computes densely for speed
+    orientation_params['adaptive_max_refined'] = 1.0
+    
+    limits = adaptive_tolerances if args.adaptive else tolerances
+    for key, (max_tol, mean_tol) in limits.items():
+        limits[key] = (max_tol if args.max_tol is None else args.max_tol,
+                       mean_tol if args.mean_tol is None else args.mean_tol)
+    
+    if args.recorded:
+        inputs = [(os.path.basename(path), load_depth_frames(path, args.frames, args.width)) for path in recorded_clips]
+    elif args.depth_video:
+        inputs = [(os.path.basename(args.depth_video), load_depth_frames(args.depth_video, args.frames, args.width))]
+    else:
+        inputs = [('synthetic', [render_frame(args.width, args.width // 2, frame_idx / args.frames)[1]
+                                 for frame_idx in range(args.frames)])]
+    
+    failed = []
+    interpolated_any = False
+    for name, depth_frames in inputs:
+        print(f"\n{name}")
+        if not depth_frames:
+            print("No frames to compare")
+            failed.append(name)
+            continue
+        
+        if args.adaptive:
+            interpolated, total = count_interpolated_cells(depth_frames)
+            print(f"Interpolated cells: {interpolated}/{total}")
+            if not interpolated:
+                print("Every cell was refined, the interpolated path is not tested here")
+                continue
+            interpolated_any = True
+            drift = report(check_equivalence(depth_frames, 'fast', 'adaptive', limits), limits, "DENSE VS ADAPTIVE")
+        else:
+            drift = report(check_equivalence(depth_frames))
+        failed += [f"{name}: {key}" for key in drift]
+    
+    if args.adaptive and not interpolated_any:
+        print("Every cell was refined in all inputs, the interpolated path is not tested (use a larger --width)")
+        sys.exit(1)
+    if failed:
+        print(f"Drift beyond tolerance in: {', '.join(failed)}")
+        sys.exit(1)
+    print("All outputs within tolerance")
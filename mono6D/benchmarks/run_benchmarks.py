@@ -0,0 +1,328 @@
+import os
+import sys
+import io
+import json
+import time
+import platform
+import shutil
+import tempfile
+import contextlib
+import numpy as np
+import cv2
+import scipy
+
+# Modules live in the parent mono6D folder
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(benchmark_dir))
+
+from synthetic import render_frame, write_clip
+from bench_inpaint import make_background
+
+from mesh_orientation import (equirectangular_to_cubemap, depth_to_mesh, calculate_triangle_orientations,
+                              dense_triangle_orientations, adaptive_triangle_orientations)
+from cubic2equi import cubic2equi
+from compute_alpha import process_alpha_map, AlphaProcessor
+from extrapolated_layer import create_extrapolated_layer
+from inpainted_layer import inpaint_nans
+from depth_improving import (optimize_objective, optimize_objective_temporal, compute_smoothness_weight,
+                             eight_neighbour_extract, Coarse2FineTwoFrames, para, params as depth_params)
+
+# Equirectangular frame sizes (width, height)
+frame_sizes = {
+    'small': (256, 128),
+    'medium': (512, 256),
+    'large': (2048, 1024)
+}
+
+# Timings depend on the machine: the committed baselines record the host they were measured on
+# and are only a reference, regenerate them with --save-baseline on the machine that checks for
+# regressions
+default_baseline_path = os.path.join(benchmark_dir, 'baselines.json')
+
+# On the shared single-core host of the committed baseline, the medians of three back-to-back
+# runs of the suite differed by up to 76% (the load of the host changes between runs, CPU time
+# varies as much), so by default only slowdowns beyond 2x (and twice the spread of the repeats)
+# are regressions; pass a smaller --tolerance on a dedicated machine
+default_tolerance = 1.0
+
+@contextlib.contextmanager
+def workspace():
+    """Run the enclosed block in a temporary working directory (the pipeline uses relative paths)"""
+    previous = os.getcwd()
+    folder = tempfile.mkdtemp(prefix='mono6d_bench_')
+    os.chdir(folder)
+    try:
+        yield folder
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(folder, ignore_errors=True)
+
+# Each setup function prepares the inputs for a frame size and returns the callable to time
+
+def setup_equirectangular_to_cubemap(width, height, num_frames):
+    _, depth = render_frame(width, height, 0.0)
+    return lambda: equirectangular_to_cubemap(depth)
+
+def setup_depth_to_mesh(width, height, num_frames):
+    _, depth = render_frame(width, height, 0.0)
+    face = equirectangular_to_cubemap(depth)[4]
+    return lambda: depth_to_mesh(face, 4)
+
+def setup_calculate_triangle_orientations(width, height, num_frames):
+    _, depth = render_frame(width, height, 0.0)
+    face = equirectangular_to_cubemap(depth)[4]
+    mesh = depth_to_mesh(face, 4)
+    return lambda: calculate_triangle_orientations(mesh, face.shape)
+
+def setup_dense_triangle_orientations(width, height, num_frames):
+    _, depth = render_frame(width, height, 0.0)
+    face = equirectangular_to_cubemap(depth)[4]
+    return lambda: dense_triangle_orientations(face, 4)
+
+def setup_adaptive_triangle_orientations(width, height, num_frames):
+    _, depth = render_frame(width, height, 0.0)
+    face = equirectangular_to_cubemap(depth)[4]
+    return lambda: adaptive_triangle_orientations(face, 4)
+
+def setup_cubic2equi(width, height, num_frames):
+    _, depth = render_frame(width, height, 0.0)
+    face_size = height // 2
+    strip = width // 6
+    faces = [cv2.cvtColor(cv2.resize(depth[:, i * strip:(i + 1) * strip], (face_size, face_size)),
+                          cv2.COLOR_GRAY2BGR) for i in range(6)]
+    return lambda: cubic2equi(*faces)
+
+def setup_process_alpha_map(width, height, num_frames):
+    _, depth = render_frame(width, height, 0.0)
+    return lambda: process_alpha_map(depth)
+
+def setup_alpha_processor(width, height, num_frames):
+    _, depth = render_frame(width, height, 0.0)
+    processor = AlphaProcessor(height, width)
+    return lambda: processor.process(depth)
+
+def setup_inpaint_nans(width, height, num_frames):
+    channel = make_background(width, height)
+    return lambda: inpaint_nans(channel.copy())
+
+def setup_optimize_objective(width, height, num_frames):
+    _, depth = render_frame(width, height, 0.0)
+    depth = depth.astype(np.float64)
+    weights = {'w_sm': eight_neighbour_extract(compute_smoothness_weight(depth, depth_params))}
+    return lambda: optimize_objective(depth, weights, None, depth_params)
+
+def setup_optimize_objective_temporal(width, height, num_frames):
+    rgb0, depth0 = render_frame(width, height, 0.0)
+    rgb1, depth1 = render_frame(width, height, 0.05)
+    depth0, depth1 = depth0.astype(np.float64), depth1.astype(np.float64)
+    weights = {'w_sm': eight_neighbour_extract(compute_smoothness_weight(depth1, depth_params))}
+    _, _, flows = Coarse2FineTwoFrames(rgb0 / 255.0, rgb1 / 255.0, para)
+    return lambda: optimize_objective_temporal(depth1, weights, None, flows, depth0, depth_params)
+
+def setup_create_extrapolated_layer(width, height, num_frames):
+    def run():
+        with workspace():
+            write_clip('_input_videos', 'bench', width, height, num_frames)
+            os.makedirs('_improved_depth/bench/videos', exist_ok=True)
+            shutil.copy('_input_videos/bench_depth.mp4', '_improved_depth/bench/videos/bench_depth.mp4')
+            start = time.perf_counter()
+            create_extrapolated_layer('bench')
+            return time.perf_counter() - start
+    return run
+
+def setup_main_process(width, height, num_frames):
+    from main import main_process
+    
+    def run():
+        with workspace():
+            # main_process resamples alpha maps to 2048x1024, so the clip must use that size
+            write_clip('_input_videos', 'bench', 2048, 1024, num_frames)
+            start = time.perf_counter()
+            main_process('bench')
+            return time.perf_counter() - start
+    return run
+
+# Benchmarks whose time depends on the clip length, timed at every --frames value
+clip_benchmarks = {'create_extrapolated_layer', 'main_process'}
+
+# name -> (setup function, sizes it runs at by default, only run with --full)
+benchmarks = {
+    'equirectangular_to_cubemap': (setup_equirectangular_to_cubemap, ['small', 'medium'], False),
+    'depth_to_mesh': (setup_depth_to_mesh, ['small', 'medium'], False),
+    'calculate_triangle_orientations': (setup_calculate_triangle_orientations, ['small', 'medium'], False),
+    'dense_triangle_orientations': (setup_dense_triangle_orientations, ['small', 'medium'], False),
+    'adaptive_triangle_orientations': (setup_adaptive_triangle_orientations, ['small', 'medium'], False),
+    'cubic2equi': (setup_cubic2equi, ['small', 'medium', 'large'], False),
+    'process_alpha_map': (setup_process_alpha_map, ['small', 'medium', 'large'], False),
+    'AlphaProcessor.process': (setup_alpha_processor, ['small', 'medium', 'large'], False),
+    'inpaint_nans': (setup_inpaint_nans, ['small', 'medium', 'large'], False),
+    'optimize_objective': (setup_optimize_objective, ['small', 'medium'], False),
+    'optimize_objective_temporal': (setup_optimize_objective_temporal, ['small', 'medium'], False),
+    'create_extrapolated_layer': (setup_create_extrapolated_layer, ['small', 'medium'], False),
+    'main_process': (setup_main_process, ['large'], True)
+}
+
+def host_info():
+    """Machine and library versions the timings were measured with"""
+    return {
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'system': platform.system(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'scipy': scipy.__version__
+    }
+
+def time_case(setup, width, height, num_frames, repeats, min_time=0.2):
+    """
+    Time one benchmark case.
+    
+    The callable returned by setup is timed as a whole, unless it returns its own
+    duration (used by cases that need to write input files first). Short cases are
+    called repeatedly within each repeat until min_time has passed, which keeps
+    timer resolution and scheduling hiccups out of the per-call time.
+    
+    Returns:
+        Dictionary with the minimum and median time in seconds and the spread of the
+        repeats relative to the median
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        run = setup(width, height, num_frames)
+    
+    def timed_calls(number):
+        durations = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            for _ in range(number):
+                result = run()
+                if isinstance(result, float):
+                    durations.append(result)
+            elapsed = time.perf_counter() - start
+        return (sum(durations) if durations else elapsed) / number
+    
+    # Calls per repeat, from a first untimed call
+    first = timed_calls(1)
+    number = max(1, int(np.ceil(min_time / max(first, 1e-6))))
+    
+    times = [timed_calls(number) for _ in range(repeats)]
+    
+    median = float(np.median(times))
+    return {'min_s': min(times), 'median_s': median, 'spread': (max(times) - min(times)) / median,
+            'repeats': repeats, 'calls': number}
+
+def run_benchmarks(names=None, sizes=None, frame_counts=(2, 6), repeats=5, full=False):
+    """
+    Run the benchmark cases.
+    
+    Args:
+        names: Benchmark names to run (default: all)
+        sizes: Size labels to run (default: each benchmark's default sizes)
+        frame_counts: Clip lengths of the clip_benchmarks (the other cases use single frames)
+        repeats: Timed runs per case
+        full: Also run the slow end-to-end cases
+    
+    Returns:
+        Dictionary "name@WxH" (clip_benchmarks: "name@WxH:Nf") -> timing result
+    """
+    results = {}
+    for name, (setup, default_sizes, slow) in benchmarks.items():
+        if names is not None and name not in names:
+            continue
+        if slow and not full and names is None:
+            continue
+        
+        for label in (sizes or default_sizes):
+            width, height = frame_sizes[label]
+            for num_frames in (frame_counts if name in clip_benchmarks else frame_counts[:1]):
+                key = f"{name}@{width}x{height}"
+                if name in clip_benchmarks:
+                    key += f":{num_frames}f"
+                result = time_case(setup, width, height, num_frames, repeats)
+                results[key] = result
+                print(f"{key:50s} median {result['median_s']:9.4f}s  min {result['min_s']:9.4f}s  "
+                      f"spread {result['spread'] * 100:4.0f}%")
+    
+    return results
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Compare the medians of the results to a stored baseline.
+    
+    A case regresses when its median exceeds the baseline median by more than the
+    tolerance and by more than twice the larger spread of the two measurements.
+    
+    Args:
+        results: Output of run_benchmarks
+        baseline: Baseline file content ({'host': ..., 'results': {key: timing result}})
+        tolerance: Allowed relative slowdown (0.5 = 50%)
+    
+    Returns:
+        List of keys slower than allowed
+    """
+    host = host_info()
+    differences = [key for key in ('machine', 'processor', 'cpu_count') if baseline['host'].get(key) != host[key]]
+    if differences:
+        print(f"\nWarning: the baseline was measured on another host ({', '.join(differences)} differ: "
+              f"{baseline['host']}), regenerate it with --save-baseline on this machine")
+    
+    regressions = []
+    print("\nCOMPARISON TO BASELINE")
+    for key, result in results.items():
+        if key not in baseline['results']:
+            print(f"{key:50s} no baseline")
+            continue
+        reference = baseline['results'][key]
+        allowed = max(tolerance, 2 * reference['spread'], 2 * result['spread'])
+        ratio = result['median_s'] / reference['median_s']
+        status = 'REGRESSION' if ratio > 1 + allowed else 'ok'
+        print(f"{key:50s} {ratio:6.2f}x baseline (allowed {1 + allowed:4.2f}x)  {status}")
+        if status != 'ok':
+            regressions.append(key)
+    return regressions
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Benchmark the preprocessing functions on synthetic 360° RGBD clips.")
+    parser.add_argument("--only", nargs="+", choices=list(benchmarks), help="Benchmarks to run")
+    parser.add_argument("--sizes", nargs="+", choices=list(frame_sizes), help="Frame sizes to run")
+    parser.add_argument("--frames", type=int, nargs="+", default=[2, 6],
+                        help="Clip lengths of the benchmarks timing whole clips (%s)" % ", ".join(sorted(clip_benchmarks)))
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per case (the median is compared)")
+    parser.add_argument("--full", action="store_true", help="Include the end-to-end main_process benchmark")
+    parser.add_argument("--baseline", default=default_baseline_path, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=default_tolerance,
+                        help="Allowed relative slowdown of the median (raised to twice the spread of the repeats)")
+    parser.add_argument("--output", help="Save the results as JSON")
+    args = parser.parse_args()
+    
+    results = run_benchmarks(args.only, args.sizes, args.frames, args.repeats, args.full)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'host': host_info(), 'results': results}, f, indent=2)
+    
+    if args.save_baseline:
+        baseline = {'host': host_info(), 'results': {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                previous = json.load(f)
+            # Timings of other hosts are not comparable, they are replaced
+            if previous.get('host') == baseline['host']:
+                baseline = previous
+        baseline['results'].update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) slower than baseline beyond the allowed slowdown")
+            sys.exit(1)
+    else:
+        print(f"No baseline at {args.baseline}, create one with --save-baseline")
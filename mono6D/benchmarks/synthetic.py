@@ -0,0 +1,129 @@
+import os
+import numpy as np
+import cv2
+
+# Scene description: static spheres (center, radius, BGR color) inside a room
+static_spheres = [
+    ((2.0, 0.0, 3.0), 0.8, (60, 180, 240)),
+    ((-3.0, 0.5, -1.0), 1.2, (200, 120, 60)),
+    ((0.5, -0.8, -2.5), 0.6, (90, 200, 90))
+]
+
+# Moving occluder orbiting the camera
+occluder_radius = 0.5
+occluder_orbit = 1.8
+occluder_color = (40, 40, 220)
+
+floor_height = -1.5
+ceiling_height = 2.5
+room_radius = 8.0
+
+min_distance = 0.3
+max_distance = room_radius
+
+def ray_directions(width, height):
+    """
+    Unit view directions of an equirectangular frame (x right, y up, z forward).
+    
+    Returns:
+        Array of shape (height, width, 3)
+    """
+    theta = ((np.arange(width) + 0.5) / width - 0.5) * 2 * np.pi        # azimuth
+    phi = (0.5 - (np.arange(height) + 0.5) / height) * np.pi            # elevation
+    theta, phi = np.meshgrid(theta, phi)
+    return np.stack([np.cos(phi) * np.sin(theta), np.sin(phi), np.cos(phi) * np.cos(theta)], axis=2)
+
+def intersect_sphere(directions, center, radius):
+    """Distance along each ray from the origin to a sphere, inf where missed"""
+    center = np.asarray(center, dtype=np.float64)
+    b = directions @ center
+    c = center @ center - radius * radius
+    disc = b * b - c
+    t = b - np.sqrt(np.maximum(disc, 0))
+    return np.where((disc >= 0) & (t > 0), t, np.inf)
+
+def intersect_plane(directions, height):
+    """Distance along each ray to the horizontal plane y = height, inf where missed"""
+    dy = directions[:, :, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = height / dy
+    return np.where(t > 0, t, np.inf)
+
+def render_frame(width, height, t, directions=None):
+    """
+    Render one equirectangular RGB + depth frame of the synthetic scene.
+    
+    Args:
+        width, height: Frame size (2:1)
+        t: Time in [0, 1) controlling the position of the moving occluder
+        directions: Precomputed ray_directions(width, height)
+    
+    Returns:
+        (rgb, depth): BGR uint8 frame and uint8 depth frame (white = closer)
+    """
+    if directions is None:
+        directions = ray_directions(width, height)
+    
+    # Room: far sphere, floor and ceiling
+    distance = np.full((height, width), room_radius)
+    color = np.empty((height, width, 3), dtype=np.float64)
+    color[:] = (170, 150, 130)
+    
+    hits = [(intersect_plane(directions, floor_height), None), (intersect_plane(directions, ceiling_height), (230, 230, 230))]
+    for center, radius, sphere_color in static_spheres:
+        hits.append((intersect_sphere(directions, center, radius), sphere_color))
+    
+    angle = 2 * np.pi * t
+    occluder_center = (occluder_orbit * np.sin(angle), 0.2 * np.sin(3 * angle), occluder_orbit * np.cos(angle))
+    hits.append((intersect_sphere(directions, occluder_center, occluder_radius), occluder_color))
+    
+    for hit, hit_color in hits:
+        closer = hit < distance
+        distance = np.where(closer, hit, distance)
+        if hit_color is None:
+            # Checkerboard floor
+            points = directions * np.where(np.isfinite(hit), hit, 0)[:, :, None]
+            checker = ((np.floor(points[:, :, 0]) + np.floor(points[:, :, 2])) % 2)[:, :, None]
+            floor_color = np.where(checker > 0, 200.0, 80.0)
+            color = np.where(closer[:, :, None], floor_color, color)
+        else:
+            color = np.where(closer[:, :, None], np.asarray(hit_color, dtype=np.float64), color)
+    
+    # Darken with distance so edges are visible in RGB too
+    shade = 1.0 - 0.5 * (distance - min_distance) / (max_distance - min_distance)
+    rgb = np.clip(color * shade[:, :, None], 0, 255).astype(np.uint8)
+    
+    depth = 255.0 * (1.0 - (np.clip(distance, min_distance, max_distance) - min_distance) / (max_distance - min_distance))
+    return rgb, depth.astype(np.uint8)
+
+def write_clip(folder, name, width, height, num_frames, fps=30):
+    """
+    Write a synthetic clip as {name}.mp4 and {name}_depth.mp4 into folder.
+    
+    Args:
+        folder: Output folder
+        name: Clip name
+        width, height: Frame size (2:1)
+        num_frames: Number of frames
+        fps: Frame rate
+    
+    Returns:
+        (rgb_path, depth_path)
+    """
+    os.makedirs(folder, exist_ok=True)
+    rgb_path = os.path.join(folder, f"{name}.mp4")
+    depth_path = os.path.join(folder, f"{name}_depth.mp4")
+    
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    rgb_writer = cv2.VideoWriter(rgb_path, fourcc, fps, (width, height))
+    depth_writer = cv2.VideoWriter(depth_path, fourcc, fps, (width, height))
+    
+    directions = ray_directions(width, height)
+    for frame_idx in range(num_frames):
+        rgb, depth = render_frame(width, height, frame_idx / max(num_frames, 1), directions)
+        rgb_writer.write(rgb)
+        depth_writer.write(cv2.cvtColor(depth, cv2.COLOR_GRAY2BGR))
+    
+    rgb_writer.release()
+    depth_writer.release()
+    return rgb_path, depth_path
@@ -0,0 +1,248 @@
+import os
+import glob
+import json
+import shutil
+import hashlib
+
+def hash_file(path, chunk_size=1 << 20):
+    """SHA-1 of a file's contents"""
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def hash_path(path):
+    """
+    Hash a file, a directory (recursively) or a glob pattern.
+
+    Args:
+        path: File path, directory path or glob pattern
+
+    Returns:
+        Hex digest, or None if nothing exists at path
+    """
+    if glob.has_magic(path):
+        files = sorted(glob.glob(path))
+    elif os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    elif os.path.isfile(path):
+        return hash_file(path)
+    else:
+        return None
+
+    if not files:
+        return None
+
+    sha = hashlib.sha1()
+    for file in files:
+        sha.update(os.path.basename(file).encode())
+        sha.update(hash_file(file).encode())
+    return sha.hexdigest()
+
+def params_key(params):
+    """Stable string representation of a parameter dictionary"""
+    return json.dumps(params, sort_keys=True, default=str)
+
+class Stage:
+    """
+    One checkpointed pipeline stage.
+
+    The manifest records the hashes of the inputs, the parameters and the hashes of the
+    outputs. The stage is up to date when all of them still match.
+    """
+
+    def __init__(self, manifest_path, name, inputs, outputs, params, enabled):
+        self.manifest_path = manifest_path
+        self.name = name
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params_key(params or {})
+        self.enabled = enabled
+
+    def _input_hashes(self):
+        return {path: hash_path(path) for path in self.inputs}
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_manifest(self, manifest):
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def up_to_date(self):
+        """Return True if the recorded manifest matches the current inputs, parameters and outputs"""
+        if not self.enabled:
+            return False
+
+        manifest = self._read_manifest()
+        if manifest is None:
+            return False
+
+        if manifest.get('params') != self.params:
+            return False
+        if manifest.get('inputs') != self._input_hashes():
+            return False
+
+        outputs = manifest.get('outputs', {})
+        for path in self.outputs:
+            if outputs.get(path) is None or hash_path(path) != outputs[path]:
+                return False
+
+        print(f"Stage '{self.name}' is up to date, skipping")
+        return True
+
+    def start(self):
+        """
+        Record the inputs and parameters of a stage that is about to run.
+
+        The manifest lists no outputs until record(), so an interrupted stage is never up to
+        date, but its next run can tell whether the partial outputs came from the same inputs.
+
+        Returns:
+            True if the previous run of the stage had the same inputs and parameters, so its
+            partial outputs can be resumed
+        """
+        if not self.enabled:
+            return False
+
+        manifest = self._read_manifest()
+        inputs = self._input_hashes()
+        resumable = manifest is not None and manifest.get('params') == self.params and \
+            manifest.get('inputs') == inputs
+
+        self._write_manifest({'stage': self.name, 'params': self.params, 'inputs': inputs, 'outputs': {}})
+        return resumable
+
+    def record(self):
+        """Write the manifest after the stage completed successfully"""
+        if not self.enabled:
+            return
+
+        self._write_manifest({
+            'stage': self.name,
+            'params': self.params,
+            'inputs': self._input_hashes(),
+            'outputs': {path: hash_path(path) for path in self.outputs}
+        })
+
+class CheckpointStore:
+    """Manifests of all stages of one job, stored as JSON files in a folder"""
+
+    def __init__(self, folder, enabled=True):
+        """
+        Args:
+            folder: Folder holding one manifest per stage
+            enabled: If False, stages are never skipped and nothing is recorded
+        """
+        self.folder = folder
+        self.enabled = enabled
+
+    def stage(self, name, inputs, outputs, params=None):
+        """
+        Create a checkpointed stage.
+
+        Args:
+            name: Stage name (used as manifest filename)
+            inputs: Files, folders or glob patterns read by the stage
+            outputs: Files, folders or glob patterns written by the stage
+            params: Dictionary of parameters affecting the outputs
+
+        Returns:
+            Stage object
+        """
+        manifest_path = os.path.join(self.folder, f"{name}.json")
+        return Stage(manifest_path, name, inputs, outputs, params, self.enabled)
+
+def hash_frames(*frames):
+    """SHA-1 of the decoded contents of one or more frames"""
+    sha = hashlib.sha1()
+    for frame in frames:
+        sha.update(str(frame.shape).encode())
+        sha.update(frame.tobytes())
+    return sha.hexdigest()
+
+class FrameCache:
+    """
+    Content-addressed store of per-frame outputs.
+
+    Entries are keyed by a fingerprint of the frame inputs and the parameters, so frames that
+    are unchanged after a re-cut or trim are found again regardless of their new frame index.
+    """
+
+    def __init__(self, folder, params=None):
+        """
+        Args:
+            folder: Cache folder (kept across runs)
+            params: Dictionary of parameters affecting the cached outputs
+        """
+        self.folder = folder
+        self.params = params_key(params or {})
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, fingerprint):
+        """Cache key of a frame fingerprint under the current parameters"""
+        return hashlib.sha1((fingerprint + self.params).encode()).hexdigest()
+
+    def path(self, key, name):
+        """Path of a cached file of an entry"""
+        return os.path.join(self.folder, key[:2], key, name)
+
+    def load(self, key, names, destinations):
+        """
+        Copy the cached files of an entry to their destinations.
+
+        Returns:
+            True if all files were cached, False otherwise (nothing is copied)
+        """
+        sources = [self.path(key, name) for name in names]
+        if not all(os.path.exists(source) for source in sources):
+            self.misses += 1
+            return False
+
+        for source, destination in zip(sources, destinations):
+            shutil.copyfile(source, destination)
+        self.hits += 1
+        return True
+
+    def store(self, key, names, sources):
+        """Copy freshly computed files into the cache entry"""
+        for name, source in zip(names, sources):
+            path = self.path(key, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + '.tmp'
+            shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, path)
+
+    def load_image(self, key, name):
+        """Cached image of an entry, or None if it is not cached"""
+        import cv2
+        path = self.path(key, name)
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED) if os.path.exists(path) else None
+        if image is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return image
+
+    def store_image(self, key, name, image):
+        """Store an image (use a lossless format such as PNG) in the cache entry"""
+        import cv2
+        path = self.path(key, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        root, ext = os.path.splitext(path)
+        tmp_path = f"{root}.tmp{ext}"
+        cv2.imwrite(tmp_path, image)
+        os.replace(tmp_path, path)
+
+    def report(self, label):
+        """Print the number of reused and recomputed frames"""
+        print(f"{label}: reused {self.hits} cached frames, recomputed {self.misses}")
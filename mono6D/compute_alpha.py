@@ -3,8 +3,15 @@ import cv2
 import numpy as np
 from scipy import ndimage
 from cubic2equi import cubic2equi
+from video_io import open_video_writer
+from telemetry import telemetry
+from checkpoint import hash_file
+from intermediates import faces_path, count_face_frames, read_faces
 
-def compute_transparency_values(folder, filename_in):
+# Alpha formats the web viewer can load, it only plays the alpha video ({filename}_alphaproc.mp4)
+viewer_alpha_formats = ('bgr', 'gray')
+
+def compute_transparency_values(folder, filename_in, alpha_format='bgr', frame_cache=None):
     """
     Compute transparency values from triangle orientations and save as a viewable video.
     Following the paper:
@@ -15,19 +22,19 @@ def compute_transparency_values(folder, filename_in):
     Args:
         folder: Path to the triangle orientations folder
         filename_in: Base name of the input file
+        alpha_format: 'bgr' (3-channel video), 'gray' (single-channel video) or
+            'png' (lossless single-channel PNG per frame)
+        frame_cache: checkpoint.FrameCache; frames whose six orientation faces were
+            processed before reuse the cached alpha frame
     """
-    # Get all jpg files in the folder
-    files = [f for f in os.listdir(folder) if f.endswith('.jpg')]
-    num_frames = len(files) // 6
-    
-    print(f"Found {len(files)} jpg files in folder, processing {num_frames} frames")
+    # One file of stacked faces per frame
+    num_frames = count_face_frames(folder)
     
-    # Create output video file path
-    output_path = os.path.join(folder, f"{filename_in}_alphaproc.mp4")
-    print(f"Will create video at: {output_path}")
+    print(f"Found {num_frames} frames of orientation faces in folder")
     
-    # Initialize VideoWriter with H.264 codec (more compatible)
-    fourcc = cv2.VideoWriter_fourcc(*'avc1')
+    # Create output path (video file, or frame folder for PNG output)
+    output_path = alpha_output_path(folder, filename_in, alpha_format)
+    print(f"Will create alpha output at: {output_path}")
     
     # Process the first frame to determine dimensions
     print("Processing first frame to determine dimensions")
@@ -40,36 +47,167 @@ def compute_transparency_values(folder, filename_in):
     print(f"Equirectangular output dimensions: {width}x{height}")
     
     # Initialize video writer
-    alpha_video = cv2.VideoWriter(output_path, fourcc, 30, (width, height))
+    grayscale = alpha_format != 'bgr'
+    if alpha_format == 'png':
+        os.makedirs(output_path, exist_ok=True)
+        alpha_video = None
+    else:
+        # H.264 codec (more compatible) with mp4v fallback for the OpenCV backend
+        alpha_video = open_video_writer(output_path, 30, (width, height), is_color=not grayscale,
+                                        fourccs=['avc1', 'mp4v'])
+        if alpha_video is None:
+            print(f"Error: Could not create video writer for {output_path}")
+            return
+    
+    # Reusable processor, buffers are allocated once for the whole video
+    alpha_processor = AlphaProcessor(height, width, grayscale=grayscale)
     
     # Process and write the first frame
-    alpha_frame = process_alpha_map(equi_orientation)
-    alpha_video.write(alpha_frame)
+    with telemetry.span("alpha_frame", "frame", frame=0):
+        alpha_frame = compute_alpha_frame(folder, filename_in, 0, alpha_processor, frame_cache, equi_orientation)
+        write_alpha_frame(alpha_video, output_path, 0, alpha_frame)
     
     # Process remaining frames
     for f in range(1, num_frames):
         print(f"Processing frame {f}/{num_frames-1}")
         
-        # Process frame
-        equi_orientation = process_frame_orientations(folder, filename_in, f)
-        
-        # Create alpha map
-        alpha_frame = process_alpha_map(equi_orientation)
-        
-        # Write frame
-        alpha_video.write(alpha_frame)
+        with telemetry.span("alpha_frame", "frame", frame=f):
+            # Create alpha map
+            alpha_frame = compute_alpha_frame(folder, filename_in, f, alpha_processor, frame_cache)
+            
+            # Write frame
+            write_alpha_frame(alpha_video, output_path, f, alpha_frame)
     
     # Release video writer
-    alpha_video.release()
-    print(f"Finished processing. Video saved to {output_path}")
+    if alpha_video is not None:
+        alpha_video.release()
+    if frame_cache is not None:
+        frame_cache.report("Transparency values")
+    print(f"Finished processing. Alpha saved to {output_path}")
     
     # Check if output file was created and has content
-    if os.path.exists(output_path):
+    if os.path.isfile(output_path):
         print(f"Output file exists: {output_path}")
         print(f"Output file size: {os.path.getsize(output_path)} bytes")
+    elif os.path.isdir(output_path):
+        print(f"Output folder exists: {output_path} ({len(os.listdir(output_path))} frames)")
     else:
         print(f"Output file does not exist: {output_path}")
 
+def compute_alpha_frame(folder, filename, frame_idx, alpha_processor, frame_cache=None, equi_orientation=None):
+    """
+    Alpha frame of one frame of orientation faces, reused from frame_cache when the faces are unchanged.
+    
+    Args:
+        folder: Path to the folder containing orientation maps
+        filename: Base filename
+        frame_idx: Frame index
+        alpha_processor: AlphaProcessor used for frames that are not cached
+        frame_cache: checkpoint.FrameCache, or None
+        equi_orientation: Equirectangular orientation map if already computed
+    
+    Returns:
+        Alpha frame
+    """
+    key = None
+    if frame_cache is not None:
+        face_file = faces_path(folder, filename, frame_idx)
+        if os.path.exists(face_file):
+            key = frame_cache.key(hash_file(face_file))
+            alpha_frame = frame_cache.load_image(key, 'alpha.png')
+            if alpha_frame is not None:
+                return alpha_frame
+    
+    if equi_orientation is None:
+        equi_orientation = process_frame_orientations(folder, filename, frame_idx)
+    alpha_frame = alpha_processor.process(equi_orientation)
+    
+    if key is not None:
+        frame_cache.store_image(key, 'alpha.png', alpha_frame)
+    
+    return alpha_frame
+
+def alpha_output_path(folder, filename, alpha_format='bgr'):
+    """
+    Path of the processed alpha output.
+    
+    Args:
+        folder: Folder containing the alpha output
+        filename: Base filename
+        alpha_format: 'bgr', 'gray' or 'png'
+        
+    Returns:
+        Path to the alpha video, or to the folder of PNG frames for 'png'
+    """
+    if alpha_format == 'png':
+        return os.path.join(folder, f"{filename}_alphaproc")
+    return os.path.join(folder, f"{filename}_alphaproc.mp4")
+
+def check_viewer_alpha_format(alpha_format):
+    """
+    Check that the viewer can load the alpha output.
+    
+    'png' frames stay a lossless intermediate of compute_transparency_values, the viewer
+    (web_viewer/src/main.js) only loads the alpha video.
+    
+    Args:
+        alpha_format: 'bgr', 'gray' or 'png'
+    
+    Raises:
+        ValueError: If the alpha format cannot be exported to the viewer
+    """
+    if alpha_format not in viewer_alpha_formats:
+        raise ValueError(f"Alpha format '{alpha_format}' cannot be loaded by the viewer, "
+                         f"use one of {', '.join(viewer_alpha_formats)}")
+
+def write_alpha_frame(alpha_video, output_path, frame_idx, alpha_frame):
+    """
+    Write an alpha frame to the video writer, or as a lossless PNG when there is no writer.
+    
+    Args:
+        alpha_video: cv2.VideoWriter, or None for PNG output
+        output_path: Folder for the PNG frames (unused with a video writer)
+        frame_idx: Frame index
+        alpha_frame: Alpha frame (BGR or single-channel)
+    """
+    if alpha_video is not None:
+        alpha_video.write(alpha_frame)
+    else:
+        cv2.imwrite(os.path.join(output_path, f"alpha_{frame_idx:04d}.png"), alpha_frame)
+
+def read_alpha_frame(folder, filename, alpha_format='bgr', frame_idx=0):
+    """
+    Read back one frame of the processed alpha output.
+    
+    Args:
+        folder: Folder containing the alpha output
+        filename: Base filename
+        alpha_format: 'bgr', 'gray' or 'png'
+        frame_idx: Frame index
+        
+    Returns:
+        Alpha frame (BGR for 'bgr', single-channel otherwise), or None if it could not be read
+    """
+    output_path = alpha_output_path(folder, filename, alpha_format)
+    
+    if alpha_format == 'png':
+        return cv2.imread(os.path.join(output_path, f"alpha_{frame_idx:04d}.png"), cv2.IMREAD_GRAYSCALE)
+    
+    alpha_video = cv2.VideoCapture(output_path)
+    if frame_idx > 0:
+        alpha_video.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+    ret, alpha_frame = alpha_video.read()
+    alpha_video.release()
+    
+    if not ret:
+        return None
+    
+    # Decoders return 3 channels even for gray videos
+    if alpha_format == 'gray' and len(alpha_frame.shape) == 3:
+        alpha_frame = cv2.cvtColor(alpha_frame, cv2.COLOR_BGR2GRAY)
+    
+    return alpha_frame
+
 def process_frame_orientations(folder, filename, frame_idx):
     """
     Process a single frame by reading and combining all 6 cube faces.
@@ -80,51 +218,38 @@ def process_frame_orientations(folder, filename, frame_idx):
         frame_idx: Frame index
     
     Returns:
-        Equirectangular orientation map
+        Equirectangular orientation map (uint16)
     """
-    bname = os.path.join(folder, f"{filename}_frame_{frame_idx:04d}")
+    face_file = faces_path(folder, filename, frame_idx)
     
     # Check if files exist
-    face_files = [f"{bname}_face_{i}.jpg" for i in range(6)]
-    for face_file in face_files:
-        if not os.path.exists(face_file):
-            print(f"WARNING: File does not exist: {face_file}")
+    if not os.path.exists(face_file):
+        print(f"WARNING: File does not exist: {face_file}")
     
     # Load and prepare cube faces
     try:
-        # Load and rotate faces according to equirectangular projection requirements
-        bottom = cv2.rotate(cv2.imread(f"{bname}_face_3.jpg", cv2.IMREAD_GRAYSCALE), cv2.ROTATE_90_CLOCKWISE)
-        top = cv2.rotate(cv2.imread(f"{bname}_face_2.jpg", cv2.IMREAD_GRAYSCALE), cv2.ROTATE_90_COUNTERCLOCKWISE)
-        left = cv2.imread(f"{bname}_face_1.jpg", cv2.IMREAD_GRAYSCALE)
-        back = cv2.imread(f"{bname}_face_5.jpg", cv2.IMREAD_GRAYSCALE)
-        right = cv2.imread(f"{bname}_face_0.jpg", cv2.IMREAD_GRAYSCALE)
-        front = cv2.imread(f"{bname}_face_4.jpg", cv2.IMREAD_GRAYSCALE)
-        
-        # Convert to 3-channel for cubic2equi function
-        bottom3 = cv2.cvtColor(bottom, cv2.COLOR_GRAY2BGR)
-        top3 = cv2.cvtColor(top, cv2.COLOR_GRAY2BGR)
-        left3 = cv2.cvtColor(left, cv2.COLOR_GRAY2BGR)
-        back3 = cv2.cvtColor(back, cv2.COLOR_GRAY2BGR)
-        right3 = cv2.cvtColor(right, cv2.COLOR_GRAY2BGR)
-        front3 = cv2.cvtColor(front, cv2.COLOR_GRAY2BGR)
-        
-        # Convert to equirectangular projection
-        out = cubic2equi(top3, bottom3, left3, right3, front3, back3)
-        
-        # Extract grayscale channel and flip vertically if needed
-        out_gray = cv2.cvtColor(out, cv2.COLOR_BGR2GRAY)
+        # Memory-mapped float16 faces [right, left, top, bottom, front, back]
+        faces = read_faces(face_file)
+        
+        # Rotate faces according to equirectangular projection requirements
+        bottom = cv2.rotate(faces[3], cv2.ROTATE_90_CLOCKWISE)
+        top = cv2.rotate(faces[2], cv2.ROTATE_90_COUNTERCLOCKWISE)
+        left, back, right, front = faces[1], faces[5], faces[0], faces[4]
+        
+        # Convert to equirectangular projection (single channel, float16)
+        out = cubic2equi(top, bottom, left, right, front, back)[:, :, 0]
         
         # Resize to standard dimensions (2048x1024)
-        out_resized = cv2.resize(out_gray, (2048, 1024))
+        out_resized = cv2.resize(out.astype(np.float32), (2048, 1024))
         
-        return out_resized
+        return np.round(np.clip(out_resized, 0, 1) * 65535).astype(np.uint16)
         
     except Exception as e:
         print(f"Error processing frame orientations: {e}")
         # Return a blank image as fallback
-        return np.zeros((1024, 2048), dtype=np.uint8)
+        return np.zeros((1024, 2048), dtype=np.uint16)
 
-def process_alpha_map(orientation_map):
+def process_alpha_map(orientation_map, grayscale=False):
     """
     Process an orientation map to create an alpha (transparency) map.
     
@@ -135,13 +260,16 @@ def process_alpha_map(orientation_map):
     We want to make edges/boundaries more transparent in the final alpha map.
     
     Args:
-        orientation_map: The orientation map (grayscale)
+        orientation_map: The orientation map (grayscale, uint8, uint16 or float in [0, 1])
+        grayscale: Return a single-channel image instead of BGR
         
     Returns:
-        BGR image with alpha values
+        BGR (or single-channel) image with alpha values
     """
     # Normalize to 0-1
-    input_map = orientation_map.astype(np.float32) / 255.0
+    input_map = orientation_map.astype(np.float32)
+    if np.issubdtype(orientation_map.dtype, np.integer):
+        input_map /= np.iinfo(orientation_map.dtype).max
     
     # The orientation map now correctly represents the angle between face normals and view direction
     # - Values close to 1 (bright) = face normal parallel to view direction (center of faces)
@@ -182,7 +310,108 @@ def process_alpha_map(orientation_map):
     # 0 (black) = fully transparent
     alpha_map = 1 - sigmoid
     
+    if grayscale:
+        return (alpha_map * 255).astype(np.uint8)
+    
     # Create a 3-channel BGR image
     alpha_bgr = np.stack([alpha_map, alpha_map, alpha_map], axis=2) * 255
     
-    return alpha_bgr.astype(np.uint8)
\ No newline at end of file
+    return alpha_bgr.astype(np.uint8)
+
+class AlphaProcessor:
+    """
+    Allocation-free version of process_alpha_map for processing many frames of the same size.
+    
+    All intermediate buffers are allocated once. The morphology and thresholding run on
+    the input data (uint8 or uint16), the blur runs on 16-bit data and the sigmoid is applied
+    as a lookup table, so the output matches process_alpha_map within +-1.
+    
+    The returned frame is an internal buffer that is overwritten by the next call.
+    """
+    
+    def __init__(self, height, width, threshold=0.3, c=0.5, k=8.0, grayscale=False):
+        """
+        Args:
+            height, width: Size of the orientation maps
+            threshold: Threshold applied after the opening (in [0, 1])
+            c: Midpoint of the logistic function
+            k: Steepness of the logistic function
+            grayscale: Return single-channel frames instead of BGR
+        """
+        self.shape = (height, width)
+        self.grayscale = grayscale
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        
+        # Scale from the 8-bit to the 16-bit range (255 * 257 = 65535)
+        self.widen_factor = np.uint16(257)
+        
+        # Values strictly above threshold are kept, as in process_alpha_map
+        self.threshold_u8 = int(np.floor(threshold * 255))
+        self.threshold_u16 = int(np.floor(threshold * 65535))
+        
+        # Preallocated buffers
+        self.inverted = np.empty(self.shape, dtype=np.uint8)
+        self.opened = np.empty(self.shape, dtype=np.uint8)
+        self.thresholded = np.empty(self.shape, dtype=np.uint8)
+        self.inverted16 = np.empty(self.shape, dtype=np.uint16)
+        self.opened16 = np.empty(self.shape, dtype=np.uint16)
+        self.widened = np.empty(self.shape, dtype=np.uint16)
+        self.smoothed = np.empty(self.shape, dtype=np.uint16)
+        self.indices = np.empty(self.shape, dtype=np.intp)
+        self.alpha = np.empty(self.shape, dtype=np.uint8)
+        self.alpha_bgr = None if grayscale else np.empty(self.shape + (3,), dtype=np.uint8)
+        
+        # Inverted logistic function sampled on the 16-bit range.
+        # An 8-bit blur output is too coarse for the steep sigmoid (errors up to +-2),
+        # so the table covers all 65536 levels of the 16-bit blur.
+        levels = np.arange(65536, dtype=np.float32) / 65535.0
+        sigmoid = 1.0 / (1.0 + np.exp(-k * (levels - c)))
+        self.lut = ((1 - sigmoid) * 255).astype(np.uint8)
+    
+    def process(self, orientation_map):
+        """
+        Process an orientation map to create an alpha (transparency) map.
+        
+        Args:
+            orientation_map: The orientation map (grayscale, uint8 or uint16)
+            
+        Returns:
+            BGR (or single-channel) image with alpha values
+        """
+        if orientation_map.dtype not in (np.uint8, np.uint16) or orientation_map.shape != self.shape:
+            return process_alpha_map(orientation_map, self.grayscale)
+        
+        if orientation_map.dtype == np.uint16:
+            # 1.-3. on the 16-bit map directly, the thresholded map is already in the blur range
+            cv2.bitwise_not(orientation_map, dst=self.inverted16)
+            cv2.morphologyEx(self.inverted16, cv2.MORPH_OPEN, self.kernel, dst=self.opened16)
+            cv2.threshold(self.opened16, self.threshold_u16, 0, cv2.THRESH_TOZERO, dst=self.widened)
+        else:
+            # 1. Invert (255 - x on uint8 is exact)
+            cv2.bitwise_not(orientation_map, dst=self.inverted)
+            
+            # 2. Erode then dilate
+            cv2.morphologyEx(self.inverted, cv2.MORPH_OPEN, self.kernel, dst=self.opened)
+            
+            # 3. Thresholding
+            cv2.threshold(self.opened, self.threshold_u8, 0, cv2.THRESH_TOZERO, dst=self.thresholded)
+            
+            # Widen to 16-bit data (x * 257 maps 255 to 65535)
+            np.copyto(self.widened, self.thresholded)
+            np.multiply(self.widened, self.widen_factor, out=self.widened)
+        
+        # 4. Gaussian blur on 16-bit data
+        cv2.GaussianBlur(self.widened, (7, 7), 11, dst=self.smoothed)
+        
+        # 5. Inverted logistic function as a lookup (np.take needs intp indices,
+        # copying into a preallocated buffer avoids a temporary conversion)
+        np.copyto(self.indices, self.smoothed)
+        np.take(self.lut, self.indices, out=self.alpha, mode='clip')
+        
+        if self.grayscale:
+            return self.alpha
+        
+        # Create a 3-channel BGR image
+        cv2.cvtColor(self.alpha, cv2.COLOR_GRAY2BGR, dst=self.alpha_bgr)
+        
+        return self.alpha_bgr
@@ -1,19 +1,34 @@
 import numpy as np
 import cv2
 
-def cubic2equi(top, bottom, left, right, front, back):
+# Projection parameters
+projection_params = {
+    'backend': 'reference'    # 'reference' (per-face masks on every call) or 'fast' (cached lookup table)
+}
+
+# face_size -> (face index, row, column) lookup of every equirectangular pixel
+_lookup_cache = {}
+
+def cubic2equi(top, bottom, left, right, front, back, backend=None):
     """
     Convert cubemap images to equirectangular projection.
     
     Args:
         top, bottom, left, right, front, back: Face images from a cubemap
+        backend: 'fast' or 'reference' (default: projection_params['backend'])
         
     Returns:
-        Equirectangular projected image
+        Equirectangular projected image (same dtype as the faces)
     """
     # Ensure all faces have the same dimensions
     assert top.shape == bottom.shape == left.shape == right.shape == front.shape == back.shape
     
+    if backend is None:
+        backend = projection_params['backend']
+    
+    if backend == 'fast':
+        return cubic2equi_fast(top, bottom, left, right, front, back)
+    
     # Get the face size
     face_size = top.shape[0]
     
@@ -24,10 +39,10 @@ def cubic2equi(top, bottom, left, right, front, back):
     # Add channel dimension if grayscale
     if len(top.shape) == 2:
         channels = 1
-        equi = np.zeros((equi_height, equi_width, 1), dtype=np.uint8)
+        equi = np.zeros((equi_height, equi_width, 1), dtype=top.dtype)
     else:
         channels = top.shape[2]
-        equi = np.zeros((equi_height, equi_width, channels), dtype=np.uint8)
+        equi = np.zeros((equi_height, equi_width, channels), dtype=top.dtype)
     
     # Create meshgrid for equirectangular coordinates
     x = np.linspace(0, 2*np.pi, equi_width)
@@ -101,4 +116,76 @@ def cubic2equi(top, bottom, left, right, front, back):
     for c in range(channels):
         equi[mask, c] = bottom[v[mask].astype(np.int32), u[mask].astype(np.int32)] if channels == 1 else bottom[v[mask].astype(np.int32), u[mask].astype(np.int32), c]
     
-    return equi
\ No newline at end of file
+    return equi
+
+def equi_lookup(face_size):
+    """
+    Source face and pixel of every equirectangular pixel, as computed by the reference path.
+    
+    Args:
+        face_size: Size of the cube faces
+        
+    Returns:
+        (face, row, column) integer arrays of shape (face_size, 2 * face_size), face indices
+        follow the argument order of cubic2equi
+    """
+    if face_size in _lookup_cache:
+        return _lookup_cache[face_size]
+    
+    equi_height = face_size
+    equi_width = 2 * face_size
+    
+    x = np.linspace(0, 2*np.pi, equi_width)
+    y = np.linspace(-np.pi/2, np.pi/2, equi_height)
+    xv, yv = np.meshgrid(x, y)
+    
+    x = np.cos(yv) * np.cos(xv)
+    y = np.sin(yv)
+    z = np.cos(yv) * np.sin(xv)
+    
+    abs_x, abs_y, abs_z = np.abs(x), np.abs(y), np.abs(z)
+    max_xyz = np.maximum(np.maximum(abs_x, abs_y), abs_z)
+    
+    face = np.zeros(x.shape, dtype=np.intp)
+    row = np.zeros(x.shape, dtype=np.intp)
+    col = np.zeros(x.shape, dtype=np.intp)
+    
+    # Same order as the reference path, later faces overwrite earlier ones on ties.
+    # Each entry: face index (top, bottom, left, right, front, back), mask, u, v
+    with np.errstate(divide='ignore', invalid='ignore'):
+        projections = [
+            (4, z == max_xyz, -x / z, -y / z),
+            (5, -z == max_xyz, x / (-z), -y / (-z)),
+            (2, -x == max_xyz, z / (-x), -y / (-x)),
+            (3, x == max_xyz, -z / x, -y / x),
+            (0, y == max_xyz, -x / y, -z / y),
+            (1, -y == max_xyz, -x / (-y), z / (-y))
+        ]
+    
+    for face_idx, mask, u, v in projections:
+        face[mask] = face_idx
+        col[mask] = ((u[mask] + 1) * 0.5 * (face_size - 1)).astype(np.int32)
+        row[mask] = ((v[mask] + 1) * 0.5 * (face_size - 1)).astype(np.int32)
+    
+    _lookup_cache[face_size] = (face, row, col)
+    return face, row, col
+
+def cubic2equi_fast(top, bottom, left, right, front, back):
+    """
+    cubic2equi with the projection computed once per face size and reused.
+    
+    Args:
+        top, bottom, left, right, front, back: Face images from a cubemap
+        
+    Returns:
+        Equirectangular projected image
+    """
+    face, row, col = equi_lookup(top.shape[0])
+    
+    faces = np.stack([top, bottom, left, right, front, back])
+    equi = faces[face, row, col]
+    
+    if equi.ndim == 2:
+        equi = equi[:, :, None]
+    
+    return equi
@@ -0,0 +1,305 @@
+import os
+import queue
+import numpy as np
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+
+from video_io import open_video_writer
+from telemetry import telemetry
+
+# Depth generation parameters. There is no default network: models/deploy.prototxt defines
+# the HED edge detector, which predicts edge probabilities and cannot produce depth (and
+# OpenCV 5 no longer reads Caffe models). A monocular depth network, e.g. ONNX, must be set.
+generation_params = {
+    'weights': None,           # depth network readable by cv2.dnn (.onnx, ...)
+    'config': '',              # separate network definition, for formats that need one
+    'output_layer': None,      # output blob (default: the last layer)
+    'tile_size': 500,          # network input size, frames are cut into tile_size x tile_size crops
+    'overlap': 100,            # minimum overlap of neighbouring crops, blended with linear ramps
+    'frame_height': None,      # working height of the frames (default: the input height)
+    'batch_size': 4,           # crops per forward pass
+    'workers': 2,              # threads running forward passes, each with its own network
+    'chunk_frames': 4,         # frames whose crops are batched together
+    'mean': (0, 0, 0),         # BGR mean subtracted from the crops
+    'scale': 1 / 255,          # scale applied after mean subtraction
+    'swap_rb': True,           # feed RGB instead of BGR
+    'invert': False,           # network predicts distance (far = high) instead of closeness
+    'normalize': True          # stretch every frame to the full 8-bit range
+}
+
+def depth_video_path(filename):
+    """Path of the input depth video of a clip"""
+    return f"_input_videos/{filename}_depth.mp4"
+
+def load_network(params=None):
+    """
+    Load the depth network for CPU inference.
+    
+    Args:
+        params: Generation parameters (default: generation_params)
+    
+    Returns:
+        cv2.dnn.Net
+    """
+    if params is None:
+        params = generation_params
+    
+    weights = params['weights']
+    if weights is None:
+        raise ValueError("No depth network set: provide an input depth video or a depth model "
+                         "(e.g. ONNX) with --depth-model")
+    if not os.path.exists(weights):
+        raise FileNotFoundError(f"Depth network weights not found: {weights} "
+                                f"(provide an input depth video or set the weights with --depth-model)")
+    
+    net = cv2.dnn.readNet(weights, params['config'] or '')
+    net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+    net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+    return net
+
+def tile_origins(length, tile, overlap, wrap=False):
+    """
+    Start positions of crops covering length pixels.
+    
+    Args:
+        length: Image size along the axis
+        tile: Crop size
+        overlap: Minimum overlap of neighbouring crops
+        wrap: The axis is periodic (longitude of an equirectangular frame), the last
+            crop wraps around and overlaps the first one
+    
+    Returns:
+        List of start positions
+    """
+    stride = tile - overlap
+    if wrap:
+        count = max(1, int(np.ceil(length / stride)))
+        return [int(round(i * length / count)) for i in range(count)]
+    
+    if length <= tile:
+        return [0]
+    count = int(np.ceil((length - overlap) / stride))
+    return [int(round(o)) for o in np.linspace(0, length - tile, count)]
+
+def feather_weights(tile, overlap):
+    """Blending weights of a crop: linear ramps over the overlap towards every border"""
+    ramp = np.minimum(np.arange(1, tile + 1), np.arange(tile, 0, -1)) / (overlap + 1)
+    ramp = np.minimum(ramp, 1.0).astype(np.float32)
+    return ramp[:, None] * ramp[None, :]
+
+def split_tiles(image, tile, overlap):
+    """
+    Cut an equirectangular frame into overlapping crops, wrapping around in longitude.
+    
+    Args:
+        image: BGR frame
+        tile: Crop size
+        overlap: Minimum overlap of neighbouring crops
+    
+    Returns:
+        (tiles, layout): list of tile x tile crops and the layout needed by stitch_tiles
+    """
+    height, width = image.shape[:2]
+    
+    # Frames lower than a crop are padded by reflection, the padding is dropped when stitching
+    if height < tile:
+        image = cv2.copyMakeBorder(image, 0, tile - height, 0, 0, cv2.BORDER_REFLECT)
+    
+    rows = tile_origins(image.shape[0], tile, overlap)
+    cols = tile_origins(width, tile, overlap, wrap=True)
+    
+    tiles = []
+    for y in rows:
+        band = image[y:y + tile]
+        for x in cols:
+            tiles.append(np.take(band, np.arange(x, x + tile), axis=1, mode='wrap'))
+    
+    return tiles, (rows, cols, image.shape[0], height, width)
+
+def stitch_tiles(predictions, layout, weights):
+    """
+    Blend per-crop predictions back into one equirectangular map.
+    
+    Args:
+        predictions: List of tile x tile float maps in the order of split_tiles
+        layout: Layout returned by split_tiles
+        weights: Blending weights of a crop (see feather_weights)
+    
+    Returns:
+        float32 map of the frame size
+    """
+    rows, cols, padded_height, height, width = layout
+    tile = weights.shape[0]
+    
+    # Accumulate on a canvas extended to the right, then fold the wrapped part back
+    accum = np.zeros((padded_height, width + tile), dtype=np.float32)
+    total = np.zeros((padded_height, width + tile), dtype=np.float32)
+    
+    predictions = iter(predictions)
+    for y in rows:
+        for x in cols:
+            accum[y:y + tile, x:x + tile] += next(predictions) * weights
+            total[y:y + tile, x:x + tile] += weights
+    
+    result = accum[:, :width].copy()
+    result_total = total[:, :width].copy()
+    for start in range(width, width + tile, width):
+        end = min(start + width, width + tile)
+        result[:, :end - start] += accum[:, start:end]
+        result_total[:, :end - start] += total[:, start:end]
+    
+    return (result / result_total)[:height]
+
+def infer_tiles(net, tiles, params=None):
+    """
+    Run one batched forward pass.
+    
+    Args:
+        net: cv2.dnn.Net (not shared between threads)
+        tiles: List of BGR crops of the same size
+        params: Generation parameters (default: generation_params)
+    
+    Returns:
+        List of float32 predictions of the crop size
+    """
+    if params is None:
+        params = generation_params
+    
+    tile = tiles[0].shape[0]
+    blob = cv2.dnn.blobFromImages(tiles, params['scale'], (tile, tile), params['mean'],
+                                  swapRB=params['swap_rb'], crop=False)
+    net.setInput(blob)
+    if params['output_layer'] is None:
+        output = net.forward()
+    else:
+        output = net.forward(params['output_layer'])
+    
+    # (N, 1, H, W) or (N, H, W) depending on the network
+    output = output.reshape(len(tiles), -1, output.shape[-2], output.shape[-1])[:, 0]
+    
+    predictions = []
+    for prediction in output:
+        if prediction.shape != (tile, tile):
+            prediction = cv2.resize(prediction, (tile, tile), interpolation=cv2.INTER_LINEAR)
+        predictions.append(prediction.astype(np.float32))
+    return predictions
+
+def prediction_to_depth(prediction, params=None):
+    """Convert a stitched prediction to an 8-bit depth frame (white = close)"""
+    if params is None:
+        params = generation_params
+    
+    if params['normalize']:
+        low, high = float(prediction.min()), float(prediction.max())
+        prediction = (prediction - low) / max(high - low, 1e-6)
+    if params['invert']:
+        prediction = 1.0 - prediction
+    return np.round(np.clip(prediction, 0, 1) * 255).astype(np.uint8)
+
+def generate_depth(filename, params=None):
+    """
+    Step 0: estimate a depth video for a clip that comes without one.
+    
+    Every equirectangular frame is cut into overlapping crops (wrapping around in
+    longitude), the crops of several frames are batched into forward passes that run
+    on a thread pool with one network per thread, and the predictions are blended back
+    with linear ramps over the overlaps.
+    
+    Args:
+        filename: Base filename, reads _input_videos/{filename}.mp4
+        params: Generation parameters (default: generation_params)
+    
+    Returns:
+        Path of the written depth video (_input_videos/{filename}_depth.mp4)
+    """
+    if params is None:
+        params = generation_params
+    
+    workers = max(1, params['workers'])
+    tile = params['tile_size']
+    overlap = params['overlap']
+    
+    # One network per thread, cv2.dnn.Net is not thread-safe. Loading them up front fails fast.
+    nets = queue.Queue()
+    for _ in range(workers):
+        nets.put(load_network(params))
+    
+    def run_batch(batch):
+        net = nets.get()
+        try:
+            return infer_tiles(net, batch, params)
+        finally:
+            nets.put(net)
+    
+    video = cv2.VideoCapture(f"_input_videos/{filename}.mp4")
+    if not video.isOpened():
+        raise ValueError(f"Could not open input video: _input_videos/{filename}.mp4")
+    
+    fps = video.get(cv2.CAP_PROP_FPS) or 30
+    width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    
+    # Working resolution of the network
+    work_height = params['frame_height'] or height
+    work_width = int(round(width * work_height / height))
+    weights = feather_weights(tile, overlap)
+    
+    # Written under a temporary name, so an interrupted run does not leave a depth video behind
+    output_path = depth_video_path(filename)
+    tmp_path = output_path[:-len('.mp4')] + '.tmp.mp4'
+    writer = open_video_writer(tmp_path, fps, (width, height), fourccs=['avc1', 'mp4v'])
+    if writer is None:
+        video.release()
+        raise ValueError(f"Could not create video writer for {output_path}")
+    
+    # Split the CPU threads between the concurrent forward passes
+    num_threads = cv2.getNumThreads()
+    cv2.setNumThreads(max(1, (os.cpu_count() or 1) // workers))
+    
+    num_frames = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            finished = False
+            while not finished:
+                frames = []
+                while len(frames) < params['chunk_frames']:
+                    ret, frame = video.read()
+                    if not ret:
+                        finished = True
+                        break
+                    if (work_width, work_height) != (width, height):
+                        frame = cv2.resize(frame, (work_width, work_height), interpolation=cv2.INTER_AREA)
+                    frames.append(frame)
+                if not frames:
+                    break
+                
+                with telemetry.span("depth_generation_frames", "frame", frame=num_frames, frames=len(frames)):
+                    # Crops of all frames in the chunk, batched across frame boundaries
+                    tiles, layouts = [], []
+                    for frame in frames:
+                        frame_tiles, layout = split_tiles(frame, tile, overlap)
+                        tiles.extend(frame_tiles)
+                        layouts.append((len(frame_tiles), layout))
+                    
+                    batches = [tiles[i:i + params['batch_size']] for i in range(0, len(tiles), params['batch_size'])]
+                    predictions = [p for batch in executor.map(run_batch, batches) for p in batch]
+                    
+                    start = 0
+                    for count, layout in layouts:
+                        depth = prediction_to_depth(stitch_tiles(predictions[start:start + count], layout, weights),
+                                                    params)
+                        start += count
+                        if depth.shape != (height, width):
+                            depth = cv2.resize(depth, (width, height), interpolation=cv2.INTER_LINEAR)
+                        writer.write(cv2.cvtColor(depth, cv2.COLOR_GRAY2BGR))
+                
+                num_frames += len(frames)
+                print(f"Generated depth for {num_frames} frames")
+    finally:
+        cv2.setNumThreads(num_threads)
+        writer.release()
+        video.release()
+    
+    os.replace(tmp_path, output_path)
+    print(f"Depth video saved to {output_path}")
+    return output_path
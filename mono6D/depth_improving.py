@@ -1,9 +1,20 @@
 import os
+import glob
+import inspect
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import cv2
-from scipy.ndimage import median_filter
+from scipy.ndimage import gaussian_filter
 from scipy.sparse import diags
 from scipy.sparse.linalg import bicgstab, cg
+from video_io import open_video_writer, open_frame_reader
+from checkpoint import params_key, hash_frames
+from telemetry import telemetry
+from thread_limits import child_process_env
+from latitude_grid import latitude_grid
+from mesh_orientation import equirectangular_to_cubemap_fast, cubemap_to_equirectangular
 
 # Add necessary paths
 import sys
@@ -37,23 +48,48 @@ params = {
     'tol': 1e-6,
     'maxiter': 30,
     'solver': 'bicgstab',
+    'precision': 'float32',  # dtype of the weights, system matrix, right-hand side and solver ('float64' to validate)
+    'solve_grid': 'equirect',  # 'equirect' (every pixel) or 'latitude' (rows of width * cos(latitude) samples)
+    'latitude_min_width': 16,  # minimum samples per row of the latitude grid
+    'latitude_full_band': 30,  # rows within +-this many degrees of the equator keep every pixel
+    'solve_domain': 'equirect',  # 'equirect' (solve_grid of the frame) or 'cubemap' (six cube faces solved in parallel)
+    'cube_face_scale': 0.64,  # cube face size relative to the frame height (2 / pi keeps the equatorial resolution)
+    'cube_face_padding': 16,  # pixels of the neighbouring faces added around every face
+    'cube_workers': 6,  # processes solving the cube faces (<= 1: solve them in turn)
     'pad_size': 65,  # padding size
     'upscale_size': upscale_size,
     'downscale_size': downscale_size,
     'bilateral_sigma': 2,
+    'edge_filter': 'joint_bilateral',  # 'joint_bilateral' (reference), 'guided', 'fgs' or 'bilateral_grid'
+    'guided_radius': 4,  # guided filter window radius
+    'guided_eps': 1e-3,  # guided filter regularization (guide in [0, 1])
+    'fgs_lambda': 100,  # fast global smoother strength
+    'fgs_sigma_color': 10,  # fast global smoother edge sensitivity (8-bit guide levels)
+    'grid_sigma_space': 4,  # bilateral grid cell size in pixels
+    'grid_sigma_color': 0.1,  # bilateral grid intensity bin width (guide in [0, 1])
     'svweight_patchsize': 7,
     'scale_factor': 1e+5,
     'video_duration': 20,
-    'upsampling': 'bilinear',
+    'upsampling': 'bilinear',  # 'bilinear' or 'bgu' (bilateral guided upsampling from bgu_scale)
+    'bgu_scale': 0.25,  # processing resolution relative to upscale_size when upsampling is 'bgu'
+    'bgu_cell_size': 8,  # processing pixels per bilateral grid cell
+    'bgu_bins': 16,  # guide intensity bins of the bilateral grid
+    'bgu_smoothing': 0.5,  # grid blur (in cells) before the affine fits
+    'bgu_lambda': 1e-2,  # regularization of the affine fits towards constant models
     'starting_point_in_sec': 0,
     'left_right': 'none',
     'weight_type': 'tukey',
     'wrs_window_size': 3,
-    'extended_filename': '1'
+    'extended_filename': '1',
+    'segment_workers': 1,  # > 1: refine overlapping temporal segments in parallel processes
+    'segment_overlap': 15  # frames shared by consecutive segments (warm-up and blending)
 }
 
 min_meter_in_depth = 0.3
 
+# (workers, ProcessPoolExecutor) of the cube face solves (see cube_face_pool)
+_cube_face_pool = None
+
 def clip01(img):
     """Clip image values to [0, 1] range"""
     return np.clip(img, 0, 1)
@@ -67,23 +103,16 @@ def imcut(img, left_right):
     else:
         return img
 
-def detect_edges(img):
-    """Edge detection function"""
-    # Simplified edge detection using Sobel operator
-    if len(img.shape) == 3:
-        gray = cv2.cvtColor(img.astype(np.float32), cv2.COLOR_RGB2GRAY)
-    else:
-        gray = img.astype(np.float32)
-    
-    # Fallback to Sobel operator
-    sobelx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-    sobely = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-    
-    # Compute gradient magnitude
-    edges = np.sqrt(sobelx**2 + sobely**2)
-    
+def gradient_magnitude(gray):
+    """Sobel gradient magnitude of a single-channel float32 image"""
+    grad_x = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+    grad_y = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+    return cv2.magnitude(grad_x, grad_y)
+
+def edges_from_gradient(grad_mag):
+    """Edge map in [0, 1] from a gradient magnitude"""
     # Apply Gaussian blur to reduce noise
-    edges = cv2.GaussianBlur(edges, (3, 3), 0)
+    edges = cv2.GaussianBlur(grad_mag, (3, 3), 0)
     
     # Enhance edges with histogram equalization
     edges = cv2.equalizeHist((edges * 255).astype(np.uint8)).astype(np.float32) / 255.0
@@ -93,25 +122,23 @@ def detect_edges(img):
     
     return edges
 
+def detect_edges(img):
+    """Edge detection function"""
+    # Simplified edge detection using Sobel operator
+    return edges_from_gradient(gradient_magnitude(grayscale_guide(img)))
+
+def depth_weight_from_gradient(grad_mag):
+    """Data weight from the depth gradient magnitude (higher gradient = lower weight)"""
+    return np.exp(-grad_mag * 5.0)
+
+def smoothness_weight_from_gradient(grad_mag, params):
+    """Smoothness weight from the depth gradient magnitude (higher gradient = lower weight)"""
+    return np.exp(-grad_mag * params['scale_factor_smoothness'])
+
 def compute_depth_weight(depth, params):
     """Compute spatially-varying weight for the depth data"""
     # Simplified implementation - edge-aware weighting
-    if len(depth.shape) == 3:
-        depth_gray = cv2.cvtColor(depth.astype(np.float32), cv2.COLOR_RGB2GRAY)
-    else:
-        depth_gray = depth.astype(np.float32)
-    
-    # Compute depth gradients
-    grad_x = cv2.Sobel(depth_gray, cv2.CV_32F, 1, 0, ksize=3)
-    grad_y = cv2.Sobel(depth_gray, cv2.CV_32F, 0, 1, ksize=3)
-    
-    # Compute gradient magnitude
-    grad_mag = np.sqrt(grad_x**2 + grad_y**2)
-    
-    # Map gradient magnitude to weights (higher gradient = lower weight)
-    weights = np.exp(-grad_mag * 5.0)
-    
-    return weights
+    return depth_weight_from_gradient(gradient_magnitude(grayscale_guide(depth)))
 
 def vectorize_any(img):
     """Flatten the array"""
@@ -133,7 +160,7 @@ def weight_compute(edge_map, window_size, weight_type):
     
     # Apply local window averaging for smoothness
     if window_size > 1:
-        kernel = np.ones((window_size, window_size)) / (window_size * window_size)
+        kernel = np.ones((window_size, window_size), dtype=np.float32) / (window_size * window_size)
         weights = cv2.filter2D(weights, -1, kernel)
     
     return weights
@@ -168,32 +195,67 @@ def eight_neighbour_extract(weights):
 
 def compute_smoothness_weight(depth, params):
     """Compute smoothness weights based on depth"""
-    if len(depth.shape) == 3:
-        depth_gray = cv2.cvtColor(depth.astype(np.float32), cv2.COLOR_RGB2GRAY)
-    else:
-        depth_gray = depth.astype(np.float32)
-    
-    # Compute depth gradients
-    grad_x = cv2.Sobel(depth_gray, cv2.CV_32F, 1, 0, ksize=3)
-    grad_y = cv2.Sobel(depth_gray, cv2.CV_32F, 0, 1, ksize=3)
-    
-    # Compute gradient magnitude
-    grad_mag = np.sqrt(grad_x**2 + grad_y**2)
-    
-    # Scale by factor from params
-    scaled_grad = grad_mag * params['scale_factor_smoothness']
-    
-    # Convert to weights (higher gradient = lower weight)
-    weights = np.exp(-scaled_grad)
+    return smoothness_weight_from_gradient(gradient_magnitude(grayscale_guide(depth)), params)
+
+def compute_frame_features(img_resized, depth_resized, params):
+    """
+    Compute the per-frame inputs of the solver from one pass over the image and depth gradients.
+    
+    The image and depth Sobel gradients are computed once in float32 and shared by the
+    edge map, the data weight and the smoothness weights.
+    
+    Args:
+        img_resized: Padded and resized RGB frame in [0, 1]
+        depth_resized: Padded and resized depth frame (single channel; the first channel is used otherwise)
+        params: Depth improvement parameters
+    
+    Returns:
+        Dictionary with 'edgemap', 'weight_data' (median filtered) and the solver 'weights'
+        ('w_rs' edge-aware weights, 'w_sm' 8-neighbour smoothness weights)
+    """
+    if len(depth_resized.shape) == 3:
+        depth_resized = depth_resized[:, :, 0]
+    
+    image_grad = gradient_magnitude(grayscale_guide(img_resized))
+    depth_grad = gradient_magnitude(depth_resized.astype(np.float32))
+    
+    # Combined and normalized edge map
+    edgemap = edges_from_gradient(image_grad) + edges_from_gradient(depth_grad)
+    edgemap = edgemap / (edgemap.max() + 1e-10)
+    
+    # 3x3 median of the data weight (equal to scipy's reflect border at this size)
+    weight_data = cv2.medianBlur(depth_weight_from_gradient(depth_grad), 3)
+    
+    weights = {
+        'w_rs': weight_compute(edgemap, params['wrs_window_size'], params['weight_type']),
+        'w_sm': eight_neighbour_extract(smoothness_weight_from_gradient(depth_grad, params))
+    }
     
-    return weights
+    return {'edgemap': edgemap, 'weight_data': weight_data, 'weights': weights}
+
+def solver_dtype(params):
+    """Floating-point type of the linear system (params['precision'])"""
+    return np.dtype(params['precision'])
 
-def create_laplacian_matrix(weights, height, width):
+def solve_latitude_grid(height, width, params):
+    """
+    Latitude-adaptive grid of the processing frame, or None to solve on every pixel.
+    
+    The processing frame is the padded frame resized to downscale_size, so its top and
+    bottom rows are symmetric padding beyond the poles (pad_size of the upscale_size height).
+    """
+    if params['solve_grid'] != 'latitude':
+        return None
+    
+    pad_fraction = params['pad_size'] / (params['upscale_size'][1] + 2 * params['pad_size'])
+    return latitude_grid(height, width, pad_fraction, params['latitude_min_width'], params['latitude_full_band'])
+
+def create_laplacian_matrix(weights, height, width, dtype=np.float64):
     """Create a Laplacian matrix for the optimization problem"""
     n = height * width
     
     # Diagonal elements
-    diag_vals = np.ones(n) * 8  # 8 neighbors
+    diag_vals = np.full(n, 8, dtype=dtype)  # 8 neighbors
     
     # Off-diagonal elements for each direction
     offsets = [
@@ -208,52 +270,225 @@ def create_laplacian_matrix(weights, height, width):
     ]
     
     # Create sparse Laplacian matrix
-    L = diags([diag_vals] + [-np.ones(n-abs(offset)) for offset in offsets],
-              [0] + offsets, shape=(n, n), format='csr')
+    L = diags([diag_vals] + [-np.ones(n-abs(offset), dtype=dtype) for offset in offsets],
+              [0] + offsets, shape=(n, n), format='csr', dtype=dtype)
     
     return L
 
-def optimize_objective(depth, weights, mask, params):
-    """Optimize the objective function (non-temporal case)"""
-    if len(depth.shape) == 3:
-        depth_working = depth[:,:,0].copy()
-    else:
-        depth_working = depth.copy()
+# SciPy 1.12 renamed the tolerance of the iterative solvers from tol to rtol (tol was removed in 1.14)
+solver_tolerance = 'rtol' if 'rtol' in inspect.signature(bicgstab).parameters else 'tol'
+
+def solve_system(A, b, params):
+    """Solve Ax = b with the configured iterative solver"""
+    iterations = [0]
+    
+    def count_iteration(xk):
+        iterations[0] += 1
+    
+    solver = bicgstab if params['solver'] == 'bicgstab' else cg
+    x, info = solver(A, b, maxiter=params['maxiter'], callback=count_iteration, **{solver_tolerance: params['tol']})
+    
+    telemetry.count('solver_iterations', iterations[0])
+    
+    if info != 0:
+        print(f"Warning: solver did not converge, info={info}")
+    
+    return x
+
+def solve_depth_system(depth_working, prev_depth_working, w_sm, params):
+    """
+    Minimize λ|x - d|² + γ|x - d_prev|² + smoothness * xᵀLx for one frame.
+    
+    Args:
+        depth_working: Depth frame (2D)
+        prev_depth_working: Warped previous depth frame (2D), or None without the temporal term
+        w_sm: Eight-neighbour smoothness weights of the frame, or None
+        params: Depth improvement parameters
+    
+    Returns:
+        Optimized depth frame in the solver dtype
+    """
+    if params['solve_domain'] == 'cubemap':
+        return solve_cubemap(depth_working, prev_depth_working, params)
     
     height, width = depth_working.shape
     n = height * width
+    dtype = solver_dtype(params)
     
     # Flatten input arrays
-    depth_flat = depth_working.flatten()
+    depth_flat = depth_working.flatten().astype(dtype)
+    if prev_depth_working is not None:
+        prev_depth_flat = prev_depth_working.flatten().astype(dtype)
+    
+    # Solve on the latitude-adaptive grid if enabled
+    grid = solve_latitude_grid(height, width, params)
+    if grid is not None:
+        depth_flat = grid.to_grid(depth_flat).astype(dtype)
+        if prev_depth_working is not None:
+            prev_depth_flat = grid.to_grid(prev_depth_flat).astype(dtype)
+        n = grid.size
     
     # Data term weight
-    lambda_data = np.ones(n) * params['lambda_data']
+    lambda_data = np.full(n, params['lambda_data'], dtype=dtype)
     
     # Create Laplacian matrix for smoothness term
-    L = create_laplacian_matrix(weights['w_sm'], height, width)
-    L = L * params['smoothness']
+    if grid is not None:
+        L = grid.laplacian(dtype)
+    else:
+        L = create_laplacian_matrix(w_sm, height, width, dtype)
+    L = L * dtype.type(params['smoothness'])
     
-    # Build the system matrix A = (λI + L)
-    I = diags([lambda_data], [0], shape=(n, n), format='csr')
+    if prev_depth_working is None:
+        # Build the system matrix A = (λI + L) and the right-hand side b = λd
+        I = diags([lambda_data], [0], shape=(n, n), format='csr', dtype=dtype)
+        b = lambda_data * depth_flat
+    else:
+        # Temporal term weight
+        gamma = np.full(n, params['gamma'], dtype=dtype)
+        
+        # Build the system matrix A = (λI + γI + L) and the right-hand side b = λd + γd_prev
+        I = diags([lambda_data + gamma], [0], shape=(n, n), format='csr', dtype=dtype)
+        b = lambda_data * depth_flat + gamma * prev_depth_flat
     A = I + L
     
-    # Right-hand side b = λd
-    b = lambda_data * depth_flat
-    
     # Solve the system Ax = b
-    if params['solver'] == 'bicgstab':
-        x, info = bicgstab(A, b, tol=params['tol'], maxiter=params['maxiter'])
-    else:
-        x, info = cg(A, b, tol=params['tol'], maxiter=params['maxiter'])
-    
-    if info != 0:
-        print(f"Warning: solver did not converge, info={info}")
+    x = solve_system(A, b, params)
     
     # Reshape to 2D
-    depth_optimized = x.reshape(height, width)
+    if grid is not None:
+        depth_optimized = grid.from_grid(x).astype(dtype)
+    else:
+        depth_optimized = x.reshape(height, width)
     
     return depth_optimized
 
+def cube_face_layout(height, width, params):
+    """
+    Equirectangular region and cube face geometry of a processing frame.
+    
+    The processing frame is the padded frame resized to downscale_size, the padding is
+    cropped before projecting to the cube. Faces have cube_face_scale times the height of
+    the equirectangular region (2 / pi keeps the equatorial resolution) plus
+    cube_face_padding pixels on every side, sampled from the neighbouring faces.
+    
+    Returns:
+        (top, left, face_size, margin): cropped rows and columns on every side, size of
+        the padded faces and the margin to pass to equirectangular_to_cubemap_fast
+    """
+    pad_size = params['pad_size']
+    top = int(round(height * pad_size / (params['upscale_size'][1] + 2 * pad_size)))
+    left = int(round(width * pad_size / (params['upscale_size'][0] + 2 * pad_size)))
+    
+    inner = max(8, int(round((height - 2 * top) * params['cube_face_scale'])))
+    padding = params['cube_face_padding']
+    return top, left, inner + 2 * padding, 2 * padding / (inner - 1)
+
+def solve_cube_face(depth_face, prev_depth_face, params):
+    """
+    Solve the depth system of one cube face (runs in a worker process).
+    
+    Returns:
+        (solved face, telemetry counters of the solve such as solver_iterations)
+    """
+    with telemetry.collect() as counters:
+        depth = solve_depth_system(depth_face, prev_depth_face, None, params)
+    return depth, counters
+
+def cube_face_pool(workers):
+    """
+    Persistent process pool for the cube face solves, started on first use.
+    
+    Workers are spawned with one thread per process and the mono6D folder on PYTHONPATH,
+    and all of them are started up front so the environment only has to be set once.
+    """
+    global _cube_face_pool
+    if _cube_face_pool is not None and _cube_face_pool[0] == workers:
+        return _cube_face_pool[1]
+    if _cube_face_pool is not None:
+        _cube_face_pool[1].shutdown()
+    
+    with child_process_env((os.cpu_count() or 1) // workers):
+        context = multiprocessing.get_context("spawn")
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        # Processes are spawned on demand, submitting one task per worker starts all of them
+        for future in [executor.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+    
+    _cube_face_pool = (workers, executor)
+    return executor
+
+def shutdown_cube_face_pool():
+    """Stop the cube face processes (see video_io.shutdown_decoder_pool)"""
+    global _cube_face_pool
+    if _cube_face_pool is not None:
+        _cube_face_pool[1].shutdown()
+        _cube_face_pool = None
+
+def solve_cubemap(depth_working, prev_depth_working, params):
+    """
+    Solve the depth system on the six faces of a cube instead of the equirectangular frame.
+    
+    Cube faces sample the sphere almost uniformly, so the six systems are smaller and better
+    conditioned than the equirectangular one, and they are independent: they are solved in
+    parallel processes (cube_workers). Every face is padded with cube_face_padding pixels of
+    its neighbours so the face borders are smoothed with their context, and only the inner
+    part of each face is used when reprojecting to the equirectangular frame.
+    
+    Args:
+        depth_working: Depth processing frame (2D, padded like prepare_depth_frame)
+        prev_depth_working: Warped previous depth frame (2D), or None without the temporal term
+        params: Depth improvement parameters
+    
+    Returns:
+        Optimized depth frame of the input size in the solver dtype
+    """
+    height, width = depth_working.shape
+    top, left, face_size, margin = cube_face_layout(height, width, params)
+    
+    def to_faces(frame):
+        equirect = frame[top:height - top, left:width - left].astype(np.float32)
+        return equirectangular_to_cubemap_fast(equirect, face_size, margin)
+    
+    depth_faces = to_faces(depth_working)
+    prev_faces = to_faces(prev_depth_working) if prev_depth_working is not None else [None] * 6
+    
+    # Faces are solved on their own pixel grid
+    face_params = dict(params, solve_domain='equirect', solve_grid='equirect')
+    
+    with telemetry.span("cube_face_solves", faces=6, face_size=face_size):
+        if params['cube_workers'] > 1:
+            executor = cube_face_pool(params['cube_workers'])
+            futures = [executor.submit(solve_cube_face, depth_face, prev_face, face_params)
+                       for depth_face, prev_face in zip(depth_faces, prev_faces)]
+            results = [future.result() for future in futures]
+        else:
+            results = [solve_cube_face(depth_face, prev_face, face_params)
+                       for depth_face, prev_face in zip(depth_faces, prev_faces)]
+        
+        # Counters of the worker processes are added to the span here
+        solved = [depth for depth, _ in results]
+        for _, counters in results:
+            for key, value in counters.items():
+                telemetry.count(key, value)
+    
+    inner_height, inner_width = height - 2 * top, width - 2 * left
+    depth_optimized = cubemap_to_equirectangular(solved, inner_height, inner_width, margin)
+    
+    # Restore the padding of the processing frame: circular in x, symmetric in y
+    depth_optimized = np.pad(depth_optimized, ((0, 0), (left, left)), mode='wrap')
+    depth_optimized = np.pad(depth_optimized, ((top, top), (0, 0)), mode='symmetric')
+    
+    return depth_optimized.astype(solver_dtype(params))
+
+def optimize_objective(depth, weights, mask, params):
+    """Optimize the objective function (non-temporal case)"""
+    if len(depth.shape) == 3:
+        depth_working = depth[:,:,0].copy()
+    else:
+        depth_working = depth.copy()
+    
+    return solve_depth_system(depth_working, None, weights['w_sm'], params)
+
 def warp_with_flow(image, flow):
     """Warp an image using optical flow"""
     h, w = image.shape[:2]
@@ -292,43 +527,7 @@ def optimize_objective_temporal(depth, weights, mask, flows, prev_depth, params)
     # Warp previous depth to current frame using optical flow
     warped_prev_depth = warp_with_flow(prev_depth_working, flows)
     
-    height, width = depth_working.shape
-    n = height * width
-    
-    # Flatten arrays
-    depth_flat = depth_working.flatten()
-    prev_depth_flat = warped_prev_depth.flatten()
-    
-    # Data term weight
-    lambda_data = np.ones(n) * params['lambda_data']
-    
-    # Temporal term weight
-    gamma = np.ones(n) * params['gamma']
-    
-    # Create Laplacian matrix for smoothness term
-    L = create_laplacian_matrix(weights['w_sm'], height, width)
-    L = L * params['smoothness']
-    
-    # Build the system matrix A = (λI + γI + L)
-    I = diags([lambda_data + gamma], [0], shape=(n, n), format='csr')
-    A = I + L
-    
-    # Right-hand side b = λd + γd_prev
-    b = lambda_data * depth_flat + gamma * prev_depth_flat
-    
-    # Solve the system Ax = b
-    if params['solver'] == 'bicgstab':
-        x, info = bicgstab(A, b, tol=params['tol'], maxiter=params['maxiter'])
-    else:
-        x, info = cg(A, b, tol=params['tol'], maxiter=params['maxiter'])
-    
-    if info != 0:
-        print(f"Warning: solver did not converge, info={info}")
-    
-    # Reshape to 2D
-    depth_optimized = x.reshape(height, width)
-    
-    return depth_optimized
+    return solve_depth_system(depth_working, warped_prev_depth, weights['w_sm'], params)
 
 def Coarse2FineTwoFrames(prev_img, curr_img, para):
     """Calculate optical flow between two frames"""
@@ -368,11 +567,234 @@ def bilateralFilter(img, guide, min_val, max_val, sigma):
     if len(guide_float.shape) == 3 and len(img_float.shape) == 2:
         guide_float = cv2.cvtColor(guide_float, cv2.COLOR_RGB2GRAY)
     
-    # Apply joint bilateral filter
-    filtered = cv2.ximgproc.jointBilateralFilter(img_float, guide_float, 9, sigma, sigma*2)
+    # Apply joint bilateral filter (the joint image comes first)
+    filtered = cv2.ximgproc.jointBilateralFilter(guide_float, img_float, 9, sigma, sigma*2)
     
     return filtered
 
+def bilateral_grid_filter(img, guide, sigma_space, sigma_color):
+    """
+    Joint bilateral filter evaluated in a bilateral grid: splat, blur, slice.
+    
+    The cost per pixel does not depend on the filter size, larger sigma_space only
+    means a coarser grid.
+    
+    Args:
+        img: Single-channel image to filter
+        guide: Single-channel guide in [0, 1]
+        sigma_space: Spatial extent in pixels (grid cell size)
+        sigma_color: Intensity extent of the guide (bin width)
+    
+    Returns:
+        float32 filtered image
+    """
+    cell = max(1, int(round(sigma_space)))
+    bins = int(np.ceil(1.0 / sigma_color)) + 1
+    
+    count, total = splat_grid(guide, [np.ones(guide.shape), img], cell, bins)
+    count = gaussian_filter(count, sigma=1, mode='nearest')
+    total = gaussian_filter(total, sigma=1, mode='nearest')
+    
+    count, total = slice_grid([count, total], guide, guide.shape, cell, bins)
+    return np.where(count > 1e-6, total / np.maximum(count, 1e-6), img).astype(np.float32)
+
+def edge_aware_filter(img, guide, params):
+    """
+    Smooth a depth map while keeping the edges of the guide, with the backend selected by params['edge_filter'].
+    
+    Args:
+        img: Single-channel depth in [0, 1]
+        guide: Single-channel guide in [0, 1] of the same size
+        params: Depth improvement parameters
+    
+    Returns:
+        float32 filtered depth
+    """
+    method = params['edge_filter']
+    img = img.astype(np.float32)
+    guide = guide.astype(np.float32)
+    
+    if method == 'guided':
+        # Box filters only, O(1) per pixel for any radius
+        return cv2.ximgproc.guidedFilter(guide, img, params['guided_radius'], params['guided_eps'])
+    elif method == 'fgs':
+        # Global weighted least squares, solved with 1D passes; needs an 8-bit guide
+        guide_uint8 = np.round(np.clip(guide, 0, 1) * 255).astype(np.uint8)
+        return cv2.ximgproc.fastGlobalSmootherFilter(guide_uint8, img, params['fgs_lambda'],
+                                                     params['fgs_sigma_color'])
+    elif method == 'bilateral_grid':
+        return bilateral_grid_filter(img, guide, params['grid_sigma_space'], params['grid_sigma_color'])
+    elif method == 'joint_bilateral':
+        return bilateralFilter(img, guide, np.min(guide), np.max(guide), params['bilateral_sigma'])
+    
+    raise ValueError(f"Unknown edge filter: {method}")
+
+def processing_size(params):
+    """(width, height) the refinement runs at: downscale_size, or bgu_scale of the output size with BGU"""
+    if params['upsampling'] == 'bgu':
+        width, height = params['upscale_size']
+        return (int(round(width * params['bgu_scale'])), int(round(height * params['bgu_scale'])))
+    return params['downscale_size']
+
+def grayscale_guide(img):
+    """Single-channel float32 guide of an RGB frame in [0, 1]"""
+    img = img.astype(np.float32)
+    if len(img.shape) == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    return img
+
+def splat_grid(guide, values, cell, bins):
+    """
+    Accumulate per-pixel values into a bilateral grid (nearest-node splatting).
+    
+    Args:
+        guide: Guide image (float, [0, 1]) selecting the intensity bin of every pixel
+        values: List of arrays of the guide size to accumulate
+        cell: Pixels per spatial grid cell
+        bins: Guide intensity bins
+    
+    Returns:
+        List of float64 grids of shape (grid_height, grid_width, bins)
+    """
+    height, width = guide.shape
+    grid_height = int(np.ceil((height - 1) / cell)) + 1
+    grid_width = int(np.ceil((width - 1) / cell)) + 1
+    
+    rows = np.round(np.arange(height) / cell).astype(np.intp)
+    cols = np.round(np.arange(width) / cell).astype(np.intp)
+    z = np.round(np.clip(guide, 0, 1) * (bins - 1)).astype(np.intp)
+    index = ((rows[:, None] * grid_width + cols[None, :]) * bins + z).ravel()
+    
+    size = grid_height * grid_width * bins
+    shape = (grid_height, grid_width, bins)
+    return [np.bincount(index, weights=np.ravel(v).astype(np.float64), minlength=size).reshape(shape)
+            for v in values]
+
+def slice_grid(grids, guide, low_size, cell, bins):
+    """
+    Trilinearly interpolate bilateral grids at every pixel of a guide.
+    
+    Args:
+        grids: List of grids from splat_grid (or derived from them)
+        guide: Guide image (float, [0, 1]), any resolution
+        low_size: (height, width) of the guide the grids were splatted from
+        cell: Pixels per spatial grid cell at low_size
+        bins: Guide intensity bins
+    
+    Returns:
+        List of float32 arrays of the guide size
+    """
+    height, width = guide.shape
+    grid_height, grid_width = grids[0].shape[:2]
+    
+    # Grid coordinates of the pixel centers, clamped to the grid (replicated border)
+    grid_x = ((np.arange(width) + 0.5) * (low_size[1] / width) - 0.5) / cell
+    grid_y = ((np.arange(height) + 0.5) * (low_size[0] / height) - 0.5) / cell
+    grid_x = np.clip(grid_x, 0, grid_width - 1)
+    grid_y = np.clip(grid_y, 0, grid_height - 1)
+    grid_z = np.clip(guide, 0, 1) * (bins - 1)
+    
+    # Lower corner and interpolation weight along each axis
+    x0 = np.floor(grid_x).astype(np.intp)
+    y0 = np.floor(grid_y).astype(np.intp)
+    z0 = np.floor(grid_z).astype(np.intp)
+    fx = (grid_x - x0).astype(np.float32)[None, :]
+    fy = (grid_y - y0).astype(np.float32)[:, None]
+    fz = (grid_z - z0).astype(np.float32)
+    x1 = np.minimum(x0 + 1, grid_width - 1)
+    y1 = np.minimum(y0 + 1, grid_height - 1)
+    z1 = np.minimum(z0 + 1, bins - 1)
+    
+    # Flat indices of the 8 surrounding grid nodes and their trilinear weights
+    corners = []
+    for yi, wy in ((y0, 1 - fy), (y1, fy)):
+        for xi, wx in ((x0, 1 - fx), (x1, fx)):
+            cell_index = (yi[:, None] * grid_width + xi[None, :]) * bins
+            for zi, wz in ((z0, 1 - fz), (z1, fz)):
+                corners.append((cell_index + zi, wy * wx * wz))
+    
+    results = []
+    for grid in grids:
+        flat = grid.astype(np.float32, copy=False).ravel()
+        result = np.zeros((height, width), dtype=np.float32)
+        for index, weight in corners:
+            result += weight * flat[index]
+        results.append(result)
+    
+    return results
+
+def bilateral_grid_fit(guide, target, params):
+    """
+    Fit an affine model target = a * guide + b in every cell of a bilateral grid.
+    
+    The samples are splatted into (y, x, guide intensity) cells, the grid moments are
+    blurred for smoothness and every cell gets the regularized least-squares fit of its
+    neighbourhood, so edges of the guide separate the models.
+    
+    Args:
+        guide: Low-resolution guide (float, [0, 1])
+        target: Low-resolution values to upsample, same size as guide
+        params: Depth improvement parameters (bgu_cell_size, bgu_bins, bgu_smoothing, bgu_lambda)
+    
+    Returns:
+        (a, b): Affine coefficients, arrays of shape (grid_height, grid_width, bins)
+    """
+    g = np.clip(guide, 0, 1).astype(np.float64)
+    t = target.astype(np.float64)
+    moments = splat_grid(guide, [np.ones_like(g), g, g * g, t, g * t], params['bgu_cell_size'], params['bgu_bins'])
+    
+    sigma = params['bgu_smoothing']
+    moments = [gaussian_filter(m, sigma=(sigma, sigma, sigma), mode='nearest') for m in moments]
+    count, sum_g, sum_gg, sum_t, sum_gt = moments
+    
+    # Empty cells fall back to the mean of the target
+    empty = count < 1e-6
+    count = np.where(empty, 1.0, count)
+    mean_g = sum_g / count
+    mean_t = np.where(empty, t.mean(), sum_t / count)
+    var_g = np.maximum(sum_gg / count - mean_g * mean_g, 0)
+    cov_gt = np.where(empty, 0.0, sum_gt / count - mean_g * mean_t)
+    
+    a = cov_gt / (var_g + params['bgu_lambda'])
+    b = mean_t - a * mean_g
+    
+    return a.astype(np.float32), b.astype(np.float32)
+
+def bilateral_grid_slice(a, b, guide, low_size, params):
+    """
+    Evaluate the grid models at every pixel of a full-resolution guide (trilinear slicing).
+    
+    Args:
+        a, b: Affine coefficients from bilateral_grid_fit
+        guide: Full-resolution guide (float, [0, 1])
+        low_size: (height, width) of the guide the grid was fitted on
+        params: Depth improvement parameters
+    
+    Returns:
+        float32 values at the guide resolution
+    """
+    # Slicing is linear, so interpolating a and b separately equals interpolating the models
+    a, b = slice_grid([a, b], guide, low_size, params['bgu_cell_size'], params['bgu_bins'])
+    return a * np.clip(guide, 0, 1).astype(np.float32) + b
+
+def bilateral_guided_upsample(low_res, low_guide, high_guide, params):
+    """
+    Bilateral guided upsampling: fit affine guide-to-value models in a bilateral grid at
+    low resolution and apply them with the full-resolution guide, which restores the
+    edges of the guide lost at the processing resolution.
+    
+    Args:
+        low_res: Low-resolution values (e.g. refined depth)
+        low_guide: Guide at the resolution of low_res (float, [0, 1])
+        high_guide: Guide at the output resolution (float, [0, 1])
+        params: Depth improvement parameters
+    
+    Returns:
+        float32 values at the resolution of high_guide
+    """
+    a, b = bilateral_grid_fit(low_guide, low_res, params)
+    return bilateral_grid_slice(a, b, high_guide, low_guide.shape, params)
+
 def flowToColor(flow):
     """Convert optical flow to color visualization"""
     # Calculate magnitude and angle
@@ -416,7 +838,381 @@ def preserve_depth_format(original_depth, processed_depth):
             return colored
         return processed_depth
 
-def improve_depth(filename):
+def refine_depth_frame(img_resized, depth_resized, prev_img, prev_depth_frame, params, debugpath, num_frames):
+    """
+    Refine one resized depth frame (edge-aware weights, optical flow and sparse solve).
+    
+    Args:
+        img_resized: Padded and resized RGB frame in [0, 1]
+        depth_resized: Padded and resized depth frame
+        prev_img: Previous resized RGB frame, or None for the first frame
+        prev_depth_frame: Previous refined depth frame, or None for the first frame
+        params: Depth improvement parameters
+        debugpath: Folder for the debug edge and weight images
+        num_frames: 1-based index of the frame in the processed range
+        
+    Returns:
+        Refined depth frame at the resized resolution
+    """
+    edgepath = os.path.join(debugpath, 'edges/')
+    w_datapath = os.path.join(debugpath, 'w_data/')
+    
+    # Edge map, data weight and smoothness weights from shared gradients
+    features = compute_frame_features(img_resized, depth_resized, params)
+    edgemap = features['edgemap']
+    weight_filtered = features['weight_data']
+    weights = features['weights']
+    
+    # Create mask (valid pixels)
+    maskimg = np.ones_like(depth_resized)
+    
+    # Save edge maps and weights for debugging
+    cv2.imwrite(os.path.join(edgepath, f'edge_{num_frames:04d}.png'), (edgemap * 255).astype(np.uint8))
+    cv2.imwrite(os.path.join(w_datapath, f'data_weight_{num_frames:04d}.png'), 
+               (weight_filtered * 255).astype(np.uint8))
+    
+    # Process differently if not the first frame
+    if num_frames > 1 and prev_img is not None and prev_depth_frame is not None:
+        # Flow estimation for temporal consistency
+        vx, vy, flows = Coarse2FineTwoFrames(prev_img, img_resized, para)
+        
+        # Save flow visualization
+        flow_color = flowToColor(flows)
+        # cv2.imwrite(os.path.join(flowpath, f'flow_{num_frames:04d}.png'), (flow_color * 255).astype(np.uint8))
+        
+        # Depth cleaning with temporal consistency
+        depth_propagated = optimize_objective_temporal(
+            depth_resized, weights, maskimg, flows, prev_depth_frame, params
+        )
+    else:
+        # Depth cleaning without temporal consistency for first frame
+        depth_propagated = optimize_objective(depth_resized, weights, maskimg, params)
+    
+    return depth_propagated
+
+def prepare_depth_frame(img, depth, params):
+    """
+    Normalize, pad and downscale one RGB and depth frame for refinement.
+    
+    Args:
+        img: BGR frame (uint8)
+        depth: Depth frame (uint8)
+        params: Depth improvement parameters
+    
+    Returns:
+        Dictionary with the resized frames ('img_resized', 'depth_resized') and what
+        finish_depth_frame needs ('origimg', 'origimg_pad', 'padarray_size')
+    """
+    # Convert to float and normalize
+    img = img.astype(np.float32) / 255.0
+    depth = cv2.normalize(depth, None, 0, 255, cv2.NORM_MINMAX)
+    depth = np.uint8(depth)
+    
+    # Apply left/right cropping if needed
+    img = imcut(img, params['left_right'])
+    depth = imcut(depth, params['left_right'])
+    
+    origimg = img.copy()
+    
+    # Use only the first channel if depth is RGB
+    if len(depth.shape) == 3 and depth.shape[2] > 1:
+        # Use first channel for processing
+        depth_processing = depth[:,:,0].copy()
+    else:
+        depth_processing = depth.copy()
+    
+    # Image padding to handle artifacts around boundaries
+    pad_size = params['pad_size']
+    # Circular padding in x-direction
+    img_padded = np.pad(img, ((0, 0), (pad_size, pad_size), (0, 0)), mode='wrap')
+    # Symmetric padding in y-direction
+    img_padded = np.pad(img_padded, ((pad_size, pad_size), (0, 0), (0, 0)), mode='symmetric')
+    origimg_pad = img_padded.copy()
+    
+    # Padding for depth
+    # Circular padding in x-direction
+    depth_padded = np.pad(depth_processing, ((0, 0), (pad_size, pad_size)), mode='wrap')
+    # Symmetric padding in y-direction
+    depth_padded = np.pad(depth_padded, ((pad_size, pad_size), (0, 0)), mode='symmetric')
+    
+    padarray_size = depth_padded.shape
+    
+    # Resize for processing
+    img_resized = cv2.resize(img_padded, processing_size(params))
+    depth_resized = cv2.resize(depth_padded, processing_size(params))
+    
+    return {
+        'img_resized': img_resized,
+        'depth_resized': depth_resized,
+        'origimg': origimg,
+        'origimg_pad': origimg_pad,
+        'padarray_size': padarray_size
+    }
+
+def finish_depth_frame(depth_propagated, frame, params):
+    """
+    Upsample, clip and edge-aware filter a refined depth frame to the output resolution.
+    
+    Args:
+        depth_propagated: Refined depth at the processing resolution
+        frame: Output of prepare_depth_frame for the same frame
+        params: Depth improvement parameters
+    
+    Returns:
+        Output depth frame (uint8, white = closer)
+    """
+    padarray_size = frame['padarray_size']
+    origimg_pad = frame['origimg_pad']
+    pad_size = params['pad_size']
+    
+    greyimg_pad = grayscale_guide(origimg_pad)
+    
+    if params['upsampling'] == 'bgu':
+        # The grid models follow the edges of the guide, they replace the joint bilateral filter
+        depth_bilateral = bilateral_guided_upsample(
+            clip01(depth_propagated), grayscale_guide(frame['img_resized']), greyimg_pad, params
+        )
+        depth_bilateral = clip01(depth_bilateral)
+    else:
+        # Resize back to original padded size
+        depth_propagated_resized = cv2.resize(depth_propagated, (padarray_size[1], padarray_size[0]))
+        
+        # Clip values to [0, 1]
+        depth_propagated_resized = clip01(depth_propagated_resized)
+        
+        # Edge-aware smoothing guided by the image
+        try:
+            depth_bilateral = edge_aware_filter(depth_propagated_resized, greyimg_pad, params)
+        except Exception as e:
+            print(f"Error in edge-aware filtering: {e}")
+            depth_bilateral = depth_propagated_resized
+    
+    # Crop padding
+    depth_bilateral = depth_bilateral[pad_size:padarray_size[0]-pad_size, 
+                                      pad_size:padarray_size[1]-pad_size]
+    
+    # Upsampling to the output size
+    depth_bilateral = cv2.resize(depth_bilateral, params['upscale_size'])
+    
+    # Ensure depth represents only depth information (white = closer)
+    if len(depth_bilateral.shape) == 2:
+        # Keep the original depth convention (white = closer)
+        depth_bilateral_uint8 = (depth_bilateral * 255).astype(np.uint8)
+    else:
+        # For multi-channel depth, use only first channel for actual depth
+        # and make all channels the same to represent only depth
+        depth_channel = depth_bilateral[:,:,0]  # Use first channel as depth
+        depth_bilateral_uint8 = np.stack([depth_channel, depth_channel, depth_channel], axis=2)
+        depth_bilateral_uint8 = (depth_bilateral_uint8 * 255).astype(np.uint8)
+    
+    return depth_bilateral_uint8
+
+def texture_output_frame(origimg, params):
+    """RGB output frame (uint8) at the output resolution"""
+    orig_resized = cv2.resize(origimg, params['upscale_size'])
+    return (orig_resized * 255).astype(np.uint8)
+
+def write_output_frames(tv_writer, dv_writer, videopath, filename, t, texture_frame, depth_frame):
+    """Write the output frames to the videos, or as PNG images if the writers are not available"""
+    # The writers expect 3-channel frames, single-channel frames would be dropped
+    if depth_frame.ndim == 2:
+        depth_frame = cv2.cvtColor(depth_frame, cv2.COLOR_GRAY2BGR)
+    
+    if tv_writer is not None and tv_writer.isOpened() and dv_writer is not None and dv_writer.isOpened():
+        try:
+            tv_writer.write(texture_frame)
+            dv_writer.write(depth_frame)
+        except Exception as e:
+            print(f"Error writing frame to video: {e}")
+            # Save individual frames as fallback
+            cv2.imwrite(os.path.join(videopath, f"{filename}_{t:04d}.png"), texture_frame)
+            cv2.imwrite(os.path.join(videopath, f"{filename}_depth_{t:04d}.png"), depth_frame)
+    else:
+        # Save individual frames if video writers are not available
+        print("no video writer, saving individual frames instead")
+        cv2.imwrite(os.path.join(videopath, f"{filename}_{t:04d}.png"), texture_frame)
+        cv2.imwrite(os.path.join(videopath, f"{filename}_depth_{t:04d}.png"), depth_frame)
+
+def segment_bounds(start_frame, end_frame, workers, overlap):
+    """
+    Split a frame range into overlapping temporal segments.
+    
+    Segment k owns the frames [core_start, end) and additionally refines the overlap
+    frames before core_start to warm up its temporal chain.
+    
+    Args:
+        start_frame: First frame of the range
+        end_frame: End of the range (exclusive)
+        workers: Requested number of segments
+        overlap: Number of warm-up frames shared with the previous segment
+    
+    Returns:
+        List of (first_frame, core_start, end) tuples
+    """
+    # Each segment must be longer than two overlaps, so overlaps never span a whole segment
+    workers = max(1, min(workers, (end_frame - start_frame) // (2 * overlap + 1)))
+    bounds = np.linspace(start_frame, end_frame, workers + 1).astype(int)
+    return [(int(max(start_frame, bounds[k] - overlap) if k > 0 else bounds[k]), int(bounds[k]), int(bounds[k + 1]))
+            for k in range(workers)]
+
+def refine_depth_segment(filename, segment_idx, first_frame, end_frame, output_path, segment_params):
+    """
+    Refine the depth of a range of frames with its own temporal chain (run in a worker process).
+    
+    Args:
+        filename: Base name of the video file
+        segment_idx: Index of the segment (used for the debug folder)
+        first_frame: First frame, the chain starts here without temporal term
+        end_frame: End of the range (exclusive)
+        output_path: .npy file receiving the output depth frames (uint8), written atomically
+        segment_params: Depth improvement parameters of the parent process
+    
+    Returns:
+        (number of refined frames, telemetry counters of the segment such as solver_iterations)
+    """
+    # Spawned workers start from the module defaults
+    params.update(segment_params)
+    
+    with telemetry.collect() as counters:
+        count = refine_segment_frames(filename, segment_idx, first_frame, end_frame, output_path)
+    return count, counters
+
+def refine_segment_frames(filename, segment_idx, first_frame, end_frame, output_path):
+    """Frame loop of refine_depth_segment, returns the number of refined frames"""
+    debugpath = f'_improved_depth/{filename}/segments/{segment_idx}/'
+    for path in [os.path.join(debugpath, 'edges/'), os.path.join(debugpath, 'w_data/')]:
+        os.makedirs(path, exist_ok=True)
+    
+    texture_video = cv2.VideoCapture(os.path.join(texture_path, f"{filename}.mp4"))
+    depth_video = cv2.VideoCapture(os.path.join(depth_path, f"{filename}_depth.mp4"))
+    texture_video.set(cv2.CAP_PROP_POS_FRAMES, first_frame)
+    depth_video.set(cv2.CAP_PROP_POS_FRAMES, first_frame)
+    
+    tmp_path = output_path.replace('.npy', '.partial.npy')
+    frames = None
+    prev_img = None
+    prev_depth_frame = None
+    count = 0
+    
+    for t in range(first_frame, end_frame):
+        print(f"Segment {segment_idx}: processing depth for frame {t:05d} / {end_frame}")
+        
+        ret, img = texture_video.read()
+        ret_d, depth = depth_video.read()
+        if not ret or not ret_d:
+            print(f"Error reading frame {t}")
+            break
+        
+        frame = prepare_depth_frame(img, depth, params)
+        depth_propagated = refine_depth_frame(
+            frame['img_resized'], frame['depth_resized'], prev_img, prev_depth_frame, params, debugpath, count + 1
+        )
+        prev_depth_frame = depth_propagated.copy()
+        prev_img = frame['img_resized'].copy()
+        
+        depth_frame = finish_depth_frame(depth_propagated, frame, params)
+        if frames is None:
+            frames = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8,
+                                               shape=(end_frame - first_frame,) + depth_frame.shape)
+        frames[count] = depth_frame
+        count += 1
+    
+    texture_video.release()
+    depth_video.release()
+    
+    if frames is None:
+        return 0
+    
+    frames.flush()
+    del frames
+    os.replace(tmp_path, output_path)
+    return count
+
+def improve_depth_segments(filename, start_frame, end_frame, texture_video, tv_writer, dv_writer, statepath, resume):
+    """
+    Refine overlapping temporal segments in parallel and write them as one video.
+    
+    Every segment after the first starts segment_overlap frames early, so its temporal
+    chain is warmed up when it reaches its own frames. The overlap frames are refined by
+    both neighbours and cross-faded linearly from the earlier segment to the later one.
+    
+    Args:
+        filename: Base name of the video file
+        start_frame: First frame to process
+        end_frame: End of the range (exclusive)
+        texture_video: Texture video positioned at start_frame
+        tv_writer, dv_writer: Output texture and depth writers
+        statepath: Folder for the segment outputs (kept for resuming)
+        resume: Reuse finished segment outputs of a previous run
+    """
+    workers = params['segment_workers']
+    overlap = params['segment_overlap']
+    segments = segment_bounds(start_frame, end_frame, workers, overlap)
+    print(f"Refining depth in {len(segments)} segments with {overlap} frames overlap")
+    
+    segment_dir = os.path.join(statepath, 'segments')
+    os.makedirs(segment_dir, exist_ok=True)
+    outputs = [os.path.join(segment_dir, f'segment_{k:03d}_{first:05d}_{end:05d}.npy')
+               for k, (first, _, end) in enumerate(segments)]
+    
+    context = multiprocessing.get_context("spawn")
+    with telemetry.span("refine_depth_segments", segments=len(segments)):
+        with ProcessPoolExecutor(max_workers=len(segments), mp_context=context) as executor:
+            # Split the cores between the workers and make the modules importable in spawned
+            # processes; the workers are spawned by submit, so the override ends before the wait
+            with child_process_env((os.cpu_count() or 1) // len(segments)):
+                futures = [
+                    executor.submit(refine_depth_segment, filename, k, first, end, output, dict(params))
+                    for k, ((first, _, end), output) in enumerate(zip(segments, outputs))
+                    if not (resume and os.path.exists(output))
+                ]
+            # Counters of the worker processes are added to the span here
+            for future in futures:
+                _, counters = future.result()
+                for key, value in counters.items():
+                    telemetry.count(key, value)
+    
+    videopath = f'_improved_depth/{filename}/videos/'
+    depth_frames = [np.load(output, mmap_mode='r') for output in outputs]
+    
+    for t in range(start_frame, end_frame):
+        ret, img = texture_video.read()
+        if not ret:
+            print(f"Error reading frame {t}")
+            break
+        
+        # Segment owning the frame
+        k = max(idx for idx, (_, core_start, _) in enumerate(segments) if core_start <= t)
+        first, _, end = segments[k]
+        if t - first >= len(depth_frames[k]):
+            print(f"Missing refined depth for frame {t}")
+            break
+        depth_frame = depth_frames[k][t - first]
+        
+        # Cross-fade into the next segment over its warm-up frames
+        if k + 1 < len(segments) and t >= segments[k + 1][0]:
+            next_first = segments[k + 1][0]
+            weight = (t - next_first + 1) / (overlap + 1)
+            blended = (1 - weight) * depth_frame.astype(np.float32) + weight * depth_frames[k + 1][t - next_first]
+            depth_frame = np.clip(np.round(blended), 0, 255).astype(np.uint8)
+        
+        origimg = imcut(img.astype(np.float32) / 255.0, params['left_right'])
+        write_output_frames(tv_writer, dv_writer, videopath, filename, t,
+                            texture_output_frame(origimg, params), np.ascontiguousarray(depth_frame))
+    
+    if not resume:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+def improve_depth(filename, resume=False):
+    """
+    Improve the depth video of a clip and write the results to _improved_depth/{filename}/videos.
+    
+    Args:
+        filename: Base name of the video file
+        resume: Keep the per-frame solves in _improved_depth/{filename}/state and reuse
+            them when rerun, so an interrupted run only solves the missing frames
+            (whole segments when params['segment_workers'] > 1)
+    """
     # Debug output path
     debugpath = f'_improved_depth/{filename}/'
     flowpath = os.path.join(debugpath, 'flow/')
@@ -431,6 +1227,28 @@ def improve_depth(filename):
 
     # Save parameters
     np.save(os.path.join(debugpath, 'params.npy'), params)
+    
+    # Per-frame solver state for resuming, invalidated when parameters change. Frame states
+    # carry the fingerprint of their input frames, so an edited clip is only re-solved from
+    # its first changed frame on
+    statepath = os.path.join(debugpath, 'state/')
+    if resume:
+        key_inputs = {'params': params}
+        if params['segment_workers'] > 1:
+            # Segment outputs have no per-frame fingerprints, any input change invalidates them
+            key_inputs['inputs'] = [(os.path.getsize(path), os.path.getmtime(path)) for path in [
+                os.path.join(texture_path, f"{filename}.mp4"), os.path.join(depth_path, f"{filename}_depth.mp4")]]
+        state_key = params_key(key_inputs)
+        key_file = os.path.join(statepath, 'key.json')
+        stored_key = None
+        if os.path.exists(key_file):
+            with open(key_file) as f:
+                stored_key = f.read()
+        if stored_key != state_key:
+            shutil.rmtree(statepath, ignore_errors=True)
+            os.makedirs(statepath, exist_ok=True)
+            with open(key_file, 'w') as f:
+                f.write(state_key)
 
     # Open video files
     texture_video = cv2.VideoCapture(os.path.join(texture_path, f"{filename}.mp4"))
@@ -457,46 +1275,15 @@ def improve_depth(filename):
     depth_video.set(cv2.CAP_PROP_POS_FRAMES, 0)
     
     # Get frame dimensions for output videos
-    width = int(upscale_size[0])
-    height = int(upscale_size[1])
-    
-    # codec
-    possible_codecs = [
-        ('mp4v', '.mp4')
-    ]
+    width = int(params['upscale_size'][0])
+    height = int(params['upscale_size'][1])
     
-    tv_writer = None
-    dv_writer = None
+    # Video writers (OpenCV or ffmpeg backend, see video_io.video_params)
+    texture_output_path = os.path.join(videopath, f"{filename}.mp4")
+    depth_output_path = os.path.join(videopath, f"{filename}_depth.mp4")
     
-    for codec, ext in possible_codecs:
-        try:
-            fourcc = cv2.VideoWriter_fourcc(*codec)
-            
-            texture_output_path = os.path.join(videopath, f"{filename}{ext}")
-            depth_output_path = os.path.join(videopath, f"{filename}_depth{ext}")
-            
-            tv_writer = cv2.VideoWriter(
-                texture_output_path, 
-                fourcc, fps, upscale_size
-            )
-            
-            dv_writer = cv2.VideoWriter(
-                depth_output_path, 
-                fourcc, fps, upscale_size
-            )
-            
-            if tv_writer.isOpened() and dv_writer.isOpened():
-                print(f"Successfully created video writers using codec: {codec}")
-                break
-            else:
-                # Close failed writers and try next codec
-                tv_writer.release()
-                dv_writer.release()
-                tv_writer = None
-                dv_writer = None
-        except Exception as e:
-            print(f"Failed to create video writers with codec {codec}: {e}")
-            continue
+    tv_writer = open_video_writer(texture_output_path, fps, params['upscale_size'], fourccs=['mp4v'])
+    dv_writer = open_video_writer(depth_output_path, fps, params['upscale_size'], fourccs=['mp4v'])
     
     if tv_writer is None or dv_writer is None:
         print("Warning: Could not create video writers with any codec.")
@@ -504,6 +1291,7 @@ def improve_depth(filename):
     num_frames = 1
     prev_depth_frame = None
     prev_img = None
+    chain_intact = True  # all frames so far are unchanged since the stored run
     
     start_frame = int(fps * params['starting_point_in_sec'])
     end_frame = min(total_num_frames, int(start_frame + fps * params['video_duration']))
@@ -514,212 +1302,51 @@ def improve_depth(filename):
         depth_video.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
     
     
-    for t in range(start_frame, end_frame):
-        print(f"\nProcessing depth for frame {t:05d} / {end_frame}")
-        
-        # Read frames
-        ret, img = texture_video.read()
-        ret_d, depth = depth_video.read()
-        
-        if not ret or not ret_d:
-            print(f"Error reading frame {t}")
-            break
-                      
-        # Convert to float and normalize
-        img = img.astype(np.float32) / 255.0
-        depth = cv2.normalize(depth, None, 0, 255, cv2.NORM_MINMAX)
-        depth = np.uint8(depth)
-
-        
-        # Apply left/right cropping if needed
-        img = imcut(img, params['left_right'])
-        depth = imcut(depth, params['left_right'])
-        
-        origimg = img.copy()
-        
-        # Use only the first channel if depth is RGB
-        if len(depth.shape) == 3 and depth.shape[2] > 1:
-            # Use first channel for processing
-            depth_processing = depth[:,:,0].copy()
-        else:
-            depth_processing = depth.copy()
-        
-        
-        # Image padding to handle artifacts around boundaries
-        pad_size = params['pad_size']
-        # Circular padding in x-direction
-        img_padded = np.pad(img, ((0, 0), (pad_size, pad_size), (0, 0)), mode='wrap')
-        # Symmetric padding in y-direction
-        img_padded = np.pad(img_padded, ((pad_size, pad_size), (0, 0), (0, 0)), mode='symmetric')
-        origimg_pad = img_padded.copy()
-        
-        # Padding for depth
-        if len(depth_processing.shape) == 2:
-            # Circular padding in x-direction
-            depth_padded = np.pad(depth_processing, ((0, 0), (pad_size, pad_size)), mode='wrap')
-            # Symmetric padding in y-direction
-            depth_padded = np.pad(depth_padded, ((pad_size, pad_size), (0, 0)), mode='symmetric')
-        
-        padarray_size = depth_padded.shape
-        
-        # Resize for processing
-        img_resized = cv2.resize(img_padded, params['downscale_size'])
-        depth_resized = cv2.resize(depth_padded, params['downscale_size'])
-        
-        # Edge detection
-        edgemap_img = detect_edges(img_resized)
-        
-        # Prepare depth for edge detection if needed
-        if len(depth_resized.shape) == 2:
-            depth_3ch = np.stack([depth_resized] * 3, axis=2)
-        else:
-            depth_3ch = depth_resized
-            
-        depth_edges = detect_edges(depth_3ch)
-        
-        # Combine edge maps
-        if len(edgemap_img.shape) == 2 and len(depth_edges.shape) == 2:
-            edgemap = edgemap_img + depth_edges
-        else:
-            # Handle different dimensions
-            if len(edgemap_img.shape) == 3 and len(depth_edges.shape) == 2:
-                edgemap = edgemap_img[:,:,0] + depth_edges
-            elif len(edgemap_img.shape) == 2 and len(depth_edges.shape) == 3:
-                edgemap = edgemap_img + depth_edges[:,:,0]
-            else:
-                edgemap = edgemap_img[:,:,0] + depth_edges[:,:,0]
-        
-        # Normalize combined edge map
-        edgemap = edgemap / (edgemap.max() + 1e-10)
-        
-        # Create mask (valid pixels)
-        maskimg = np.ones_like(depth_resized)
-        
-        # Compute data weight
-        weight_data = compute_depth_weight(depth_resized, params)
-        
-        # Apply median filter to weights
-        weight_filtered = median_filter(weight_data, size=3)
-        
-        # Scale lambdas by the weight
-        data_lambda = vectorize_any(weight_filtered) * params['lambda_data']
-        
-        # Compute edge-aware weights
-        weights = {'w_rs': weight_compute(edgemap, params['wrs_window_size'], params['weight_type'])}
-        
-        # Compute smoothness weights
-        if len(depth_resized.shape) == 2:
-            weights['w_sm'] = eight_neighbour_extract(compute_smoothness_weight(depth_resized, params))
-        else:
-            weights['w_sm'] = eight_neighbour_extract(compute_smoothness_weight(depth_resized[:,:,0], params))
-        
-        # Save edge maps and weights for debugging
-        cv2.imwrite(os.path.join(edgepath, f'edge_{num_frames:04d}.png'), (edgemap * 255).astype(np.uint8))
-        cv2.imwrite(os.path.join(w_datapath, f'data_weight_{num_frames:04d}.png'), 
-                   (weight_filtered * 255).astype(np.uint8))
-        
-        # Process differently if not the first frame
-        if num_frames > 1 and prev_img is not None and prev_depth_frame is not None:
-            # Flow estimation for temporal consistency
-            vx, vy, flows = Coarse2FineTwoFrames(prev_img, img_resized, para)
-            
-            # Save flow visualization
-            flow_color = flowToColor(flows)
-            # cv2.imwrite(os.path.join(flowpath, f'flow_{num_frames:04d}.png'), (flow_color * 255).astype(np.uint8))
-            
-            # Depth cleaning with temporal consistency
-            depth_propagated = optimize_objective_temporal(
-                depth_resized, weights, maskimg, flows, prev_depth_frame, params
-            )
-        else:
-            # Depth cleaning without temporal consistency for first frame
-            depth_propagated = optimize_objective(depth_resized, weights, maskimg, params)
-        
-        # Save current frame data for next iteration
-        prev_depth_frame = depth_propagated.copy()
-        prev_img = img_resized.copy()
-        
-        # Resize back to original padded size
-        if len(padarray_size) == 2:
-            depth_propagated_resized = cv2.resize(depth_propagated, (padarray_size[1], padarray_size[0]))
-        else:
-            depth_propagated_resized = cv2.resize(depth_propagated, (padarray_size[1], padarray_size[0]))
-        
-        # Clip values to [0, 1]
-        depth_propagated_resized = clip01(depth_propagated_resized)
-        
-        # Bilateral filtering for edge-aware smoothing
-        if len(origimg_pad.shape) == 3:
-            greyimg_pad = cv2.cvtColor(origimg_pad.astype(np.float32), cv2.COLOR_RGB2GRAY)
-        else:
-            greyimg_pad = origimg_pad.astype(np.float32)
+    if params['segment_workers'] > 1 and end_frame - start_frame > 2 * params['segment_overlap']:
+        # Overlapping temporal segments refined in parallel processes
+        improve_depth_segments(filename, start_frame, end_frame, texture_video, tv_writer, dv_writer,
+                               statepath, resume)
+    else:
+        # Frames are decoded ahead in a separate process (see video_io.open_frame_reader)
+        reader_paths = [os.path.join(texture_path, f"{filename}.mp4"), os.path.join(depth_path, f"{filename}_depth.mp4")]
+        with open_frame_reader(reader_paths, range(start_frame, end_frame)) as reader:
+            for t, (img, depth) in reader:
+                print(f"\nProcessing depth for frame {t:05d} / {end_frame}")
+                
+                with telemetry.span("improve_depth_frame", "frame", frame=t):
+                    fingerprint = hash_frames(img, depth)[:16]
+                    frame = prepare_depth_frame(img, depth, params)
+                    
+                    # Reuse the solve of a previous run when resuming, as long as this frame and all
+                    # frames before it are unchanged (the temporal term links each frame to the previous)
+                    state_file = os.path.join(statepath, f'depth_{t:05d}_{fingerprint}.npy')
+                    if resume and chain_intact and os.path.exists(state_file):
+                        depth_propagated = np.load(state_file)
+                    else:
+                        if resume and chain_intact and t > start_frame:
+                            print(f"Frame {t} changed or not solved yet, refining from here on")
+                        chain_intact = False
+                        depth_propagated = refine_depth_frame(
+                            frame['img_resized'], frame['depth_resized'], prev_img, prev_depth_frame, params, debugpath, num_frames
+                        )
+                        if resume:
+                            for stale_file in glob.glob(os.path.join(statepath, f'depth_{t:05d}_*.npy')):
+                                os.remove(stale_file)
+                            np.save(state_file, depth_propagated)
+                    
+                    # Save current frame data for next iteration
+                    prev_depth_frame = depth_propagated.copy()
+                    prev_img = frame['img_resized'].copy()
+                    
+                    orig_resized_uint8 = texture_output_frame(frame['origimg'], params)
+                    depth_bilateral_uint8 = finish_depth_frame(depth_propagated, frame, params)
+                    
+                    write_output_frames(tv_writer, dv_writer, videopath, filename, t, orig_resized_uint8, depth_bilateral_uint8)
+                
+                num_frames += 1
             
-        min_val = np.min(greyimg_pad)
-        max_val = np.max(greyimg_pad)
-        
-        # Apply joint bilateral filter using the guide image
-        try:
-            depth_bilateral = bilateralFilter(
-                depth_propagated_resized, greyimg_pad, min_val, max_val, params['bilateral_sigma']
-            )
-        except Exception as e:
-            print(f"Error in bilateral filtering: {e}")
-            depth_bilateral = depth_propagated_resized
-        
-        # Crop padding
-        if len(depth_bilateral.shape) == 2:
-            depth_bilateral = depth_bilateral[pad_size:padarray_size[0]-pad_size, 
-                                             pad_size:padarray_size[1]-pad_size]
-        else:
-            depth_bilateral = depth_bilateral[pad_size:padarray_size[0]-pad_size, 
-                                              pad_size:padarray_size[1]-pad_size]
-        
-        # Upsampling
-        if params['upsampling'] == 'bilinear':
-            depth_bilateral = cv2.resize(depth_bilateral, upscale_size)
-        elif params['upsampling'] == 'bgu':
-            # Fallback to bilinear if BGU is not implemented
-            depth_bilateral = cv2.resize(depth_bilateral, upscale_size)
-            print("BGU upsampling not implemented, using bilinear instead")
-        
-        # Write frames to video
-        orig_resized = cv2.resize(origimg, upscale_size)
-        
-        # Convert floating point images to uint8 for video writing
-        orig_resized_uint8 = (orig_resized * 255).astype(np.uint8)
-        
-        # Ensure depth represents only depth information (white = closer)
-        # If depth is single channel, convert to 3-channel for video writing
-        if len(depth_bilateral.shape) == 2:
-            # Create a pure depth representation - single channel to 3-channel BGR
-            # Keep the original depth convention (white = closer)
-            depth_bilateral_uint8 = (depth_bilateral * 255).astype(np.uint8)
-            # depth_bilateral_uint8 = cv2.cvtColor(depth_bilateral_uint8, cv2.COLOR_GRAY2BGR)
-        else:
-            # For multi-channel depth, use only first channel for actual depth
-            # and make all channels the same to represent only depth
-            # Preserve the original depth convention (white = closer)
-            depth_channel = depth_bilateral[:,:,0]  # Use first channel as depth
-            depth_bilateral_uint8 = np.stack([depth_channel, depth_channel, depth_channel], axis=2)
-            depth_bilateral_uint8 = (depth_bilateral_uint8 * 255).astype(np.uint8)
-        
-        # Save frames - either to video or as images
-        if tv_writer is not None and tv_writer.isOpened() and dv_writer is not None and dv_writer.isOpened():
-            try:
-                tv_writer.write(orig_resized_uint8)
-                dv_writer.write(depth_bilateral_uint8)
-            except Exception as e:
-                print(f"Error writing frame to video: {e}")
-                # Save individual frames as fallback
-                cv2.imwrite(os.path.join(videopath, f"{filename}_{t:04d}.png"), orig_resized_uint8)
-                cv2.imwrite(os.path.join(videopath, f"{filename}_depth_{t:04d}.png"), depth_bilateral_uint8)
-        else:
-            # Save individual frames if video writers are not available
-            print("no video writer, saving individual frames instead")
-            cv2.imwrite(os.path.join(videopath, f"{filename}_{t:04d}.png"), orig_resized_uint8)
-            cv2.imwrite(os.path.join(videopath, f"{filename}_depth_{t:04d}.png"), depth_bilateral_uint8)
-        
-        num_frames += 1
+            if reader.failed_frame is not None:
+                print(f"Error reading frame {reader.failed_frame}")
     
     # Release video resources
     texture_video.release()
@@ -1,13 +1,16 @@
 import os
 import numpy as np
 import cv2
+from intermediates import write_image16
+from video_io import open_frame_reader, probe_videos
 
-def create_extrapolated_layer(filename):
+def create_extrapolated_layer(filename, max_frames=None):
     """
     Create the extrapolated layer from the RGB and depth videos.
     
     Args:
         filename: Base name of the video file
+        max_frames: Only sample the first max_frames frames (quick first-pass background)
     """
     in_path = "_input_videos"
     out_path = f"_extrapolated_layer/{filename}"
@@ -17,25 +20,13 @@ def create_extrapolated_layer(filename):
     rgb_path = os.path.join(in_path, f"{filename}.mp4")
     depth_path = os.path.join(f"_improved_depth/{filename}/videos", f"{filename}_depth.mp4")
     
-    fg_rgb_vid = cv2.VideoCapture(rgb_path)
-    fg_depth_vid = cv2.VideoCapture(depth_path)
+    # Get frame count and size (raises if the videos cannot be opened)
+    total_frames, shapes = probe_videos([rgb_path, depth_path])
+    height, width = shapes[0][:2]
     
-    if not fg_rgb_vid.isOpened() or not fg_depth_vid.isOpened():
-        raise ValueError(f"Could not open video files: {rgb_path} and {depth_path}")
-    
-    # Get frame for size reference
-    ret_rgb, rgb_tex = fg_rgb_vid.read()
-    ret_depth, d_tex = fg_depth_vid.read()
-    
-    if not ret_rgb or not ret_depth:
-        raise ValueError("Could not read frames from videos")
-    
-    height, width = rgb_tex.shape[:2]
-    
-    # Determine total frames and sample frames
-    total_frames_rgb = int(fg_rgb_vid.get(cv2.CAP_PROP_FRAME_COUNT))
-    total_frames_depth = int(fg_depth_vid.get(cv2.CAP_PROP_FRAME_COUNT))
-    total_frames = min(total_frames_rgb, total_frames_depth)
+    # Determine sample frames
+    if max_frames is not None:
+        total_frames = min(total_frames, max_frames)
     n_frames = min(300, total_frames)  # Sample up to 300 frames
     frame_samples = np.round(np.linspace(0, total_frames - 1, n_frames)).astype(int)
     
@@ -45,24 +36,21 @@ def create_extrapolated_layer(filename):
     rgb_block_g = np.zeros((height, width, n_frames), dtype=np.float32)
     rgb_block_b = np.zeros((height, width, n_frames), dtype=np.float32)
     
-    # Read and store frames
-    for idx, frame_no in enumerate(frame_samples):
-        fg_rgb_vid.set(cv2.CAP_PROP_POS_FRAMES, frame_no)
-        fg_depth_vid.set(cv2.CAP_PROP_POS_FRAMES, frame_no)
-        
-        ret_rgb, rgb_tex = fg_rgb_vid.read()
-        ret_depth, d_tex = fg_depth_vid.read()
-        
-        if not ret_rgb or not ret_depth:
-            continue
-        
-        rgb_tex = rgb_tex.astype(np.float32) / 255.0  # Normalize to [0,1]
-        d_tex = d_tex.astype(np.float32) / 255.0
-        
-        rgb_block_r[:, :, idx] = rgb_tex[:, :, 0]
-        rgb_block_g[:, :, idx] = rgb_tex[:, :, 1]
-        rgb_block_b[:, :, idx] = rgb_tex[:, :, 2]
-        depth_block[:, :, idx] = d_tex[:, :, 0]
+    # Read and store frames, decoded ahead in a separate process (see video_io.open_frame_reader)
+    frames_read = 0
+    with open_frame_reader([rgb_path, depth_path], frame_samples.tolist()) as reader:
+        for idx, (_, (rgb_tex, d_tex)) in enumerate(reader):
+            rgb_tex = rgb_tex.astype(np.float32) / 255.0  # Normalize to [0,1]
+            d_tex = d_tex.astype(np.float32) / 255.0
+            
+            rgb_block_r[:, :, idx] = rgb_tex[:, :, 0]
+            rgb_block_g[:, :, idx] = rgb_tex[:, :, 1]
+            rgb_block_b[:, :, idx] = rgb_tex[:, :, 2]
+            depth_block[:, :, idx] = d_tex[:, :, 0]
+            frames_read += 1
+    
+    if frames_read == 0:
+        raise ValueError("Could not read frames from videos")
     
     # Compute robust median of the min depth values
     sorted_depth = np.sort(depth_block, axis=2)
@@ -76,6 +64,7 @@ def create_extrapolated_layer(filename):
     
     # Save images
     cv2.imwrite(os.path.join(out_path, f"{filename}_BG.png"), (color_out * 255).astype(np.uint8))
-    cv2.imwrite(os.path.join(out_path, f"{filename}_BG_depth.png"), (depth_out * 255).astype(np.uint8))
+    # 16-bit depth, quantized to 8 bits only when exported to the viewer
+    write_image16(os.path.join(out_path, f"{filename}_BG_depth.png"), depth_out)
     
     print(f"Extrapolated layer created successfully for {filename}.")
@@ -2,8 +2,34 @@ import os
 import numpy as np
 import cv2
 from scipy import ndimage
+from intermediates import read_image, write_image16
+
+# Inpainting parameters
+inpaint_params = {
+    'method': 'ns',          # 'ns' (full resolution) or 'pyramid' (coarse-to-fine)
+    'radius': 3,             # inpainting radius in pixels
+    'pyramid_levels': 3,     # number of 2x pyramid levels below the full resolution
+    'band_width': 8          # width of the refined band inside the hole boundary
+}
+
+def inpaint_nans(mat, method=None):
+    """
+    Fill NaN values of a single-channel image.
+
+    Args:
+        mat: 2D float array with NaNs marking the pixels to fill
+        method: 'ns' or 'pyramid' (default: inpaint_params['method'])
+
+    Returns:
+        Array with the NaN pixels inpainted
+    """
+    if method is None:
+        method = inpaint_params['method']
+
+    if method == 'pyramid':
+        return inpaint_nans_pyramid(mat, inpaint_params['pyramid_levels'],
+                                    inpaint_params['radius'], inpaint_params['band_width'])
 
-def inpaint_nans(mat):
     # Create a mask for NaN values
     mask = np.isnan(mat)
     
@@ -21,14 +47,85 @@ def inpaint_nans(mat):
     result = cv2.inpaint(
         src=mat_copy.astype(np.float32), 
         inpaintMask=mask_cv, 
-        inpaintRadius=3, 
+        inpaintRadius=inpaint_params['radius'], 
         flags=cv2.INPAINT_NS
     )
     
     return result
 
-def create_inpainted_layer(filename):
+def inpaint_nans_pyramid(mat, levels, radius, band_width):
+    """
+    Coarse-to-fine inpainting for large holes.
+    
+    The frame is halved level by level with masked averaging until the holes
+    are small, they are filled at the coarsest level, and the fill is carried
+    back up one level at a time: at each level the upsampled fill is the
+    initial value of the hole pixels and only a band of hole pixels next to the
+    known region is re-inpainted.
+    
+    Args:
+        mat: 2D float array with NaNs marking the pixels to fill
+        levels: Number of pyramid levels below the full resolution
+        radius: Inpainting radius in pixels
+        band_width: Width in pixels of the band refined at each level
+        
+    Returns:
+        Array with the NaN pixels inpainted
+    """
+    mask = np.isnan(mat)
+    
+    if not np.any(mask):
+        return mat
     
+    height, width = mat.shape
+    valid = (~mask).astype(np.float32)
+    values = np.where(mask, 0, mat).astype(np.float32)
+    
+    # Coarsest level: fill the (now small) holes directly
+    if levels == 0 or min(height, width) < 2:
+        return cv2.inpaint(
+            src=values,
+            inpaintMask=mask.astype(np.uint8) * 255,
+            inpaintRadius=radius,
+            flags=cv2.INPAINT_NS
+        )
+    
+    # Masked 2x downsampling: average only known pixels so the holes do not bleed in
+    coarse_size = (max(1, width // 2), max(1, height // 2))
+    coarse_weight = cv2.resize(valid, coarse_size, interpolation=cv2.INTER_AREA)
+    coarse_values = cv2.resize(values, coarse_size, interpolation=cv2.INTER_AREA)
+    coarse = coarse_values / np.maximum(coarse_weight, 1e-3)
+    coarse[coarse_weight < 1e-3] = np.nan
+    coarse = inpaint_nans_pyramid(coarse, levels - 1, radius, band_width)
+    
+    # Upsample the coarser fill as the initial value of the hole pixels
+    initial = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_LINEAR)
+    result = values
+    result[mask] = initial[mask]
+    
+    # Refine only the hole pixels close to the known region at this level
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * band_width + 1, 2 * band_width + 1))
+    near_known = cv2.dilate(valid.astype(np.uint8), kernel) > 0
+    band = mask & near_known
+    
+    if np.any(band):
+        result = cv2.inpaint(
+            src=result,
+            inpaintMask=band.astype(np.uint8) * 255,
+            inpaintRadius=radius,
+            flags=cv2.INPAINT_NS
+        )
+    
+    return result
+
+def create_inpainted_layer(filename, method=None):
+    """
+    Create the inpainted layer by filling the disoccluded regions of the extrapolated layer.
+    
+    Args:
+        filename: Base name of the video file
+        method: Inpainting method, 'ns' or 'pyramid' (default: inpaint_params['method'])
+    """
     in_path = os.path.join('_extrapolated_layer', filename, filename)
     out_path = os.path.join('_inpainted_layer', filename)
     
@@ -39,12 +136,12 @@ def create_inpainted_layer(filename):
     rgb_tex = cv2.imread(f"{in_path}_BG.png")
     rgb_tex = rgb_tex.astype(np.float32) / 255.0  # Convert to [0,1] range
     
-    d_encoded = cv2.imread(f"{in_path}_BG_depth.png")
-    d_encoded = d_encoded.astype(np.float32) / 255.0
+    # 8-bit or 16-bit depth, single channel
+    d_encoded = read_image(f"{in_path}_BG_depth.png", grayscale=True)
     
-    alpha = cv2.imread(f"{in_path}_BGA.png")
+    # Alpha may be stored with 1 or 3 identical channels
+    alpha = cv2.imread(f"{in_path}_BGA.png", cv2.IMREAD_GRAYSCALE)
     alpha = alpha.astype(np.float32) / 255.0
-    alpha = alpha[:,:,0]  # Use first channel
     
     # Process color channels
     inpainted = np.zeros_like(rgb_tex)
@@ -52,21 +149,17 @@ def create_inpainted_layer(filename):
     for i in range(3):
         bg_channel = rgb_tex[:,:,i].copy()
         bg_channel[alpha < 0.5] = np.nan
-        inpainted[:,:,i] = inpaint_nans(bg_channel)
+        inpainted[:,:,i] = inpaint_nans(bg_channel, method)
     
     # Save inpainted color image
     cv2.imwrite(os.path.join(out_path, f"{filename}_BG_inp.png"), 
                 (inpainted * 255).astype(np.uint8))
     
     # Process depth
-    bg_d = d_encoded[:,:,0].copy()
+    bg_d = d_encoded.copy()
     bg_d[alpha < 0.5] = np.nan
     
-    d_d = inpaint_nans(bg_d)
-    
-    depth_inpainted = np.zeros_like(d_encoded)
-    for i in range(3):
-        depth_inpainted[:,:,i] = d_d
+    d_d = inpaint_nans(bg_d, method)
     
-    cv2.imwrite(os.path.join(out_path, f"{filename}_BGD_inp.png"), 
-                (depth_inpainted * 255).astype(np.uint8))
\ No newline at end of file
+    # 16-bit depth, quantized to 8 bits only when exported to the viewer
+    write_image16(os.path.join(out_path, f"{filename}_BGD_inp.png"), d_d)
\ No newline at end of file
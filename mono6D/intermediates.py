@@ -0,0 +1,108 @@
+import os
+import shutil
+import numpy as np
+import cv2
+
+# Intermediate files exchanged between the stages keep more than 8 bits:
+# - orientation faces: one float16 .npy per frame, all six faces stacked, values in [0, 1]
+# - background depth: 16-bit single-channel PNG
+# Quantization to 8 bits happens only when the viewer files are exported.
+# The improved depth video is still written with 8 bits per pixel: the OpenCV video
+# writer cannot store 16-bit frames, so the extra precision ends at the background images.
+
+def faces_path(folder, filename, frame_idx):
+    """Path of the stacked orientation faces of a frame"""
+    return os.path.join(folder, f"{filename}_frame_{frame_idx:04d}_faces.npy")
+
+def count_face_frames(folder):
+    """Number of frames with stacked orientation faces in folder"""
+    return len([f for f in os.listdir(folder) if f.endswith('_faces.npy')])
+
+def write_faces(path, faces):
+    """
+    Save the six orientation faces of a frame.
+    
+    Args:
+        path: Output .npy file
+        faces: List of 6 float orientation maps in [0, 1] [right, left, top, bottom, front, back]
+    """
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.tmp{ext}"
+    np.save(tmp_path, np.stack(faces).astype(np.float16))
+    os.replace(tmp_path, path)
+
+def read_faces(path):
+    """
+    Memory-map the six orientation faces of a frame without reading or converting them.
+    
+    Returns:
+        float16 array of shape (6, face_size, face_size)
+    """
+    return np.load(path, mmap_mode='r')
+
+def write_image16(path, image):
+    """Save a float image in [0, 1] as a 16-bit PNG"""
+    cv2.imwrite(path, np.round(np.clip(image, 0, 1) * 65535).astype(np.uint16))
+
+def read_image(path, grayscale=False):
+    """
+    Read an 8-bit or 16-bit image as float32 in [0, 1].
+    
+    Args:
+        path: Image file
+        grayscale: Return a single channel (the first one of color images)
+    
+    Returns:
+        float32 image, or None if it could not be read
+    """
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        return None
+    if grayscale and image.ndim == 3:
+        image = image[:, :, 0]
+    return image.astype(np.float32) / np.iinfo(image.dtype).max
+
+def to_uint8(image):
+    """Quantize an 8-bit, 16-bit or float [0, 1] image to 8 bits"""
+    if image.dtype == np.uint8:
+        return image
+    if image.dtype == np.uint16:
+        return ((image.astype(np.uint32) + 128) // 257).astype(np.uint8)
+    return np.round(np.clip(image, 0, 1) * 255).astype(np.uint8)
+
+def export_file(src, dst):
+    """
+    Copy an intermediate file to the viewer, quantizing 16-bit images to 8 bits.
+    
+    The quantized images are written with 3 channels like the viewer files of the
+    8-bit pipeline.
+    
+    Args:
+        src: Intermediate file
+        dst: Viewer file
+    """
+    if src.endswith('.png'):
+        image = cv2.imread(src, cv2.IMREAD_UNCHANGED)
+        if image is not None and image.dtype != np.uint8:
+            image = to_uint8(image)
+            if image.ndim == 2:
+                image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+            cv2.imwrite(dst, image)
+            return
+    shutil.copyfile(src, dst)
+
+def background_viewer_files(filename):
+    """(source, viewer destination) pairs of the background layer images"""
+    return [
+        (f"_extrapolated_layer/{filename}/{filename}_BG.png", f"_vid2viewer/{filename}/{filename}_BG.png"),
+        (f"_extrapolated_layer/{filename}/{filename}_BG_depth.png", f"_vid2viewer/{filename}/{filename}_BGD.png"),
+        (f"_extrapolated_layer/{filename}/{filename}_BGA.png", f"_vid2viewer/{filename}/{filename}_BGA.png"),
+        (f"_inpainted_layer/{filename}/{filename}_BG_inp.png", f"_vid2viewer/{filename}/{filename}_BG_inp.png"),
+        (f"_inpainted_layer/{filename}/{filename}_BGD_inp.png", f"_vid2viewer/{filename}/{filename}_BGD_inp.png")
+    ]
+
+def cleanup_temp_files():
+    """Remove temporary processing directories."""
+    temp_dirs = ["_extrapolated_layer", "_improved_depth", "_inpainted_layer", "_triangle_orientations", "_checkpoints"]
+    for directory in temp_dirs:
+        shutil.rmtree(directory, ignore_errors=True)
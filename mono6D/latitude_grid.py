@@ -0,0 +1,134 @@
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix, diags
+
+# (height, width, pad_fraction, min_width, full_band) -> LatitudeGrid
+_grid_cache = {}
+
+def latitude_row_widths(height, width, pad_fraction=0.0, min_width=16, full_band=0.0):
+    """
+    Number of samples of every row of a latitude-adaptive grid.
+    
+    Args:
+        height, width: Size of the equirectangular frame
+        pad_fraction: Fraction of the rows at the top and at the bottom that are symmetric
+            padding beyond the poles (they mirror the latitudes inside the frame)
+        min_width: Minimum number of samples of a row
+        full_band: Rows within +-full_band degrees of the equator keep every pixel, the
+            other rows get width * |cos(latitude)| / cos(full_band) samples
+    
+    Returns:
+        Integer array of row widths in [min_width, width]
+    """
+    # Latitude of the row centers, the padding rows continue past +-90 degrees
+    inner = height * (1 - 2 * pad_fraction)
+    y = (np.arange(height) + 0.5 - height * pad_fraction) / inner
+    latitude = np.pi * (0.5 - y)
+    
+    widths = np.round(width * np.abs(np.cos(latitude)) / np.cos(np.radians(full_band))).astype(np.intp)
+    return np.clip(widths, min(min_width, width), width)
+
+class LatitudeGrid:
+    """
+    Equirectangular frame resampled to rows of width * cos(latitude) samples.
+    
+    Equirectangular frames oversample the poles by 1 / cos(latitude); solving on this grid
+    removes about a third of the unknowns while the rows of the equatorial band keep every pixel.
+    The grid is stored as a flat vector of all rows, with sparse matrices mapping to and from
+    the frame and an 8-neighbour graph Laplacian connecting neighbouring samples.
+    """
+    
+    def __init__(self, height, width, pad_fraction=0.0, min_width=16, full_band=0.0):
+        self.height = height
+        self.width = width
+        self.row_widths = latitude_row_widths(height, width, pad_fraction, min_width, full_band)
+        self.row_offsets = np.concatenate([[0], np.cumsum(self.row_widths)])
+        self.size = int(self.row_offsets[-1])
+        
+        self.downsample = self._area_matrix()
+        self.upsample = self._linear_matrix()
+        self._adjacency = self._adjacency_matrix()
+    
+    def _area_matrix(self):
+        """(grid size x frame size) matrix averaging the pixels covered by every sample"""
+        rows, cols, values = [], [], []
+        for r, samples in enumerate(self.row_widths):
+            scale = self.width / samples
+            j = np.arange(samples)
+            start, end = j * scale, (j + 1) * scale
+            for k in range(int(np.ceil(scale)) + 1):
+                pixel = np.floor(start).astype(np.intp) + k
+                overlap = np.minimum(pixel + 1, end) - np.maximum(pixel, start)
+                valid = (overlap > 1e-9) & (pixel < self.width)
+                rows.append(self.row_offsets[r] + j[valid])
+                cols.append(r * self.width + pixel[valid])
+                values.append(overlap[valid] / scale)
+        
+        shape = (self.size, self.height * self.width)
+        return csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), shape=shape)
+    
+    def _linear_matrix(self):
+        """(frame size x grid size) matrix interpolating every pixel linearly from its row"""
+        pixels = np.arange(self.width)
+        rows, cols, values = [], [], []
+        for r, samples in enumerate(self.row_widths):
+            x = np.clip((pixels + 0.5) * samples / self.width - 0.5, 0, samples - 1)
+            j0 = np.floor(x).astype(np.intp)
+            j1 = np.minimum(j0 + 1, samples - 1)
+            frac = x - j0
+            for j, weight in ((j0, 1 - frac), (j1, frac)):
+                rows.append(r * self.width + pixels)
+                cols.append(self.row_offsets[r] + j)
+                values.append(weight)
+        
+        shape = (self.height * self.width, self.size)
+        return csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), shape=shape)
+    
+    def _adjacency_matrix(self):
+        """Symmetric 0/1 matrix of the 8-neighbour connections between grid samples"""
+        rows, cols = [], []
+        for r, samples in enumerate(self.row_widths):
+            offset = self.row_offsets[r]
+            j = np.arange(samples)
+            
+            # East neighbour in the same row
+            rows.append(offset + j[:-1])
+            cols.append(offset + j[1:])
+            
+            # Nearest sample of the next row and its east and west neighbours
+            if r + 1 < self.height:
+                next_samples = self.row_widths[r + 1]
+                nearest = np.round((j + 0.5) * next_samples / samples - 0.5).astype(np.intp)
+                for shift in (-1, 0, 1):
+                    target = nearest + shift
+                    valid = (target >= 0) & (target < next_samples)
+                    rows.append(offset + j[valid])
+                    cols.append(self.row_offsets[r + 1] + target[valid])
+        
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        edges = coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(self.size, self.size)).tocsr()
+        
+        # Links found from both rows are merged, the result is symmetric with unit weights
+        adjacency = edges + edges.T
+        adjacency.data[:] = 1
+        return adjacency
+    
+    def laplacian(self, dtype=np.float64):
+        """Graph Laplacian (degree - adjacency) of the grid, 8 * I - neighbours in the interior"""
+        adjacency = self._adjacency.astype(dtype)
+        degree = np.asarray(adjacency.sum(axis=1)).ravel()
+        return (diags([degree], [0], format='csr', dtype=dtype) - adjacency).tocsr()
+    
+    def to_grid(self, image):
+        """Resample a frame (height x width) to the flat grid vector"""
+        return self.downsample @ np.ravel(image)
+    
+    def from_grid(self, values):
+        """Resample a flat grid vector back to a frame (height x width)"""
+        return (self.upsample @ values).reshape(self.height, self.width)
+
+def latitude_grid(height, width, pad_fraction=0.0, min_width=16, full_band=0.0):
+    """Cached LatitudeGrid for a frame size"""
+    key = (height, width, round(pad_fraction, 6), min_width, full_band)
+    if key not in _grid_cache:
+        _grid_cache[key] = LatitudeGrid(height, width, pad_fraction, min_width, full_band)
+    return _grid_cache[key]
@@ -4,13 +4,23 @@ import numpy as np
 import cv2
 from pathlib import Path
 
-from depth_improving import improve_depth
-from mesh_orientation import compute_triangle_orientations
-from compute_alpha import compute_transparency_values
+from depth_improving import improve_depth, params as depth_params
+from depth_generation import generate_depth, generation_params
+from mesh_orientation import compute_triangle_orientations, orientation_params
+from cubic2equi import projection_params
+from compute_alpha import (compute_transparency_values, alpha_output_path, read_alpha_frame,
+                           check_viewer_alpha_format)
 from extrapolated_layer import create_extrapolated_layer
-from inpainted_layer import create_inpainted_layer
+from inpainted_layer import create_inpainted_layer, inpaint_params
+from video_io import video_params
+from checkpoint import CheckpointStore, FrameCache
+from stage_graph import StageGraph
+from intermediates import export_file, background_viewer_files, cleanup_temp_files
+from viewer_bundle import bundle_viewer_files, bundle_params
+from telemetry import telemetry
 
-def main_process(filename):
+def main_process(filename, inpaint_method=None, alpha_format="bgr", resume=False, cleanup=True, incremental=False,
+                 bundle=False, cpu_budget=None, improve=False):
     """
     Main processing pipeline for motion parallax for 360° RGBD video.
     
@@ -23,7 +33,24 @@ def main_process(filename):
     
     Args:
         filename: Base name of the video file (without extension)
+        inpaint_method: Inpainting method for the inpainted layer, 'ns' or 'pyramid'
+        alpha_format: Alpha output, 'bgr' (3-channel video) or 'gray' (single-channel video);
+            the viewer cannot load 'png' frames, so they are rejected
+        resume: Skip stages whose inputs, parameters and outputs are unchanged since the
+            last run, and resume partially processed stages frame by frame
+        cleanup: Delete the intermediate folders at the end
+        incremental: Fingerprint the decoded frames and reuse per-frame results of earlier
+            runs from _frame_cache (kept by cleanup), so a re-cut or trimmed clip only
+            recomputes its changed frames
+        bundle: Also pack the background images into one atlas with a JSON manifest
+            (see viewer_bundle.bundle_params for the atlas format and depth/alpha muxing)
+        cpu_budget: Cores shared by the stages running concurrently (default: all cores,
+            1 runs the stages one after another)
+        improve: Run the Step 1 depth improvement with depth_improving.params (off by default,
+            the input videos are used directly)
     """
+    check_viewer_alpha_format(alpha_format)
+    
     print("Starting preprocessing pipeline...")
     
     # Create output directories
@@ -38,98 +65,273 @@ def main_process(filename):
     
     for directory in output_dirs:
         os.makedirs(directory, exist_ok=True)
+    
+    # Stage manifests used to skip up-to-date stages
+    checkpoints = CheckpointStore(f"_checkpoints/{filename}", enabled=resume)
+    
+    # The number of face threads does not change the orientations
+    orientation_settings = {key: value for key, value in orientation_params.items() if key != 'face_workers'}
+    
+    # Content-addressed per-frame results shared by all runs and clips
+    orientation_cache = alpha_cache = None
+    if incremental:
+        orientation_cache = FrameCache("_frame_cache/orientations", {'orientation_params': orientation_settings})
+        alpha_cache = FrameCache("_frame_cache/alpha", {'alpha_format': alpha_format})
+    
+    # Paths shared between stages
+    input_videos = [f"_input_videos/{filename}.mp4", f"_input_videos/{filename}_depth.mp4"]
+    improved_videos = [f"_improved_depth/{filename}/videos/{filename}.mp4",
+                       f"_improved_depth/{filename}/videos/{filename}_depth.mp4"]
+    fg_faces = f"_triangle_orientations/{filename}/{filename}_frame_*_faces.npy"
+    bg_faces = f"_extrapolated_layer/{filename}/_triangle_orientations/{filename}_BG_frame_*_faces.npy"
+    bg_images = [f"_extrapolated_layer/{filename}/{filename}_BG.png",
+                 f"_extrapolated_layer/{filename}/{filename}_BG_depth.png"]
+    bg_alpha = f"_extrapolated_layer/{filename}/{filename}_BGA.png"
 
     # Step 0: generate depth for video if none
-    # TODO:
-
+    if not os.path.exists(input_videos[1]):
+        print("GENERATING DEPTH")
+        with telemetry.span("depth_generation"):
+            generate_depth(filename)
 
-    # TODO: disable for now
-    improve = False
-
-    if improve:
-        # Step 1: Depth improvement
-        print("STARTING DEPTH PROCESSING")
-        improve_depth(filename)
-    else:
-        # directly copy input files
-        shutil.copy(f"_input_videos/{filename}.mp4", f"_improved_depth/{filename}/videos/{filename}.mp4")
-        shutil.copy(f"_input_videos/{filename}_depth.mp4", f"_improved_depth/{filename}/videos/{filename}_depth.mp4")
+    # Steps 1-7 as a dependency graph: every stage waits for the stages writing its inputs, so
+    # the foreground orientations and alpha (Steps 2-3) overlap with the background layer
+    # (Steps 4-7), which only needs the depth video
+    graph = StageGraph(cpu_budget)
+    
+    def depth_stage(cores):
+        if improve:
+            # Step 1: Depth improvement
+            print("STARTING DEPTH PROCESSING")
+            improve_depth(filename, resume=resume or incremental)
+        else:
+            # directly copy input files
+            shutil.copy(f"_input_videos/{filename}.mp4", f"_improved_depth/{filename}/videos/{filename}.mp4")
+            shutil.copy(f"_input_videos/{filename}_depth.mp4", f"_improved_depth/{filename}/videos/{filename}_depth.mp4")
     
+    graph.add(checkpoints.stage("depth", input_videos, improved_videos,
+                                {'improve': improve, 'depth_params': depth_params if improve else None}),
+              depth_stage)
     
     # Step 2: Compute triangle orientations
-    print("COMPUTING TRIANGLE ORIENTATIONS")
-    input_dir = f"_improved_depth/{filename}/videos/"
-    output_dir = f"_triangle_orientations/{filename}"
-    compute_triangle_orientations(input_dir, filename, output_dir)
+    orientations = checkpoints.stage("orientations", improved_videos, [fg_faces],
+                                     {'orientation_params': orientation_settings})
+    
+    def orientations_stage(cores):
+        print("COMPUTING TRIANGLE ORIENTATIONS")
+        input_dir = f"_improved_depth/{filename}/videos/"
+        output_dir = f"_triangle_orientations/{filename}"
+        # Frames of an interrupted run are only reused if it read the same videos with the same
+        # parameters, otherwise compute_triangle_orientations deletes them first
+        resume_frames = orientations.start()
+        compute_triangle_orientations(input_dir, filename, output_dir, resume=resume_frames,
+                                      frame_cache=orientation_cache, face_workers=cores)
+    
+    graph.add(orientations, orientations_stage, cores=orientation_params['face_workers'])
     
     # Step 3: Compute transparency values
-    print("COMPUTING TRANSPARENCY VALUES")
-    triangle_folder = f"_triangle_orientations/{filename}"
-    compute_transparency_values(triangle_folder, filename)
+    def alpha_stage(cores):
+        print("COMPUTING TRANSPARENCY VALUES")
+        triangle_folder = f"_triangle_orientations/{filename}"
+        compute_transparency_values(triangle_folder, filename, alpha_format, frame_cache=alpha_cache)
+    
+    graph.add(checkpoints.stage("alpha", [fg_faces],
+                                [alpha_output_path(f"_triangle_orientations/{filename}", filename, alpha_format)],
+                                {'alpha_format': alpha_format}),
+              alpha_stage)
     
     # Step 4: Create extrapolated layer
-    print("COMPUTING EXTRAPOLATED LAYER")
-    create_extrapolated_layer(filename)
+    def extrapolated_layer_stage(cores):
+        print("COMPUTING EXTRAPOLATED LAYER")
+        create_extrapolated_layer(filename)
+    
+    graph.add(checkpoints.stage("extrapolated_layer", [input_videos[0], improved_videos[1]], bg_images),
+              extrapolated_layer_stage)
     
     # Step 5: Compute triangle orientations for extrapolated layer
-    print("COMPUTING TRIANGLE ORIENTATIONS OF EXTRAPOLATED LAYER")
-    extrapolated_input = f"_extrapolated_layer/{filename}"
-    extrapolated_output = f"_extrapolated_layer/{filename}/_triangle_orientations"
-    compute_triangle_orientations(extrapolated_input, f"{filename}_BG", extrapolated_output)
+    def bg_orientations_stage(cores):
+        print("COMPUTING TRIANGLE ORIENTATIONS OF EXTRAPOLATED LAYER")
+        extrapolated_input = f"_extrapolated_layer/{filename}"
+        extrapolated_output = f"_extrapolated_layer/{filename}/_triangle_orientations"
+        compute_triangle_orientations(extrapolated_input, f"{filename}_BG", extrapolated_output, face_workers=cores)
+    
+    graph.add(checkpoints.stage("bg_orientations", bg_images, [bg_faces]), bg_orientations_stage,
+              cores=orientation_params['face_workers'])
     
     # Step 6: Compute transparency values for extrapolated layer
-    print("COMPUTING TRANSPARENCY VALUES OF EXTRAPOLATED LAYER")
-    compute_transparency_values(f"_extrapolated_layer/{filename}/_triangle_orientations", f"{filename}_BG")
+    def bg_alpha_stage(cores):
+        print("COMPUTING TRANSPARENCY VALUES OF EXTRAPOLATED LAYER")
+        compute_transparency_values(f"_extrapolated_layer/{filename}/_triangle_orientations", f"{filename}_BG", alpha_format)
+        
+        # Save alpha image (single-channel unless alpha_format is 'bgr')
+        alpha_frame = read_alpha_frame(f"_extrapolated_layer/{filename}/_triangle_orientations", f"{filename}_BG", alpha_format)
+        if alpha_frame is not None:
+            cv2.imwrite(bg_alpha, alpha_frame)
     
-    # Save alpha image
-    bg_alpha_video = cv2.VideoCapture(f"_extrapolated_layer/{filename}/_triangle_orientations/{filename}_BG_alphaproc.mp4")
-    ret, alpha_frame = bg_alpha_video.read()
-    if ret:
-        cv2.imwrite(f"_extrapolated_layer/{filename}/{filename}_BGA.png", alpha_frame)
-    bg_alpha_video.release()
+    graph.add(checkpoints.stage("bg_alpha", [bg_faces], [bg_alpha], {'alpha_format': alpha_format}), bg_alpha_stage)
     
     # Step 7: Create inpainted layer
-    print("COMPUTING INPAINTED LAYER")
-    create_inpainted_layer(filename)
+    def inpainted_layer_stage(cores):
+        print("COMPUTING INPAINTED LAYER")
+        create_inpainted_layer(filename, inpaint_method)
+    
+    graph.add(checkpoints.stage("inpainted_layer", bg_images + [bg_alpha],
+                                [f"_inpainted_layer/{filename}/{filename}_BG_inp.png",
+                                 f"_inpainted_layer/{filename}/{filename}_BGD_inp.png"],
+                                {'inpaint_method': inpaint_method, 'inpaint_params': inpaint_params}),
+              inpainted_layer_stage)
+    
+    graph.run()
     
     # Step 8: Save final files to viewer directory
     print("SAVING INTO _vid2viewer FOLDER")
-    copy_files_to_viewer(filename)
+    with telemetry.span("copy_files_to_viewer"):
+        copy_files_to_viewer(filename, alpha_format)
+    
+    if bundle:
+        print("PACKING VIEWER BUNDLE")
+        with telemetry.span("bundle_viewer_files"):
+            bundle_viewer_files(f"_vid2viewer/{filename}", filename, alpha_format)
     
     # Step 9: Clean up temporary files (optional)
-    print("DELETING TEMPORARY FILES")
-    # Uncomment to enable cleanup
-    cleanup_temp_files()
+    if cleanup:
+        print("DELETING TEMPORARY FILES")
+        cleanup_temp_files()
     
     print("Processing complete! Files are ready for the viewer.")
 
-def copy_files_to_viewer(filename):
-    """Copy the processed files to the viewer directory."""
+def copy_files_to_viewer(filename, alpha_format="bgr"):
+    """Copy the processed files to the viewer directory, quantizing 16-bit images to 8 bits."""
+    alpha_src = alpha_output_path(f"_triangle_orientations/{filename}", filename, alpha_format)
+    alpha_dst = alpha_output_path(f"_vid2viewer/{filename}", filename, alpha_format)
+    
     src_files = [
         (f"_improved_depth/{filename}/videos/{filename}.mp4", f"_vid2viewer/{filename}/{filename}.mp4"),
-        (f"_improved_depth/{filename}/videos/{filename}_depth.mp4", f"_vid2viewer/{filename}/{filename}_depth.mp4"),
-        (f"_triangle_orientations/{filename}/{filename}_alphaproc.mp4", f"_vid2viewer/{filename}/{filename}_alphaproc.mp4"),
-        (f"_extrapolated_layer/{filename}/{filename}_BG.png", f"_vid2viewer/{filename}/{filename}_BG.png"),
-        (f"_extrapolated_layer/{filename}/{filename}_BG_depth.png", f"_vid2viewer/{filename}/{filename}_BGD.png"),
-        (f"_extrapolated_layer/{filename}/{filename}_BGA.png", f"_vid2viewer/{filename}/{filename}_BGA.png"),
-        (f"_inpainted_layer/{filename}/{filename}_BG_inp.png", f"_vid2viewer/{filename}/{filename}_BG_inp.png"),
-        (f"_inpainted_layer/{filename}/{filename}_BGD_inp.png", f"_vid2viewer/{filename}/{filename}_BGD_inp.png")
-    ]
+        (f"_improved_depth/{filename}/videos/{filename}_depth.mp4", f"_vid2viewer/{filename}/{filename}_depth.mp4")
+    ] + background_viewer_files(filename)
     
     for src, dst in src_files:
-        shutil.copyfile(src, dst)
-
-def cleanup_temp_files():
-    """Remove temporary processing directories."""
-    temp_dirs = ["_extrapolated_layer", "_improved_depth", "_inpainted_layer", "_triangle_orientations"]
-    for directory in temp_dirs:
-        shutil.rmtree(directory, ignore_errors=True)
+        export_file(src, dst)
+    
+    shutil.copyfile(alpha_src, alpha_dst)
 
 if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description="Process 360° RGBD video for motion parallax.")
     parser.add_argument("filename", help="Base name of the video file (without extension)")
+    parser.add_argument("--inpaint-method", choices=["ns", "pyramid"], default=None,
+                        help="Inpainting method for the background layer (default: ns)")
+    parser.add_argument("--alpha-format", choices=["bgr", "gray"], default="bgr",
+                        help="Alpha output: 3-channel or single-channel video")
+    parser.add_argument("--video-backend", choices=["opencv", "ffmpeg"], default="opencv",
+                        help="Video writer backend (ffmpeg pipes raw frames to an x264/x265 subprocess)")
+    parser.add_argument("--video-reader", choices=["ring", "opencv"], default=video_params['reader'],
+                        help="Video decoding: ahead of the computation in a separate process (ring) or in-process")
+    parser.add_argument("--codec", choices=["libx264", "libx265"], default=video_params['codec'],
+                        help="Encoder for the ffmpeg backend")
+    parser.add_argument("--crf", type=int, default=video_params['crf'], help="CRF for the ffmpeg backend")
+    parser.add_argument("--improve-depth", action="store_true",
+                        help="Run the Step 1 depth improvement (off by default, the depth flags below need it)")
+    parser.add_argument("--depth-workers", type=int, default=depth_params['segment_workers'],
+                        help="Refine the depth in this many overlapping temporal segments in parallel")
+    parser.add_argument("--edge-filter", choices=["guided", "fgs", "bilateral_grid", "joint_bilateral"],
+                        default=depth_params['edge_filter'],
+                        help="Edge-aware filter of the depth improvement (guided, fgs and bilateral_grid are faster "
+                             "approximations of joint_bilateral)")
+    parser.add_argument("--depth-precision", choices=["float32", "float64"], default=depth_params['precision'],
+                        help="Floating-point precision of the depth refinement solve (float64 for validation)")
+    parser.add_argument("--depth-solve-grid", choices=["equirect", "latitude"], default=depth_params['solve_grid'],
+                        help="Grid of the depth refinement solve (latitude: fewer samples towards the poles)")
+    parser.add_argument("--depth-solve-domain", choices=["equirect", "cubemap"], default=depth_params['solve_domain'],
+                        help="Domain of the depth refinement solve (cubemap: six cube faces solved in parallel)")
+    parser.add_argument("--cube-workers", type=int, default=depth_params['cube_workers'],
+                        help="Processes solving the cube faces with --depth-solve-domain cubemap")
+    parser.add_argument("--depth-upsampling", choices=["bilinear", "bgu"], default=depth_params['upsampling'],
+                        help="Upsampling of the refined depth (bgu: bilateral guided upsampling from a lower "
+                             "processing resolution)")
+    parser.add_argument("--depth-model", default=generation_params['weights'],
+                        help="Monocular depth network (e.g. ONNX, read with cv2.dnn), required for clips "
+                             "without a depth video")
+    parser.add_argument("--kernels", choices=["reference", "fast"], default=orientation_params['backend'],
+                        help="Orientation and projection kernels (fast: vectorized with the same output, checked "
+                             "by benchmarks/check_equivalence.py)")
+    parser.add_argument("--adaptive-orientations", action="store_true",
+                        help="Compute triangle orientations at full resolution only where the depth is not flat "
+                             "(faster than --kernels fast only on mostly flat cube faces)")
+    parser.add_argument("--face-workers", type=int, default=orientation_params['face_workers'],
+                        help="Workers computing the six cube faces of a frame in parallel: threads with --kernels fast, "
+                             "processes with the reference kernels (1: one after another)")
+    parser.add_argument("--cpu-budget", type=int, default=None,
+                        help="Cores shared by the pipeline stages running concurrently (default: all, 1: sequential)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip up-to-date stages and resume interrupted stages frame by frame")
+    parser.add_argument("--keep-temp", action="store_true",
+                        help="Keep the intermediate folders (needed for --resume on later runs)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Reuse per-frame results of earlier runs for frames whose content is unchanged")
+    parser.add_argument("--stream", action="store_true",
+                        help="Produce viewer assets progressively (first-pass background, then video segments "
+                             "followed by the web viewer); use --kernels fast for a quick first preview")
+    parser.add_argument("--preview-frames", type=int, default=None,
+                        help="Frames used for the first-pass background in --stream mode")
+    parser.add_argument("--segment-frames", type=int, default=None,
+                        help="Frames per video segment in --stream mode")
+    parser.add_argument("--bundle", action="store_true",
+                        help="Pack the background images into one atlas with a JSON manifest for the viewer")
+    parser.add_argument("--bundle-format", choices=["png", "webp"], default=bundle_params['image_format'],
+                        help="Atlas encoding (webp is lossless)")
+    parser.add_argument("--mux", choices=["top_bottom", "side_by_side"], default=None,
+                        help="With --bundle, also combine the depth and alpha videos into one video")
+    parser.add_argument("--trace", default=None,
+                        help="Save a per-stage and per-frame timing trace to this file")
+    parser.add_argument("--trace-format", choices=["json", "csv", "chrome"], default=None,
+                        help="Trace format (default: from the file extension, json otherwise)")
     args = parser.parse_args()
     
-    main_process(args.filename)
\ No newline at end of file
+    # The depth flags only configure Step 1, which is skipped without --improve-depth
+    depth_flags = {"--depth-workers": "depth_workers", "--edge-filter": "edge_filter",
+                   "--depth-precision": "depth_precision", "--depth-solve-grid": "depth_solve_grid",
+                   "--depth-solve-domain": "depth_solve_domain", "--cube-workers": "cube_workers",
+                   "--depth-upsampling": "depth_upsampling"}
+    ignored = [flag for flag, dest in depth_flags.items() if getattr(args, dest) != parser.get_default(dest)]
+    if ignored and not args.improve_depth:
+        parser.error(f"--improve-depth is required by {', '.join(ignored)}")
+    
+    video_params['backend'] = args.video_backend
+    video_params['reader'] = args.video_reader
+    video_params['codec'] = args.codec
+    video_params['crf'] = args.crf
+    depth_params['segment_workers'] = args.depth_workers
+    depth_params['edge_filter'] = args.edge_filter
+    depth_params['precision'] = args.depth_precision
+    depth_params['solve_grid'] = args.depth_solve_grid
+    depth_params['solve_domain'] = args.depth_solve_domain
+    depth_params['cube_workers'] = args.cube_workers
+    depth_params['upsampling'] = args.depth_upsampling
+    generation_params['weights'] = args.depth_model
+    orientation_params['backend'] = args.kernels
+    projection_params['backend'] = args.kernels
+    orientation_params['adaptive'] = args.adaptive_orientations
+    orientation_params['face_workers'] = args.face_workers
+    bundle_params['image_format'] = args.bundle_format
+    bundle_params['mux'] = args.mux
+    
+    if args.trace is not None:
+        telemetry.enable()
+    
+    try:
+        if args.stream:
+            from streaming import stream_process
+            with telemetry.span("stream_process", clip=args.filename):
+                stream_process(args.filename, alpha_format=args.alpha_format, inpaint_method=args.inpaint_method,
+                               preview_frames=args.preview_frames, segment_frames=args.segment_frames,
+                               cleanup=not args.keep_temp, bundle=args.bundle, improve=args.improve_depth)
+        else:
+            with telemetry.span("main_process", clip=args.filename):
+                main_process(args.filename, inpaint_method=args.inpaint_method, alpha_format=args.alpha_format,
+                             resume=args.resume, cleanup=not args.keep_temp, incremental=args.incremental,
+                             bundle=args.bundle, cpu_budget=args.cpu_budget, improve=args.improve_depth)
+    finally:
+        if args.trace is not None:
+            telemetry.save(args.trace, args.trace_format)
\ No newline at end of file
@@ -6,8 +6,65 @@ import trimesh
 import math
 from scipy.spatial.transform import Rotation as R
 import matplotlib.pyplot as plt
+import threading
+import multiprocessing
+from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from telemetry import telemetry
+from thread_limits import child_process_env
+from checkpoint import hash_frames
+from intermediates import faces_path, write_faces
+from video_io import open_frame_reader, probe_videos
 
-def compute_triangle_orientations(input_dir, filename, output_dir):
+# Orientation parameters
+orientation_params = {
+    'backend': 'reference',      # 'reference' (original per-pixel loops) or 'fast' (vectorized, same output,
+                                 # checked by benchmarks/check_equivalence.py)
+    'adaptive': False,           # interpolate flat regions from a coarse mesh (adaptive_triangle_orientations)
+    'adaptive_cell_size': 16,    # cell size of the coarse mesh in pixels
+    'adaptive_threshold': 0.25,  # depth levels a cell may deviate from its corner interpolation (below half
+                                 # a level, so cells with 8-bit quantization steps are refined)
+    'adaptive_max_refined': 0.6, # faces refining more of their cells are computed densely (faster there)
+    'face_workers': 6            # workers processing the six cube faces of a frame (1: one after another)
+}
+
+# (workers, processes) -> ThreadPoolExecutor or ProcessPoolExecutor shared by all frames (see face_pool)
+_face_pools = {}
+_face_pools_lock = threading.Lock()
+
+def face_pool(workers, processes=False):
+    """
+    Pool for the cube faces of a frame, created on first use and reused afterwards.
+    
+    Args:
+        workers: Number of threads or processes
+        processes: Spawn processes (for the reference kernels, whose per-pixel loops hold
+            the GIL) instead of threads
+    """
+    # Stages running concurrently may ask for pools at the same time
+    with _face_pools_lock:
+        key = (workers, processes)
+        if key not in _face_pools:
+            if processes:
+                with child_process_env((os.cpu_count() or 1) // workers):
+                    context = multiprocessing.get_context("spawn")
+                    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+                    # Processes are spawned on demand, submitting one task per worker starts all of them
+                    for future in [executor.submit(os.getpid) for _ in range(workers)]:
+                        future.result()
+                _face_pools[key] = executor
+            else:
+                _face_pools[key] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="orientation_face")
+        return _face_pools[key]
+
+def shutdown_face_pools():
+    """Stop the face pools (see video_io.shutdown_decoder_pool)"""
+    with _face_pools_lock:
+        for executor in _face_pools.values():
+            executor.shutdown()
+        _face_pools.clear()
+
+def compute_triangle_orientations(input_dir, filename, output_dir, resume=False, frame_cache=None, face_workers=None):
     """
     Compute the orientation of triangles in a 3D mesh with respect to the center of projection.
     This replaces the triangle_orientations.exe from the original MATLAB code.
@@ -16,6 +73,12 @@ def compute_triangle_orientations(input_dir, filename, output_dir):
         input_dir: Directory containing input videos/images
         filename: Base name of the video/image file
         output_dir: Directory to save the triangle orientations
+        resume: Skip frames whose six faces already exist in output_dir. Only valid if they were
+            computed from the same videos (main_process checks the stage manifest); without
+            resume, the faces of earlier runs are deleted first
+        frame_cache: checkpoint.FrameCache; frames whose decoded depth was processed
+            before (at any frame index) reuse the cached faces
+        face_workers: Workers processing the faces of a frame (default: orientation_params)
     """
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
@@ -49,123 +112,255 @@ def compute_triangle_orientations(input_dir, filename, output_dir):
     is_video = rgb_path.endswith('.mp4')
     
     if is_video:
-        rgb_video = cv2.VideoCapture(rgb_path)
-        depth_video = cv2.VideoCapture(depth_path)
+        # Get frame count (raises if the videos cannot be opened)
+        frame_count, _ = probe_videos([rgb_path, depth_path])
         
-        # Check if videos are opened successfully
-        if not rgb_video.isOpened() or not depth_video.isOpened():
-            raise ValueError(f"Could not open video files: {rgb_path} and {depth_path}")
+        # Faces of an earlier run may come from other videos, a later resume must not find them
+        if not resume:
+            remove_faces(output_dir, filename)
         
-        # Get frame count and dimensions
-        frame_count = int(rgb_video.get(cv2.CAP_PROP_FRAME_COUNT))
-        width = int(rgb_video.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(rgb_video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        # Skip frames completed by a previous run (the cache checks their content instead)
+        frame_indices = [frame_idx for frame_idx in range(frame_count)
+                         if not (resume and frame_cache is None and frame_faces_exist(output_dir, filename, frame_idx))]
         
-        # Process each frame
-        for frame_idx in range(frame_count):
-            print(f"Processing frame {frame_idx+1}/{frame_count}")
-            
-            # Read frames
-            ret_rgb, rgb_frame = rgb_video.read()
-            ret_depth, depth_frame = depth_video.read()
-            
-            if not ret_rgb or not ret_depth:
-                break
-            
-            # Make sure depth is grayscale
-            if len(depth_frame.shape) == 3:
-                depth_frame = cv2.cvtColor(depth_frame, cv2.COLOR_BGR2GRAY)
-            
-            # Process the equirectangular frame
-            process_frame(depth_frame, rgb_frame, filename, frame_idx, output_dir, debug_dir)
+        # Process each frame, decoded ahead in a separate process (see video_io.open_frame_reader)
+        with open_frame_reader([rgb_path, depth_path], frame_indices) as reader:
+            for frame_idx, (rgb_frame, depth_frame) in reader:
+                print(f"Processing frame {frame_idx+1}/{frame_count}")
+                
+                # Make sure depth is grayscale
+                if len(depth_frame.shape) == 3:
+                    depth_frame = cv2.cvtColor(depth_frame, cv2.COLOR_BGR2GRAY)
+                
+                # Process the equirectangular frame
+                with telemetry.span("process_frame", "frame", frame=frame_idx):
+                    process_frame_cached(depth_frame, rgb_frame, filename, frame_idx, output_dir, debug_dir,
+                                         frame_cache, face_workers)
         
-        # Release videos
-        rgb_video.release()
-        depth_video.release()
+        remove_faces(output_dir, filename, frame_count)
+        if frame_cache is not None:
+            frame_cache.report("Triangle orientations")
         
     else:
         # Handle single image
         rgb_frame = cv2.imread(rgb_path)
-        depth_frame = cv2.imread(depth_path, cv2.IMREAD_GRAYSCALE)
+        # Keep 16-bit depth images at full precision
+        depth_frame = cv2.imread(depth_path, cv2.IMREAD_UNCHANGED)
         
         if rgb_frame is None or depth_frame is None:
             raise ValueError(f"Could not read image files: {rgb_path} and {depth_path}")
         
+        if len(depth_frame.shape) == 3:
+            depth_frame = cv2.cvtColor(depth_frame, cv2.COLOR_BGR2GRAY)
+        
         # Process the equirectangular frame
-        process_frame(depth_frame, rgb_frame, filename, 0, output_dir, debug_dir)
+        with telemetry.span("process_frame", "frame", frame=0):
+            process_frame_cached(depth_frame, rgb_frame, filename, 0, output_dir, debug_dir, frame_cache, face_workers)
+
+
+def frame_faces_exist(output_dir, filename, frame_idx):
+    """Check whether the orientation faces of a frame have been written"""
+    return os.path.exists(faces_path(output_dir, filename, frame_idx))
+
+def process_frame_cached(depth_frame, rgb_frame, filename, frame_idx, output_dir, debug_dir, frame_cache=None,
+                         face_workers=None):
+    """
+    process_frame, reusing the faces of an identical depth frame from frame_cache.
+    
+    The orientations only depend on the depth, so the RGB frame is not part of the key.
+    """
+    if frame_cache is None:
+        process_frame(depth_frame, rgb_frame, filename, frame_idx, output_dir, debug_dir, face_workers)
+        return
+    
+    names = ["faces.npy"]
+    paths = [faces_path(output_dir, filename, frame_idx)]
+    key = frame_cache.key(hash_frames(depth_frame))
+    if frame_cache.load(key, names, paths):
+        return
+    
+    process_frame(depth_frame, rgb_frame, filename, frame_idx, output_dir, debug_dir, face_workers)
+    frame_cache.store(key, names, paths)
 
+def remove_faces(output_dir, filename, first_frame=0):
+    """Delete the faces from first_frame on, e.g. those left by a longer previous version of the clip"""
+    prefix, suffix = f"{filename}_frame_", "_faces.npy"
+    for name in os.listdir(output_dir):
+        index = name[len(prefix):-len(suffix)]
+        if name.startswith(prefix) and name.endswith(suffix) and index.isdigit() and int(index) >= first_frame:
+            os.remove(os.path.join(output_dir, name))
 
-def process_frame(depth_frame, rgb_frame, filename, frame_idx, output_dir, debug_dir):
+def process_frame(depth_frame, rgb_frame, filename, frame_idx, output_dir, debug_dir, face_workers=None):
     """
     Process a single equirectangular frame to compute triangle orientations
     
+    The six orientation maps are saved together as float16 (see intermediates.write_faces).
+    
     Args:
-        depth_frame: Depth frame as a grayscale image
+        depth_frame: Depth frame as a grayscale image (uint8, or uint16 for 16-bit depth images)
         rgb_frame: RGB frame (for reference, not used in computation)
         filename: Base filename
         frame_idx: Frame index
         output_dir: Output directory
         debug_dir: Directory for debug images
+        face_workers: Threads (fast kernels) or processes (reference kernels) processing the six
+            faces (default: orientation_params['face_workers'])
     """
-    # Ensure depth frame is in uint8 format without normalizing
-    if depth_frame.dtype != np.uint8:
+    # 16-bit depth keeps its precision as float on the 8-bit scale, anything else is used as uint8
+    if depth_frame.dtype == np.uint16:
+        depth_frame = depth_frame.astype(np.float32) / 257.0
+    elif depth_frame.dtype != np.uint8:
         depth_frame = depth_frame.astype(np.uint8)
+    depth_u8 = depth_frame.astype(np.uint8)
     
     # Visualize depth with jet colormap for better visualization
-    depth_colored = cv2.applyColorMap(depth_frame, cv2.COLORMAP_JET)
+    depth_colored = cv2.applyColorMap(depth_u8, cv2.COLORMAP_JET)
     cv2.imwrite(os.path.join(debug_dir, f"{filename}_frame_{frame_idx:04d}_depth_colored.jpg"), depth_colored)
     
-    # Convert equirectangular depth to cubemap faces
-    faces = equirectangular_to_cubemap(depth_frame)
-    
-    # Save cubemap faces for debugging
-    for face_idx, face_depth in enumerate(faces):
-        # Save the depth face
-        cv2.imwrite(os.path.join(debug_dir, f"{filename}_frame_{frame_idx:04d}_face_{face_idx}_depth.jpg"), face_depth)
+    if face_workers is None:
+        face_workers = orientation_params['face_workers']
+    workers = min(face_workers, 6)
+    
+    if workers > 1 and orientation_params['backend'] == 'reference':
+        # The per-pixel loops of the reference kernels hold the GIL, so threads would run them
+        # one after another: every face is projected and processed in a worker process
+        # (map returns the results in face order)
+        orientation_maps = list(face_pool(workers, processes=True).map(
+            project_face, repeat(depth_frame), range(6), repeat(filename), repeat(frame_idx),
+            repeat(os.path.abspath(debug_dir)), repeat(dict(orientation_params))))
+    else:
+        # Convert equirectangular depth to cubemap faces
+        faces = equirectangular_to_cubemap(depth_frame)
+        
+        # The fast kernels spend their time in NumPy and OpenCV, which release the GIL, so
+        # threads overlap the faces
+        face_indices = range(len(faces))
         
-        # Save colored version for better visualization with inverted colors
-        inverted_face = 255 - face_depth
-        face_colored = cv2.applyColorMap(inverted_face, cv2.COLORMAP_JET)
-        cv2.imwrite(os.path.join(debug_dir, f"{filename}_frame_{frame_idx:04d}_face_{face_idx}_depth_colored.jpg"), face_colored)
+        def face_task(face_idx):
+            return process_face(faces[face_idx], face_idx, filename, frame_idx, debug_dir)
+        
+        if workers > 1:
+            # map returns the results in face order
+            orientation_maps = list(face_pool(workers).map(face_task, face_indices))
+        else:
+            orientation_maps = [face_task(face_idx) for face_idx in face_indices]
+    
+    # Save the final output to the main output directory
+    output_path = faces_path(output_dir, filename, frame_idx)
+    write_faces(output_path, orientation_maps)
     
-    # Process each face
-    for face_idx, face_depth in enumerate(faces):
+    print(f"Saved faces to {output_path}")
+
+def project_face(depth_frame, face_idx, filename, frame_idx, debug_dir, params):
+    """
+    Project one cube face of a frame and compute its orientations (runs in a worker process).
+    
+    Args:
+        depth_frame: Equirectangular depth frame as prepared by process_frame
+        face_idx: Index of the face (see face_normals)
+        filename: Base filename
+        frame_idx: Frame index
+        debug_dir: Directory for debug images
+        params: Orientation parameters of the parent process
+    
+    Returns:
+        Orientation map of the face clipped to [0, 1]
+    """
+    # Spawned workers start from the module defaults
+    orientation_params.update(params)
+    
+    face_depth = equirectangular_to_cubemap(depth_frame, face_indices=[face_idx])[0]
+    return process_face(face_depth, face_idx, filename, frame_idx, debug_dir)
+
+def process_face(face_depth, face_idx, filename, frame_idx, debug_dir):
+    """
+    Compute the triangle orientations of one cube face and save its debug images.
+    
+    Args:
+        face_depth: Depth of the face (uint8, or float for 16-bit depth)
+        face_idx: Index of the face (see face_normals)
+        filename: Base filename
+        frame_idx: Frame index
+        debug_dir: Directory for debug images
+    
+    Returns:
+        Orientation map of the face clipped to [0, 1]
+    """
+    # Save the depth face
+    face_u8 = face_depth.astype(np.uint8)
+    cv2.imwrite(os.path.join(debug_dir, f"{filename}_frame_{frame_idx:04d}_face_{face_idx}_depth.jpg"), face_u8)
+    
+    # Save colored version for better visualization with inverted colors
+    inverted_face = 255 - face_u8
+    face_colored = cv2.applyColorMap(inverted_face, cv2.COLORMAP_JET)
+    cv2.imwrite(os.path.join(debug_dir, f"{filename}_frame_{frame_idx:04d}_face_{face_idx}_depth_colored.jpg"), face_colored)
+    
+    if orientation_params['adaptive']:
+        # Full resolution only where the depth is not flat
+        orientation_map = adaptive_triangle_orientations(face_depth, face_idx)
+    elif orientation_params['backend'] == 'fast':
+        # Same values as the mesh below, computed from the quads without building it
+        orientation_map = dense_triangle_orientations(face_depth, face_idx)
+    else:
         # Create mesh from depth map
         mesh = depth_to_mesh(face_depth, face_idx)
-        
+    
         # Calculate triangle orientations with different methods for comparison
         orientation_map = calculate_triangle_orientations(mesh, face_depth.shape)
-        
-        # Scale orientation maps to 0-255 for visualization
-        orientation_img = np.clip(orientation_map * 255, 0, 255).astype(np.uint8)
-        
-        # Save orientation images
-        cv2.imwrite(os.path.join(debug_dir, f"{filename}_frame_{frame_idx:04d}_face_{face_idx}_orientation.jpg"), 
-                   orientation_img)
-        
-        # Save colored versions for better visualization
-        orientation_colored_fixed = cv2.applyColorMap(orientation_img, cv2.COLORMAP_JET)
-        
-        cv2.imwrite(os.path.join(debug_dir, f"{filename}_frame_{frame_idx:04d}_face_{face_idx}_orientation_colored.jpg"), 
-                   orientation_colored_fixed)
-        
-        # Save the final output to the main output directory
-        output_path = os.path.join(output_dir, f"{filename}_frame_{frame_idx:04d}_face_{face_idx}.jpg")
-        cv2.imwrite(output_path, orientation_img)
-        
-        print(f"Saved face {face_idx} to {output_path}")
+    
+    # Scale orientation maps to 0-255 for visualization
+    orientation_img = np.clip(orientation_map * 255, 0, 255).astype(np.uint8)
+    
+    # Save orientation images
+    cv2.imwrite(os.path.join(debug_dir, f"{filename}_frame_{frame_idx:04d}_face_{face_idx}_orientation.jpg"), 
+               orientation_img)
+    
+    # Save colored versions for better visualization
+    orientation_colored_fixed = cv2.applyColorMap(orientation_img, cv2.COLORMAP_JET)
+    
+    cv2.imwrite(os.path.join(debug_dir, f"{filename}_frame_{frame_idx:04d}_face_{face_idx}_orientation_colored.jpg"), 
+               orientation_colored_fixed)
+    
+    return np.clip(orientation_map, 0, 1)
 
-def equirectangular_to_cubemap(equirectangular_img, face_size=None):
+# Define vectors for each face direction
+# Order: right (+x), left (-x), top (+y), bottom (-y), front (+z), back (-z)
+face_normals = [
+    np.array([1, 0, 0]),  # Right
+    np.array([-1, 0, 0]),  # Left
+    np.array([0, 1, 0]),  # Top
+    np.array([0, -1, 0]),  # Bottom
+    np.array([0, 0, 1]),  # Front
+    np.array([0, 0, -1])   # Back
+]
+
+# Define up vectors for each face
+up_vectors = [
+    np.array([0, 1, 0]),  # Right
+    np.array([0, 1, 0]),  # Left
+    np.array([0, 0, -1]),  # Top
+    np.array([0, 0, 1]),  # Bottom
+    np.array([0, 1, 0]),  # Front
+    np.array([0, 1, 0])   # Back
+]
+
+def equirectangular_to_cubemap(equirectangular_img, face_size=None, backend=None, face_indices=None):
     """
     Convert an equirectangular image to 6 cubemap faces.
     
     Args:
         equirectangular_img: Equirectangular image (grayscale)
         face_size: Size of the cube face (default: height/2)
+        backend: 'fast' or 'reference' (default: orientation_params['backend'])
+        face_indices: Faces to compute (default: all six)
         
     Returns:
-        List of 6 cubemap faces [right, left, top, bottom, front, back]
+        List of 6 cubemap faces [right, left, top, bottom, front, back] (or the faces of
+        face_indices in that order), uint8 for uint8 input and float32 otherwise
     """
+    if backend is None:
+        backend = orientation_params['backend']
+    
     # Ensure input image is grayscale
     if len(equirectangular_img.shape) > 2:
         equirectangular_img = cv2.cvtColor(equirectangular_img, cv2.COLOR_BGR2GRAY)
@@ -176,32 +371,19 @@ def equirectangular_to_cubemap(equirectangular_img, face_size=None):
     if face_size is None:
         face_size = height // 2
     
-    # Initialize cube faces
-    faces = [np.zeros((face_size, face_size), dtype=np.uint8) for _ in range(6)]
-    
-    # Define vectors for each face direction
-    # Order: right (+x), left (-x), top (+y), bottom (-y), front (+z), back (-z)
-    face_normals = [
-        np.array([1, 0, 0]),  # Right
-        np.array([-1, 0, 0]),  # Left
-        np.array([0, 1, 0]),  # Top
-        np.array([0, -1, 0]),  # Bottom
-        np.array([0, 0, 1]),  # Front
-        np.array([0, 0, -1])   # Back
-    ]
-    
-    # Define up vectors for each face
-    up_vectors = [
-        np.array([0, 1, 0]),  # Right
-        np.array([0, 1, 0]),  # Left
-        np.array([0, 0, -1]),  # Top
-        np.array([0, 0, 1]),  # Bottom
-        np.array([0, 1, 0]),  # Front
-        np.array([0, 1, 0])   # Back
-    ]
+    if face_indices is None:
+        face_indices = range(6)
+    
+    if backend == 'fast':
+        faces = equirectangular_to_cubemap_fast(equirectangular_img, face_size)
+        return [faces[face_idx] for face_idx in face_indices]
+    
+    # Initialize cube faces (truncated to integers for uint8 input)
+    face_dtype = np.uint8 if equirectangular_img.dtype == np.uint8 else np.float32
+    faces = [np.zeros((face_size, face_size), dtype=face_dtype) for _ in range(6)]
     
     # For each face
-    for face_idx in range(6):
+    for face_idx in face_indices:
         # Get face normal and up vector
         face_normal = face_normals[face_idx]
         up_vector = up_vectors[face_idx]
@@ -250,22 +432,173 @@ def equirectangular_to_cubemap(equirectangular_img, face_size=None):
                 d = equirectangular_img[v1, u1]
                 
                 # Bilinear interpolation
-                pixel = int((1 - wu) * (1 - wv) * a + wu * (1 - wv) * b + (1 - wu) * wv * c + wu * wv * d)
+                pixel = (1 - wu) * (1 - wv) * a + wu * (1 - wv) * b + (1 - wu) * wv * c + wu * wv * d
+                if face_dtype == np.uint8:
+                    pixel = int(pixel)
                 faces[face_idx][i, j] = pixel
     
+    return [faces[face_idx] for face_idx in face_indices]
+
+# (height, width, face_size, margin) -> bilinear sampling of the faces (see cubemap_face_samples)
+_cubemap_samples = {}
+
+def cubemap_face_samples(height, width, face_size, margin=0.0):
+    """
+    Equirectangular pixels and bilinear weights sampled by every cube face pixel.
+    
+    Returns:
+        List of 6 tuples (v0, v1, u0, u1, wu, wv) of arrays of shape (face_size, face_size)
+    """
+    key = (height, width, face_size, round(margin, 9))
+    if key in _cubemap_samples:
+        return _cubemap_samples[key]
+    
+    x = np.linspace(-1 - margin, 1 + margin, face_size)
+    y = np.linspace(-1 - margin, 1 + margin, face_size)
+    xv, yv = np.meshgrid(x, y)
+    
+    samples = []
+    for face_idx in range(6):
+        face_normal = face_normals[face_idx]
+        up_vector = up_vectors[face_idx]
+        right_vector = np.cross(up_vector, face_normal)
+        
+        # Direction vectors of all pixels, shape (face_size, face_size, 3)
+        direction = face_normal + right_vector * xv[:, :, None] + up_vector * yv[:, :, None]
+        # Stacked dot products round like np.linalg.norm of each vector in the reference loop
+        # (a sum over the last axis does not, which flipped some face pixels by one level)
+        norm = np.sqrt(direction[:, :, None, :] @ direction[:, :, :, None])[:, :, 0]
+        direction = direction / norm
+        
+        theta = np.arctan2(direction[:, :, 0], direction[:, :, 2])
+        phi = np.arcsin(direction[:, :, 1])
+        
+        u = np.clip(((theta / (2 * np.pi)) + 0.5) * width, 0, width - 1.001)
+        v = np.clip((0.5 - (phi / np.pi)) * height, 0, height - 1.001)
+        
+        u0 = np.floor(u).astype(np.int32) % width
+        u1 = (u0 + 1) % width
+        v0 = np.floor(v).astype(np.int32)
+        v1 = np.minimum(v0 + 1, height - 1)
+        
+        samples.append((v0, v1, u0, u1, u - u0, v - v0))
+    
+    _cubemap_samples[key] = samples
+    return samples
+
+def equirectangular_to_cubemap_fast(equirectangular_img, face_size, margin=0.0):
+    """
+    Vectorized equirectangular_to_cubemap: same sampling, computed for all pixels of a face at once.
+    
+    Args:
+        equirectangular_img: Equirectangular image (grayscale)
+        face_size: Size of the cube face
+        margin: Extend every face past its edges by this fraction of the half face width, so
+            neighbouring faces overlap (face coordinates span [-1 - margin, 1 + margin])
+        
+    Returns:
+        List of 6 cubemap faces [right, left, top, bottom, front, back]
+    """
+    height, width = equirectangular_img.shape
+    img = equirectangular_img.astype(np.float64)
+    
+    faces = []
+    for v0, v1, u0, u1, wu, wv in cubemap_face_samples(height, width, face_size, margin):
+        pixel = ((1 - wu) * (1 - wv) * img[v0, u0] + wu * (1 - wv) * img[v0, u1] +
+                 (1 - wu) * wv * img[v1, u0] + wu * wv * img[v1, u1])
+        faces.append(pixel.astype(np.uint8 if equirectangular_img.dtype == np.uint8 else np.float32))
+    
     return faces
 
-def depth_to_mesh(depth_map, face_idx):
+# (height, width, face_size, margin) -> (face index, map_x, map_y) of every equirectangular pixel
+_cubemap_maps = {}
+
+def cubemap_sampling_maps(height, width, face_size, margin=0.0):
+    """
+    Face and face pixel coordinates of every equirectangular pixel, the exact inverse of
+    the sampling in equirectangular_to_cubemap_fast.
+    
+    Args:
+        height, width: Size of the equirectangular image
+        face_size: Size of the cube faces
+        margin: Margin the faces were extended by (see equirectangular_to_cubemap_fast)
+    
+    Returns:
+        (face_index, map_x, map_y): int array and float32 maps of shape (height, width)
+    """
+    key = (height, width, face_size, round(margin, 9))
+    if key in _cubemap_maps:
+        return _cubemap_maps[key]
+    
+    # Viewing direction of every pixel, same angles as the forward sampling
+    theta = (np.arange(width) / width - 0.5) * 2 * np.pi
+    phi = (0.5 - np.arange(height) / height) * np.pi
+    theta, phi = np.meshgrid(theta, phi)
+    direction = np.stack([np.cos(phi) * np.sin(theta), np.sin(phi), np.cos(phi) * np.cos(theta)], axis=2)
+    
+    # The face seen by a direction is the one with the most aligned normal
+    normals = np.array(face_normals, dtype=np.float64)
+    alignment = direction @ normals.T
+    face_index = np.argmax(alignment, axis=2)
+    
+    map_x = np.zeros((height, width), dtype=np.float32)
+    map_y = np.zeros((height, width), dtype=np.float32)
+    scale = (face_size - 1) / (2 + 2 * margin)
+    for face_idx in range(6):
+        mask = face_index == face_idx
+        face_normal = normals[face_idx]
+        up_vector = np.array(up_vectors[face_idx], dtype=np.float64)
+        right_vector = np.cross(up_vector, face_normal)
+        
+        # Intersect the ray with the face plane, direction = normal + right * x + up * y
+        hit = direction[mask] / alignment[mask, face_idx][:, None] - face_normal
+        map_x[mask] = (hit @ right_vector + 1 + margin) * scale
+        map_y[mask] = (hit @ up_vector + 1 + margin) * scale
+    
+    _cubemap_maps[key] = (face_index, map_x, map_y)
+    return _cubemap_maps[key]
+
+def cubemap_to_equirectangular(faces, height, width, margin=0.0):
+    """
+    Reproject cubemap faces to an equirectangular image (inverse of equirectangular_to_cubemap_fast).
+    
+    Args:
+        faces: List of 6 grayscale faces [right, left, top, bottom, front, back]
+        height, width: Size of the equirectangular image
+        margin: Margin the faces were extended by (see equirectangular_to_cubemap_fast)
+    
+    Returns:
+        float32 equirectangular image, bilinearly sampled from the faces
+    """
+    face_index, map_x, map_y = cubemap_sampling_maps(height, width, faces[0].shape[0], margin)
+    
+    result = np.zeros((height, width), dtype=np.float32)
+    for face_idx, face in enumerate(faces):
+        sampled = cv2.remap(face.astype(np.float32), map_x, map_y, cv2.INTER_LINEAR,
+                            borderMode=cv2.BORDER_REPLICATE)
+        mask = face_index == face_idx
+        result[mask] = sampled[mask]
+    
+    return result
+
+def depth_to_mesh(depth_map, face_idx, backend=None):
     """
     Convert a depth map to a 3D mesh for a specific cubemap face.
     
     Args:
         depth_map: Depth map image (grayscale)
         face_idx: Face index (0: right, 1: left, 2: top, 3: bottom, 4: front, 5: back)
+        backend: 'fast' or 'reference' (default: orientation_params['backend'])
         
     Returns:
         trimesh.Trimesh object
     """
+    if backend is None:
+        backend = orientation_params['backend']
+    
+    if backend == 'fast':
+        return depth_to_mesh_fast(depth_map, face_idx)
+    
     height, width = depth_map.shape
     
     # keep original values and just invert them
@@ -336,17 +669,70 @@ def depth_to_mesh(depth_map, face_idx):
     mesh = trimesh.Trimesh(vertices=vertices, faces=faces)
     return mesh
 
-def calculate_triangle_orientations(mesh, depth_shape):
+def depth_to_mesh_fast(depth_map, face_idx):
+    """
+    Vectorized depth_to_mesh producing the same vertices and triangles.
+    
+    Args:
+        depth_map: Depth map image (grayscale)
+        face_idx: Face index (0: right, 1: left, 2: top, 3: bottom, 4: front, 5: back)
+        
+    Returns:
+        trimesh.Trimesh object
+    """
+    height, width = depth_map.shape
+    
+    depth_values = (255.0 - depth_map.astype(float)) / 255.0
+    
+    y, x = np.mgrid[0:height, 0:width]
+    x_norm = (x / (width - 1)) * 2 - 1
+    y_norm = -((y / (height - 1)) * 2 - 1)
+    
+    min_depth = 0.1
+    max_depth = 1.0
+    scaled_depth = min_depth + depth_values * (max_depth - min_depth)
+    
+    # Same axis layout as the reference loops
+    if face_idx == 0:  # Right (+X)
+        coords = [scaled_depth, y_norm, -x_norm]
+    elif face_idx == 1:  # Left (-X)
+        coords = [-scaled_depth, y_norm, x_norm]
+    elif face_idx == 2:  # Top (+Y)
+        coords = [x_norm, scaled_depth, -y_norm]
+    elif face_idx == 3:  # Bottom (-Y)
+        coords = [x_norm, -scaled_depth, y_norm]
+    elif face_idx == 4:  # Front (+Z)
+        coords = [x_norm, y_norm, scaled_depth]
+    else:  # Back (-Z)
+        coords = [-x_norm, y_norm, -scaled_depth]
+    vertices = np.stack([c.reshape(-1) for c in coords], axis=1).astype(np.float64)
+    
+    # Two triangles per quad, in the row-major order of the reference loops
+    idx = np.arange(height * width).reshape(height, width)
+    v00 = idx[:-1, :-1].reshape(-1)
+    v01 = idx[:-1, 1:].reshape(-1)
+    v10 = idx[1:, :-1].reshape(-1)
+    v11 = idx[1:, 1:].reshape(-1)
+    faces = np.stack([np.stack([v00, v10, v01], axis=1), np.stack([v01, v10, v11], axis=1)], axis=1).reshape(-1, 3)
+    
+    mesh = trimesh.Trimesh(vertices=vertices, faces=faces)
+    return mesh
+
+def calculate_triangle_orientations(mesh, depth_shape, backend=None):
     """
     orientation between face normal and view vector
     
     Args:
         mesh: trimesh.Trimesh object
         depth_shape: shape of the depth map (height, width)
+        backend: 'fast' or 'reference' (default: orientation_params['backend'])
         
     Returns:
         2D array with orientation values (0 to 1)
     """
+    if backend is None:
+        backend = orientation_params['backend']
+    
     # Calculate face normals if not already computed
     if not hasattr(mesh, 'face_normals') or mesh.face_normals is None:
         mesh.face_normals = None  # Reset to force recalculation
@@ -373,6 +759,13 @@ def calculate_triangle_orientations(mesh, depth_shape):
     # Get original depth map dimensions
     height, width = depth_shape
     
+    if backend == 'fast' and len(orientations) == 2 * (height - 1) * (width - 1) and height > 1 and width > 1:
+        # Quad averages; the last quad written in the reference loop wins, which
+        # leaves the last row and column equal to their neighbours
+        quads = orientations.reshape(height - 1, width - 1, 2)
+        avg_orientation = (quads[:, :, 0] + quads[:, :, 1]) / 2
+        return np.pad(avg_orientation, ((0, 1), (0, 1)), mode='edge')
+    
     # Initialize output array
     orientation_map = np.zeros((height, width))
     
@@ -394,4 +787,199 @@ def calculate_triangle_orientations(mesh, depth_shape):
                 orientation_map[i+1, j] = avg_orientation
                 orientation_map[i+1, j+1] = avg_orientation
     
-    return orientation_map
\ No newline at end of file
+    return orientation_map
+
+def face_vertices(depth_values, x, y, width, height, face_idx):
+    """
+    3D vertex coordinates of depth samples on a cubemap face, as built by depth_to_mesh.
+    
+    Args:
+        depth_values: Depth samples (0-255 scale, white = closer)
+        x, y: Pixel coordinates of the samples on the full-resolution face (broadcastable)
+        width, height: Size of the full-resolution face
+        face_idx: Face index (0: right, 1: left, 2: top, 3: bottom, 4: front, 5: back)
+    
+    Returns:
+        Array of shape depth_values.shape + (3,)
+    """
+    x_norm = (x / (width - 1)) * 2 - 1
+    y_norm = -((y / (height - 1)) * 2 - 1)
+    x_norm, y_norm = np.broadcast_arrays(x_norm, y_norm)
+    scaled_depth = 0.1 + (255.0 - depth_values) / 255.0 * 0.9
+    
+    if face_idx == 0:  # Right (+X)
+        coords = [scaled_depth, y_norm, -x_norm]
+    elif face_idx == 1:  # Left (-X)
+        coords = [-scaled_depth, y_norm, x_norm]
+    elif face_idx == 2:  # Top (+Y)
+        coords = [x_norm, scaled_depth, -y_norm]
+    elif face_idx == 3:  # Bottom (-Y)
+        coords = [x_norm, -scaled_depth, y_norm]
+    elif face_idx == 4:  # Front (+Z)
+        coords = [x_norm, y_norm, scaled_depth]
+    else:  # Back (-Z)
+        coords = [-x_norm, y_norm, -scaled_depth]
+    return np.stack(coords, axis=-1)
+
+def quad_orientations(v00, v01, v10, v11):
+    """
+    Average orientation of the two triangles of quads, as in calculate_triangle_orientations.
+    
+    Args:
+        v00, v01, v10, v11: Corner vertices of the quads, arrays of shape (..., 3)
+    
+    Returns:
+        Orientation values (0 to 1) of shape (...)
+    """
+    def triangle_orientation(a, b, c):
+        normal = np.cross(b - a, c - a)
+        normal /= np.maximum(np.linalg.norm(normal, axis=-1, keepdims=True), 1e-12)
+        view = -(a + b + c) / 3
+        view /= np.maximum(np.linalg.norm(view, axis=-1, keepdims=True), 1e-10)
+        return np.abs(np.sum(normal * view, axis=-1))
+    
+    # Same winding as depth_to_mesh: (v00, v10, v01) and (v01, v10, v11)
+    return (triangle_orientation(v00, v10, v01) + triangle_orientation(v01, v10, v11)) / 2
+
+def dense_triangle_orientations(depth_map, face_idx):
+    """
+    Orientation map of a cubemap face computed directly from its quads.
+    
+    Gives the values of calculate_triangle_orientations on the mesh of depth_to_mesh
+    (up to rounding in the last bit) without building the trimesh mesh.
+    
+    Args:
+        depth_map: Depth map of the face (grayscale, 0-255 scale)
+        face_idx: Face index (0: right, 1: left, 2: top, 3: bottom, 4: front, 5: back)
+    
+    Returns:
+        2D array with orientation values (0 to 1), same shape as depth_map
+    """
+    height, width = depth_map.shape
+    vertices = face_vertices(depth_map.astype(np.float64), np.arange(width)[None, :], np.arange(height)[:, None],
+                             width, height, face_idx)
+    orientation = quad_orientations(vertices[:-1, :-1], vertices[:-1, 1:], vertices[1:, :-1], vertices[1:, 1:])
+    
+    # The last row and column repeat their neighbours, as in calculate_triangle_orientations
+    return np.pad(orientation, ((0, 1), (0, 1)), mode='edge')
+
+def interpolate_cells(values, centers, size):
+    """
+    Bilinearly interpolate per-cell values at the quad centers of the full-resolution face.
+    
+    Args:
+        values: Cell values, shape (cells, cells)
+        centers: Pixel coordinate of each cell center along one axis
+        size: Number of full-resolution quads along one axis
+    
+    Returns:
+        Array of shape (size, size)
+    """
+    position = np.interp(np.arange(size) + 0.5, centers, np.arange(len(centers)))
+    i0 = np.minimum(np.floor(position).astype(np.intp), len(centers) - 1)
+    i1 = np.minimum(i0 + 1, len(centers) - 1)
+    w = position - i0
+    
+    rows = values[i0] * (1 - w)[:, None] + values[i1] * w[:, None]
+    return rows[:, i0] * (1 - w) + rows[:, i1] * w
+
+def adaptive_cells(depth_map, cell_size=None, threshold=None):
+    """
+    Coarse mesh and refinement decision of adaptive_triangle_orientations.
+    
+    Args:
+        depth_map: Depth map of the face (grayscale, 0-255 scale)
+        cell_size: Cell size in pixels (default: orientation_params['adaptive_cell_size'])
+        threshold: Refinement threshold in depth levels (default: orientation_params['adaptive_threshold'])
+    
+    Returns:
+        (corners, refine): vertex indices of the coarse mesh along each axis and a boolean
+        array of the cells computed at full resolution, or None if the face is too small
+        (or not square) or refines more than orientation_params['adaptive_max_refined'] of
+        its cells, and every quad is computed
+    """
+    if cell_size is None:
+        cell_size = orientation_params['adaptive_cell_size']
+    if threshold is None:
+        threshold = orientation_params['adaptive_threshold']
+    
+    height, width = depth_map.shape
+    size = min(height, width) - 1  # quads per axis
+    if height != width or size < 2 * cell_size:
+        return None
+    
+    depth = depth_map.astype(np.float64)
+    
+    # Coarse mesh: every cell_size-th vertex plus the last row and column
+    corners = np.unique(np.append(np.arange(0, size + 1, cell_size), size))
+    coarse_depth = depth[np.ix_(corners, corners)]
+    
+    # Deviation of the depth from the bilinear interpolation of the cell corners
+    position = np.interp(np.arange(size + 1), corners, np.arange(len(corners)))
+    i0 = np.minimum(np.floor(position).astype(np.intp), len(corners) - 1)
+    i1 = np.minimum(i0 + 1, len(corners) - 1)
+    w = position - i0
+    rows = coarse_depth[i0] * (1 - w)[:, None] + coarse_depth[i1] * w[:, None]
+    reconstruction = rows[:, i0] * (1 - w) + rows[:, i1] * w
+    residual = np.abs(depth - reconstruction)[:size, :size]
+    
+    # Largest residual per cell (cells may be smaller at the last row and column)
+    starts = corners[:-1]
+    cell_residual = np.maximum.reduceat(np.maximum.reduceat(residual, starts, axis=0), starts, axis=1)
+    
+    # Interpolated values near a refined cell mix in its coarse value, so refine the neighbours too
+    refine = cv2.dilate((cell_residual > threshold).astype(np.uint8), np.ones((3, 3), np.uint8)) > 0
+    if refine.mean() > orientation_params['adaptive_max_refined']:
+        return None
+    
+    return corners, refine
+
+def adaptive_triangle_orientations(depth_map, face_idx, cell_size=None, threshold=None):
+    """
+    Orientation map of a cubemap face computed on a two-level grid.
+    
+    The face is divided into cells of cell_size pixels whose corners form a coarse mesh.
+    Cells where the depth deviates from the bilinear interpolation of their corners by more
+    than threshold (edges, curved surfaces) and their neighbours are refined to full
+    resolution; flat cells (sky, walls, floors) are interpolated from the coarse mesh.
+    Refined pixels match dense_triangle_orientations exactly.
+    
+    Gathering the refined quads costs more per quad than dense_triangle_orientations, so
+    faces refining more than orientation_params['adaptive_max_refined'] of their cells are
+    computed densely. Only faces that are mostly flat run faster than the dense path.
+    
+    Args:
+        depth_map: Depth map of the face (grayscale, 0-255 scale)
+        face_idx: Face index (0: right, 1: left, 2: top, 3: bottom, 4: front, 5: back)
+        cell_size: Cell size in pixels (default: orientation_params['adaptive_cell_size'])
+        threshold: Refinement threshold in depth levels (default: orientation_params['adaptive_threshold'])
+    
+    Returns:
+        2D array with orientation values (0 to 1), same shape as depth_map
+    """
+    cells = adaptive_cells(depth_map, cell_size, threshold)
+    if cells is None:
+        # Too small (or not square) or too detailed to benefit, compute every quad
+        return dense_triangle_orientations(depth_map, face_idx)
+    corners, refine = cells
+    
+    height, width = depth_map.shape
+    depth = depth_map.astype(np.float64)
+    size = min(height, width) - 1  # quads per axis
+    
+    coarse_depth = depth[np.ix_(corners, corners)]
+    coarse = face_vertices(coarse_depth, corners[None, :], corners[:, None], width, height, face_idx)
+    coarse_orientation = quad_orientations(coarse[:-1, :-1], coarse[:-1, 1:], coarse[1:, :-1], coarse[1:, 1:])
+    centers = (corners[:-1] + corners[1:]) / 2
+    orientation = interpolate_cells(coarse_orientation, centers, size)
+    extents = np.diff(corners)
+    
+    if refine.any():
+        quad_mask = np.repeat(np.repeat(refine, extents, axis=0), extents, axis=1)
+        rows, cols = np.nonzero(quad_mask)
+        vertices = face_vertices(depth, np.arange(width)[None, :], np.arange(height)[:, None], width, height, face_idx)
+        orientation[rows, cols] = quad_orientations(vertices[rows, cols], vertices[rows, cols + 1],
+                                                    vertices[rows + 1, cols], vertices[rows + 1, cols + 1])
+    
+    # The last row and column repeat their neighbours, as in calculate_triangle_orientations
+    return np.pad(orientation, ((0, height - size), (0, width - size)), mode='edge')
@@ -0,0 +1,113 @@
+import os
+import cv2
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from telemetry import telemetry
+
+class StageGraph:
+    """
+    Pipeline stages run as a dependency graph.
+    
+    Every stage is a checkpoint.Stage with its declared inputs and outputs. A stage depends
+    on the earlier added stages that write any of its inputs, so the stages of independent
+    branches (e.g. the foreground alpha and the background layer) run concurrently on
+    threads. The stages share a CPU budget: every stage asks for a number of cores, and it is
+    started once the cores it gets leave the running stages within the budget.
+    
+    The cores of a stage size its own workers (face threads, processes). OpenCV and the
+    BLAS libraries have one thread pool per process, so inside a stage they are only held
+    to the total budget: OpenCV through cv2.setNumThreads while the graph runs, BLAS and
+    OpenMP through the thread limit variables set before the process starts (see batch).
+    """
+    
+    def __init__(self, cpu_budget=None):
+        """
+        Args:
+            cpu_budget: Total cores of all running stages (default: all cores)
+        """
+        self.cpu_budget = max(1, cpu_budget or os.cpu_count() or 1)
+        self.nodes = []
+    
+    def add(self, stage, run, cores=1):
+        """
+        Add a stage.
+        
+        Args:
+            stage: checkpoint.Stage, skipped when it is up to date and recorded after run
+            run: Function computing the stage, called with the number of cores it was given
+            cores: Cores the stage can use
+        """
+        self.nodes.append({'stage': stage, 'run': run, 'cores': max(1, cores)})
+    
+    def dependencies(self):
+        """Dictionary stage name -> set of names of the stages writing its inputs"""
+        producers = {}
+        dependencies = {}
+        for node in self.nodes:
+            stage = node['stage']
+            dependencies[stage.name] = {producers[path] for path in stage.inputs if path in producers}
+            for path in stage.outputs:
+                producers[path] = stage.name
+        return dependencies
+    
+    def _run_node(self, node, cores, parent):
+        stage = node['stage']
+        with telemetry.adopt(parent), telemetry.span(stage.name, cores=cores):
+            if not stage.up_to_date():
+                node['run'](cores)
+                stage.record()
+    
+    def run(self):
+        """
+        Run all stages, each one as soon as the stages it depends on have finished.
+        
+        Ready stages start in the order they were added. When several are ready, each gets
+        at most an even share of the free cores (at least one), so a wide stage does not
+        keep a concurrent branch waiting.
+        
+        Raises:
+            The first exception raised by a stage, after the running stages have finished
+        """
+        dependencies = self.dependencies()
+        pending = list(self.nodes)
+        done = set()
+        running = {}
+        free = self.cpu_budget
+        error = None
+        
+        # The OpenCV thread pool shared by the running stages is capped at the budget
+        num_threads = cv2.getNumThreads()
+        cv2.setNumThreads(self.cpu_budget)
+        
+        # Stage spans are nested in the span open while the graph runs
+        parent = telemetry.current()
+        
+        with ThreadPoolExecutor(max_workers=self.cpu_budget, thread_name_prefix="stage") as executor:
+            while pending or running:
+                if error is None:
+                    ready = [node for node in pending if dependencies[node['stage'].name] <= done]
+                    for index, node in enumerate(ready):
+                        if free == 0:
+                            break
+                        share = max(1, free // (len(ready) - index))
+                        cores = min(node['cores'], share)
+                        free -= cores
+                        pending.remove(node)
+                        future = executor.submit(self._run_node, node, cores, parent)
+                        running[future] = (node, cores)
+                
+                if not running:
+                    break
+                
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    node, cores = running.pop(future)
+                    free += cores
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                    else:
+                        done.add(node['stage'].name)
+        
+        cv2.setNumThreads(num_threads)
+        if error is not None:
+            raise error
@@ -0,0 +1,303 @@
+import os
+import json
+import shutil
+import cv2
+
+from mesh_orientation import process_frame, compute_triangle_orientations
+from compute_alpha import (compute_transparency_values, process_frame_orientations, read_alpha_frame,
+                           alpha_output_path, check_viewer_alpha_format, AlphaProcessor)
+from extrapolated_layer import create_extrapolated_layer
+from inpainted_layer import create_inpainted_layer
+from video_io import open_video_writer
+from intermediates import export_file, background_viewer_files, cleanup_temp_files
+from depth_generation import generate_depth, depth_video_path
+from depth_improving import improve_depth
+from viewer_bundle import bundle_viewer_files
+from telemetry import telemetry
+
+# Streaming parameters
+stream_params = {
+    'preview_frames': 30,        # frames sampled for the first-pass background
+    'segment_frames': 60,        # frames per emitted video segment
+    'refine_background': True,   # recompute the background from the whole clip at the end
+    'fps': None                  # frame rate of the segments (None: frame rate of the RGB video)
+}
+
+def create_background_layers(filename, alpha_format='bgr', inpaint_method=None, max_frames=None):
+    """
+    Create the extrapolated and inpainted background layers and copy them to the viewer folder.
+    
+    Args:
+        filename: Base name of the video file
+        alpha_format: 'bgr' or 'gray'
+        inpaint_method: Inpainting method, 'ns' or 'pyramid'
+        max_frames: Only use the first max_frames frames for the background
+    """
+    create_extrapolated_layer(filename, max_frames=max_frames)
+    
+    bg_folder = f"_extrapolated_layer/{filename}/_triangle_orientations"
+    compute_triangle_orientations(f"_extrapolated_layer/{filename}", f"{filename}_BG", bg_folder)
+    compute_transparency_values(bg_folder, f"{filename}_BG", alpha_format)
+    alpha_frame = read_alpha_frame(bg_folder, f"{filename}_BG", alpha_format)
+    if alpha_frame is not None:
+        cv2.imwrite(f"_extrapolated_layer/{filename}/{filename}_BGA.png", alpha_frame)
+    
+    create_inpainted_layer(filename, inpaint_method)
+    
+    for src, dst in background_viewer_files(filename):
+        publish_file(src, dst)
+
+def publish_file(src, dst):
+    """Export src to dst atomically, so the viewer never reads a partially written file"""
+    root, ext = os.path.splitext(dst)
+    tmp_path = f"{root}.partial{ext}"
+    export_file(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+def write_manifest(path, manifest):
+    """Atomically write the segment manifest"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+class SegmentWriter:
+    """Numbered RGB, depth and alpha video chunks of fixed length"""
+    
+    def __init__(self, folder, filename, frame_size, alpha_size, alpha_format, fps):
+        """
+        Args:
+            folder: Folder receiving the segments
+            filename: Base filename
+            frame_size: (width, height) of the RGB and depth frames
+            alpha_size: (width, height) of the alpha frames
+            alpha_format: 'bgr' or 'gray'
+            fps: Frame rate
+        """
+        self.folder = folder
+        self.filename = filename
+        self.frame_size = frame_size
+        self.alpha_size = alpha_size
+        self.alpha_format = alpha_format
+        self.fps = fps
+        self.index = -1
+        self.start = 0
+        self.frames = 0
+        self.writers = None
+        os.makedirs(folder, exist_ok=True)
+    
+    def paths(self, index):
+        """Paths of the RGB, depth and alpha outputs of a segment"""
+        return {
+            'video': os.path.join(self.folder, f"{self.filename}_{index:04d}.mp4"),
+            'depth': os.path.join(self.folder, f"{self.filename}_depth_{index:04d}.mp4"),
+            'alpha': os.path.join(self.folder, f"{self.filename}_alphaproc_{index:04d}.mp4")
+        }
+    
+    def open(self, start):
+        """Start a new segment beginning at frame start"""
+        self.index += 1
+        self.start = start
+        self.frames = 0
+        paths = self.paths(self.index)
+        
+        self.writers = {
+            'video': open_video_writer(paths['video'], self.fps, self.frame_size, fourccs=['avc1', 'mp4v']),
+            'depth': open_video_writer(paths['depth'], self.fps, self.frame_size, fourccs=['avc1', 'mp4v']),
+            'alpha': open_video_writer(paths['alpha'], self.fps, self.alpha_size, is_color=self.alpha_format == 'bgr',
+                                       fourccs=['avc1', 'mp4v'])
+        }
+        
+        if any(writer is None for writer in self.writers.values()):
+            raise RuntimeError(f"Could not create segment writers in {self.folder}")
+    
+    def write(self, rgb_frame, depth_frame, alpha_frame):
+        """Append one frame to the open segment"""
+        self.writers['video'].write(rgb_frame)
+        self.writers['depth'].write(depth_frame)
+        self.writers['alpha'].write(alpha_frame)
+        self.frames += 1
+    
+    def close(self):
+        """
+        Finish the open segment.
+        
+        Returns:
+            Manifest entry of the segment, or None if no segment was open
+        """
+        if self.writers is None:
+            return None
+        
+        for writer in self.writers.values():
+            writer.release()
+        self.writers = None
+        
+        paths = self.paths(self.index)
+        return {
+            'index': self.index,
+            'start_frame': self.start,
+            'frames': self.frames,
+            'video': os.path.relpath(paths['video'], os.path.dirname(self.folder)),
+            'depth': os.path.relpath(paths['depth'], os.path.dirname(self.folder)),
+            'alpha': os.path.relpath(paths['alpha'], os.path.dirname(self.folder))
+        }
+
+def stream_process(filename, alpha_format="bgr", inpaint_method=None, preview_frames=None,
+                   segment_frames=None, cleanup=True, bundle=False, improve=False):
+    """
+    Progressive variant of main_process producing viewer assets while the clip is processed.
+    
+    1. A first-pass background is built from the first preview_frames frames and copied to
+       _vid2viewer/{filename} right away.
+    2. Frames are processed one by one and written as numbered RGB, depth and alpha segments in
+       _vid2viewer/{filename}/segments. {filename}_segments.json lists the finished segments.
+       After the first segment, the viewer files ({filename}.mp4, _depth.mp4, _alphaproc.mp4)
+       are published from it so the viewer can preview the clip.
+    3. At the end the viewer files are replaced by the full clip and, unless disabled, the
+       background is recomputed from the whole clip.
+    
+    The web viewer polls {filename}_segments.json, plays the segments as they are listed and
+    switches to the full clip once the manifest is complete. The first preview is only quick
+    with the fast kernels (orientation_params/projection_params backend 'fast'): on a 2048x1024
+    clip with one preview frame and one frame per segment it was published after 7 s with them
+    and after 123 s with the reference kernels (14 s and 280 s for the whole 3-frame clip).
+    
+    Args:
+        filename: Base name of the video file (without extension)
+        alpha_format: 'bgr' or 'gray' (the viewer cannot load 'png' frames)
+        inpaint_method: Inpainting method for the inpainted layer, 'ns' or 'pyramid'
+        preview_frames: Frames used for the first-pass background (default: stream_params)
+        segment_frames: Frames per segment (default: stream_params)
+        cleanup: Delete the intermediate folders at the end
+        bundle: Pack the final background images into a viewer atlas (see viewer_bundle)
+        improve: Run the depth improvement of main_process before streaming starts
+    """
+    if preview_frames is None:
+        preview_frames = stream_params['preview_frames']
+    if segment_frames is None:
+        segment_frames = stream_params['segment_frames']
+    check_viewer_alpha_format(alpha_format)
+    
+    print("Starting streaming preprocessing pipeline...")
+    
+    viewer_dir = f"_vid2viewer/{filename}"
+    video_dir = f"_improved_depth/{filename}/videos"
+    orientation_dir = f"_triangle_orientations/{filename}"
+    debug_dir = os.path.join(orientation_dir, "debug")
+    for directory in [video_dir, debug_dir, f"_extrapolated_layer/{filename}/_triangle_orientations",
+                      f"_inpainted_layer/{filename}", viewer_dir]:
+        os.makedirs(directory, exist_ok=True)
+    
+    # Step 0 as in main_process: the whole depth video is generated before streaming starts
+    if not os.path.exists(depth_video_path(filename)):
+        with telemetry.span("depth_generation"):
+            generate_depth(filename)
+    
+    # Step 1 as in main_process: the whole depth video is improved, or the inputs are used directly
+    rgb_path = f"{video_dir}/{filename}.mp4"
+    depth_path = f"{video_dir}/{filename}_depth.mp4"
+    if improve:
+        with telemetry.span("improve_depth"):
+            improve_depth(filename)
+    else:
+        shutil.copy(f"_input_videos/{filename}.mp4", rgb_path)
+        shutil.copy(f"_input_videos/{filename}_depth.mp4", depth_path)
+    
+    # Step 1: first-pass background
+    print(f"COMPUTING FIRST-PASS BACKGROUND FROM {preview_frames} FRAMES")
+    with telemetry.span("preview_background"):
+        create_background_layers(filename, alpha_format, inpaint_method, max_frames=preview_frames)
+    
+    # Step 2: per-frame processing into segments
+    rgb_video = cv2.VideoCapture(rgb_path)
+    depth_video = cv2.VideoCapture(depth_path)
+    if not rgb_video.isOpened() or not depth_video.isOpened():
+        raise ValueError(f"Could not open video files: {rgb_path} and {depth_path}")
+    
+    frame_count = int(min(rgb_video.get(cv2.CAP_PROP_FRAME_COUNT), depth_video.get(cv2.CAP_PROP_FRAME_COUNT)))
+    fps = stream_params['fps'] or rgb_video.get(cv2.CAP_PROP_FPS) or 30
+    width = int(rgb_video.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(rgb_video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    
+    # process_frame_orientations resamples the alpha to the viewer resolution
+    alpha_width, alpha_height = 2048, 1024
+    alpha_processor = AlphaProcessor(alpha_height, alpha_width, grayscale=alpha_format != 'bgr')
+    
+    segments = SegmentWriter(os.path.join(viewer_dir, "segments"), filename, (width, height),
+                             (alpha_width, alpha_height), alpha_format, fps)
+    manifest_path = os.path.join(viewer_dir, f"{filename}_segments.json")
+    manifest = {'filename': filename, 'fps': fps, 'total_frames': frame_count,
+                'alpha_format': alpha_format, 'complete': False, 'segments': []}
+    write_manifest(manifest_path, manifest)
+    
+    # Full-length alpha video (same location as in main_process), published at the end
+    alpha_full_path = alpha_output_path(orientation_dir, filename, alpha_format)
+    alpha_full = open_video_writer(alpha_full_path, fps, (alpha_width, alpha_height),
+                                   is_color=alpha_format == 'bgr', fourccs=['avc1', 'mp4v'])
+    if alpha_full is None:
+        raise RuntimeError(f"Could not create video writer for {alpha_full_path}")
+    
+    print("PROCESSING FRAMES")
+    for frame_idx in range(frame_count):
+        ret_rgb, rgb_frame = rgb_video.read()
+        ret_depth, depth_frame = depth_video.read()
+        if not ret_rgb or not ret_depth:
+            break
+        
+        if frame_idx % segment_frames == 0:
+            finish_segment(segments, manifest, manifest_path, viewer_dir, filename, alpha_format)
+            segments.open(frame_idx)
+        
+        with telemetry.span("stream_frame", "frame", frame=frame_idx):
+            depth_gray = cv2.cvtColor(depth_frame, cv2.COLOR_BGR2GRAY) if depth_frame.ndim == 3 else depth_frame
+            process_frame(depth_gray, rgb_frame, filename, frame_idx, orientation_dir, debug_dir)
+            alpha_frame = alpha_processor.process(process_frame_orientations(orientation_dir, filename, frame_idx))
+            
+            segments.write(rgb_frame, depth_frame, alpha_frame)
+            alpha_full.write(alpha_frame)
+    
+    finish_segment(segments, manifest, manifest_path, viewer_dir, filename, alpha_format)
+    rgb_video.release()
+    depth_video.release()
+    
+    # Step 3: full-length outputs
+    print("PUBLISHING FULL CLIP")
+    publish_file(rgb_path, os.path.join(viewer_dir, f"{filename}.mp4"))
+    publish_file(depth_path, os.path.join(viewer_dir, f"{filename}_depth.mp4"))
+    alpha_full.release()
+    publish_file(alpha_full_path, alpha_output_path(viewer_dir, filename, alpha_format))
+    
+    if stream_params['refine_background'] and frame_count > preview_frames:
+        print("REFINING BACKGROUND FROM THE WHOLE CLIP")
+        with telemetry.span("refine_background"):
+            create_background_layers(filename, alpha_format, inpaint_method)
+    
+    if bundle:
+        print("PACKING VIEWER BUNDLE")
+        with telemetry.span("bundle_viewer_files"):
+            bundle_viewer_files(viewer_dir, filename, alpha_format)
+    
+    manifest['complete'] = True
+    write_manifest(manifest_path, manifest)
+    
+    if cleanup:
+        print("DELETING TEMPORARY FILES")
+        cleanup_temp_files()
+    
+    print("Streaming complete! Files are ready for the viewer.")
+
+def finish_segment(segments, manifest, manifest_path, viewer_dir, filename, alpha_format):
+    """Close the open segment, list it in the manifest and publish the first one as preview"""
+    entry = segments.close()
+    if entry is None:
+        return
+    
+    manifest['segments'].append(entry)
+    write_manifest(manifest_path, manifest)
+    print(f"Segment {entry['index']} ready: frames {entry['start_frame']}-{entry['start_frame'] + entry['frames'] - 1}")
+    
+    # The viewer loads fixed filenames, give it the first segment to preview
+    if entry['index'] == 0:
+        publish_file(os.path.join(viewer_dir, entry['video']), os.path.join(viewer_dir, f"{filename}.mp4"))
+        publish_file(os.path.join(viewer_dir, entry['depth']), os.path.join(viewer_dir, f"{filename}_depth.mp4"))
+        publish_file(os.path.join(viewer_dir, entry['alpha']), alpha_output_path(viewer_dir, filename, alpha_format))
@@ -0,0 +1,288 @@
+import os
+import sys
+import csv
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def peak_rss_mb():
+    """Peak resident set size of the process in MB, or None if unavailable"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+def io_bytes():
+    """(read, written) bytes of the process from /proc/self/io, or (None, None) if unavailable"""
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines())
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+class Telemetry:
+    """
+    Records timed spans (pipeline stages, frames) with wall time, CPU time, peak RSS,
+    I/O bytes and custom counters such as solver iterations.
+    
+    The CPU time of a span is that of the thread running it (worker threads and processes
+    it waits for are not included). The I/O bytes can only be read for the whole process:
+    spans that ran while a span of another thread was open are marked 'overlapped', their
+    I/O includes that of the concurrent spans.
+    
+    Disabled by default, in which case spans cost a single attribute check.
+    """
+    
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._open = []
+    
+    def enable(self):
+        """Start recording and reset previously recorded events"""
+        self.enabled = True
+        self.events = []
+        self.origin = time.perf_counter()
+        self._open = []
+    
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+    
+    def begin(self, name, category='stage', **args):
+        """
+        Open a span. Prefer span() unless the timed code cannot be wrapped in a with block.
+        
+        Args:
+            name: Span name (e.g. stage or function name)
+            category: 'stage' or 'frame'
+            **args: Extra values stored with the span (e.g. frame index)
+        
+        Returns:
+            Span token for end(), or None when disabled
+        """
+        if not self.enabled:
+            return None
+        
+        read_bytes, write_bytes = io_bytes()
+        stack = self._stack()
+        token = {
+            'name': name,
+            'category': category,
+            'args': dict(args),
+            'start': time.perf_counter(),
+            'cpu_start': time.thread_time(),
+            'read_start': read_bytes,
+            'write_start': write_bytes,
+            'thread': threading.get_ident(),
+            'parent': stack[-1] if stack else None,
+            'overlapped': False
+        }
+        
+        # Spans open in other threads share the process-wide I/O counters with this one,
+        # except the enclosing spans waiting for it (e.g. main_process for its stages)
+        ancestors = []
+        parent = token['parent']
+        while parent is not None:
+            ancestors.append(parent)
+            parent = parent.get('parent')
+        with self._lock:
+            for other in self._open:
+                if other['thread'] != token['thread'] and not any(other is a for a in ancestors):
+                    other['overlapped'] = token['overlapped'] = True
+            self._open.append(token)
+        
+        stack.append(token)
+        return token
+    
+    def end(self, token):
+        """Close a span opened with begin() and record it"""
+        if token is None:
+            return
+        
+        wall = time.perf_counter() - token['start']
+        cpu = time.thread_time() - token['cpu_start']
+        read_bytes, write_bytes = io_bytes()
+        
+        stack = self._stack()
+        if token in stack:
+            stack.remove(token)
+        with self._lock:
+            if token in self._open:
+                self._open.remove(token)
+        
+        event = {
+            'name': token['name'],
+            'category': token['category'],
+            'start_s': token['start'] - self.origin,
+            'wall_s': wall,
+            'cpu_s': cpu,
+            'peak_rss_mb': peak_rss_mb(),
+            'read_bytes': None if read_bytes is None else read_bytes - token['read_start'],
+            'write_bytes': None if write_bytes is None else write_bytes - token['write_start'],
+            'overlapped': token['overlapped'],
+            'thread': token['thread'],
+            'args': token['args']
+        }
+        
+        frames = token['args'].get('frames')
+        if frames and wall > 0:
+            event['fps'] = frames / wall
+        
+        with self._lock:
+            self.events.append(event)
+    
+    @contextmanager
+    def span(self, name, category='stage', **args):
+        """
+        Time the enclosed block.
+        
+        Yields the span arguments, so the block can attach values, e.g. args['frames'] = n.
+        """
+        token = self.begin(name, category, **args)
+        try:
+            yield token['args'] if token is not None else {}
+        finally:
+            self.end(token)
+    
+    def current(self):
+        """Innermost open span of the current thread, or None"""
+        stack = self._stack()
+        return stack[-1] if stack else None
+    
+    @contextmanager
+    def adopt(self, token):
+        """
+        Nest the spans opened by the enclosed block of a worker thread in a span of another
+        thread (from current()), so waiting for the worker does not mark them overlapped.
+        """
+        if token is None:
+            yield
+            return
+        stack = self._stack()
+        stack.append(token)
+        try:
+            yield
+        finally:
+            stack.remove(token)
+    
+    def count(self, key, value=1):
+        """Add value to a counter of the innermost open span (or collect block) of the current thread"""
+        stack = self._stack()
+        if stack:
+            args = stack[-1]['args']
+            args[key] = args.get(key, 0) + value
+    
+    @contextmanager
+    def collect(self):
+        """
+        Collect the counters of the enclosed block, also when recording is disabled.
+        
+        Worker processes have their own, disabled recorder: they return the collected
+        counters so the parent can add them to its span with count().
+        
+        Yields the dictionary receiving the counters.
+        """
+        stack = self._stack()
+        token = {'args': {}, 'parent': stack[-1] if stack else None}
+        stack.append(token)
+        try:
+            yield token['args']
+        finally:
+            stack.remove(token)
+    
+    def summary(self):
+        """
+        Aggregate the events per span name.
+        
+        Returns:
+            Dictionary name -> count, total/mean wall time, total CPU time, peak RSS,
+            frames per second (frame spans), number of overlapped spans and summed counters
+        """
+        summary = {}
+        for event in self.events:
+            entry = summary.setdefault(event['name'], {
+                'category': event['category'], 'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                'peak_rss_mb': None, 'read_bytes': 0, 'write_bytes': 0, 'overlapped': 0
+            })
+            entry['count'] += 1
+            entry['overlapped'] += event['overlapped']
+            entry['wall_s'] += event['wall_s']
+            entry['cpu_s'] += event['cpu_s']
+            if event['peak_rss_mb'] is not None:
+                entry['peak_rss_mb'] = max(entry['peak_rss_mb'] or 0, event['peak_rss_mb'])
+            entry['read_bytes'] += event['read_bytes'] or 0
+            entry['write_bytes'] += event['write_bytes'] or 0
+            for key, value in event['args'].items():
+                if isinstance(value, (int, float)) and key not in ('frame', 'face'):
+                    entry[key] = entry.get(key, 0) + value
+        
+        for entry in summary.values():
+            entry['wall_mean_s'] = entry['wall_s'] / entry['count']
+            if entry['category'] == 'frame' and entry['wall_s'] > 0:
+                entry['fps'] = entry['count'] / entry['wall_s']
+        
+        return summary
+    
+    def save(self, path, fmt=None):
+        """
+        Save the recorded events.
+        
+        Args:
+            path: Output file
+            fmt: 'json' (events and summary), 'csv' (one row per event) or 'chrome'
+                (trace viewer format for chrome://tracing or Perfetto).
+                Default: derived from the file extension, 'json' otherwise.
+        """
+        if fmt is None:
+            fmt = 'csv' if path.endswith('.csv') else 'json'
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        if fmt == 'chrome':
+            pid = os.getpid()
+            trace = [{
+                'name': event['name'],
+                'cat': event['category'],
+                'ph': 'X',
+                'ts': event['start_s'] * 1e6,
+                'dur': event['wall_s'] * 1e6,
+                'pid': pid,
+                'tid': event['thread'],
+                'args': dict(event['args'], cpu_s=event['cpu_s'], peak_rss_mb=event['peak_rss_mb'],
+                             overlapped=event['overlapped'])
+            } for event in self.events]
+            with open(path, 'w') as f:
+                json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+        elif fmt == 'csv':
+            fields = ['name', 'category', 'start_s', 'wall_s', 'cpu_s', 'fps', 'peak_rss_mb',
+                      'read_bytes', 'write_bytes', 'overlapped', 'thread', 'args']
+            with open(path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=fields)
+                writer.writeheader()
+                for event in self.events:
+                    writer.writerow(dict(event, args=json.dumps(event['args'])))
+        else:
+            with open(path, 'w') as f:
+                json.dump({'events': self.events, 'summary': self.summary()}, f, indent=2)
+        
+        print(f"Telemetry trace saved to {path}")
+
+# Shared recorder used by all pipeline modules
+telemetry = Telemetry()
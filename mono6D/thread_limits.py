@@ -0,0 +1,36 @@
+import os
+import threading
+from contextlib import contextmanager
+
+# Environment variables limiting the thread pools of numpy/scipy BLAS and OpenMP
+thread_env_vars = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+# os.environ is shared by the stage threads, overrides are applied and restored one at a time
+_env_lock = threading.Lock()
+
+@contextmanager
+def child_process_env(threads):
+    """
+    Environment of processes spawned inside the block.
+    
+    Limits the BLAS and OpenMP threads of the children and makes the pipeline modules
+    importable from them. The previous values are restored on exit. Concurrent stages
+    wait for each other, so one stage cannot restore the values set by another.
+    
+    Args:
+        threads: Value of the thread limit variables
+    """
+    with _env_lock:
+        saved_env = {var: os.environ.get(var) for var in thread_env_vars + ["PYTHONPATH"]}
+        for var in thread_env_vars:
+            os.environ[var] = str(max(1, threads))
+        module_dir = os.path.dirname(os.path.abspath(__file__))
+        os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [module_dir, saved_env["PYTHONPATH"]]))
+        try:
+            yield
+        finally:
+            for var, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = value
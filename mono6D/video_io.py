@@ -0,0 +1,476 @@
+import os
+import shutil
+import subprocess
+import threading
+import queue
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cv2
+
+# Video writer parameters
+video_params = {
+    'backend': 'opencv',       # 'opencv' (cv2.VideoWriter) or 'ffmpeg' (subprocess pipe)
+    'ffmpeg_path': 'ffmpeg',   # ffmpeg executable
+    'codec': 'libx264',        # 'libx264' or 'libx265'
+    'preset': 'veryfast',      # x264/x265 speed preset
+    'crf': 18,                 # constant rate factor (lower = better quality)
+    'threads': 0,              # encoder threads (0 = auto)
+    'pix_fmt': 'yuv420p',      # output pixel format ('yuv420p' or 'gray')
+    'queue_size': 8,           # frames buffered between compute and the encoder thread
+    # 'ring' (decode in a separate process into shared memory) or 'opencv' (in-process). On a single
+    # core the decoder only competes with the computation and starting it costs seconds, so 'opencv'.
+    'reader': 'ring' if (os.cpu_count() or 1) > 1 else 'opencv',
+    'reader_slots': 4,         # frames the ring reader decodes ahead of the consumer
+    'reader_processes': 2,     # decoder processes shared by all ring readers (one per concurrent reader)
+    'reader_seek_gap': 16      # forward gaps up to this many frames are skipped by grabbing instead of seeking
+}
+
+def open_video_writer(path, fps, frame_size, is_color=True, fourccs=('mp4v',), backend=None):
+    """
+    Open a video writer with the configured backend.
+
+    Both backends expose the cv2.VideoWriter interface (write, release, isOpened).
+
+    Args:
+        path: Output video path
+        fps: Frame rate
+        frame_size: (width, height) of the frames
+        is_color: Whether the frames are BGR (True) or single-channel (False)
+        fourccs: Codecs to try in order for the OpenCV backend
+        backend: 'opencv' or 'ffmpeg' (default: video_params['backend'])
+
+    Returns:
+        Opened writer, or None if no writer could be created
+    """
+    if backend is None:
+        backend = video_params['backend']
+
+    if backend == 'ffmpeg':
+        if shutil.which(video_params['ffmpeg_path']) is not None:
+            writer = FFmpegVideoWriter(path, fps, frame_size, is_color)
+            if writer.isOpened():
+                print(f"Successfully created ffmpeg video writer using codec: {video_params['codec']}")
+                return writer
+        print(f"Warning: could not start {video_params['ffmpeg_path']}, falling back to OpenCV writer")
+
+    for codec in fourccs:
+        try:
+            fourcc = cv2.VideoWriter_fourcc(*codec)
+            writer = cv2.VideoWriter(path, fourcc, fps, frame_size, isColor=is_color)
+
+            if writer.isOpened():
+                print(f"Successfully created video writer using codec: {codec}")
+                return writer
+
+            # Close failed writer and try next codec
+            writer.release()
+        except Exception as e:
+            print(f"Failed to create video writer with codec {codec}: {e}")
+
+    return None
+
+class FFmpegVideoWriter:
+    """
+    Video writer that pipes raw frames into an ffmpeg subprocess.
+
+    Frames are queued and written to ffmpeg from a background thread, so encoding
+    overlaps with computation. The bounded queue blocks the producer when the
+    encoder falls behind.
+    """
+
+    def __init__(self, path, fps, frame_size, is_color=True):
+        """
+        Args:
+            path: Output video path
+            fps: Frame rate
+            frame_size: (width, height) of the frames
+            is_color: Whether the frames are BGR (True) or single-channel (False)
+        """
+        self.path = path
+        self.frame_size = frame_size
+        self.is_color = is_color
+        self.error = None
+
+        width, height = frame_size
+        command = [
+            video_params['ffmpeg_path'], '-y', '-loglevel', 'error',
+            '-f', 'rawvideo',
+            '-pix_fmt', 'bgr24' if is_color else 'gray',
+            '-s', f"{width}x{height}",
+            '-r', str(fps),
+            '-i', '-',
+            '-c:v', video_params['codec'],
+            '-preset', video_params['preset'],
+            '-crf', str(video_params['crf']),
+            '-threads', str(video_params['threads']),
+            '-pix_fmt', video_params['pix_fmt'],
+            path
+        ]
+
+        try:
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        except OSError as e:
+            print(f"Failed to start ffmpeg: {e}")
+            self.process = None
+            return
+
+        self.queue = queue.Queue(maxsize=video_params['queue_size'])
+        self.thread = threading.Thread(target=self._encode_loop, daemon=True)
+        self.thread.start()
+
+    def _encode_loop(self):
+        """Write queued frames to the ffmpeg pipe until the end marker is received"""
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self.process.stdin.write(frame.tobytes())
+            except (BrokenPipeError, OSError) as e:
+                self.error = e
+
+    def isOpened(self):
+        return self.process is not None and self.process.poll() is None and self.error is None
+
+    def write(self, frame):
+        """
+        Queue a frame for encoding. The frame is copied, so the caller may reuse its buffer.
+
+        Args:
+            frame: BGR or single-channel uint8 frame of size frame_size
+        """
+        if self.error is not None:
+            raise RuntimeError(f"ffmpeg encoder failed for {self.path}: {self.error}")
+
+        # Match the channel count the pipe was opened with
+        if self.is_color and len(frame.shape) == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        elif not self.is_color and len(frame.shape) == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        else:
+            frame = frame.copy()
+
+        self.queue.put(np.ascontiguousarray(frame, dtype=np.uint8))
+
+    def release(self):
+        """Flush the queue, close the pipe and wait for ffmpeg to finish"""
+        if self.process is None:
+            return
+
+        self.queue.put(None)
+        self.thread.join()
+
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+
+        returncode = self.process.wait()
+        if returncode != 0 or self.error is not None:
+            print(f"Warning: ffmpeg exited with code {returncode} for {self.path}")
+
+        self.process = None
+
+def open_frame_reader(paths, frame_indices=None, backend=None):
+    """
+    Open synchronized readers of one or more videos (e.g. RGB and depth).
+
+    Both backends are iterated the same way and yield (frame_idx, frames) with one BGR
+    frame per video. Use them as context managers so the decoder is always shut down.
+
+    Args:
+        paths: Video paths
+        frame_indices: Increasing frame indices to read (default: all frames)
+        backend: 'ring' or 'opencv' (default: video_params['reader'])
+
+    Returns:
+        FrameRingReader or FrameReader
+    """
+    if backend is None:
+        backend = video_params['reader']
+
+    if backend == 'ring':
+        return FrameRingReader(paths, frame_indices)
+    return FrameReader(paths, frame_indices)
+
+def probe_videos(paths):
+    """
+    Frame count shared by videos and the frame shape of each one.
+
+    Returns:
+        (frame_count, shapes): minimum frame count and a list of (height, width, 3)
+    """
+    frame_count = None
+    shapes = []
+    for path in paths:
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise ValueError(f"Could not open video file: {path}")
+        count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        frame_count = count if frame_count is None else min(frame_count, count)
+        shapes.append((int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), 3))
+        capture.release()
+    return frame_count, shapes
+
+def seek_capture(capture, position, frame_idx, seek_gap):
+    """
+    Move a capture from position to frame_idx, grabbing over short forward gaps.
+
+    Returns:
+        False if a grabbed frame could not be decoded
+    """
+    if frame_idx == position:
+        return True
+    if position < frame_idx <= position + seek_gap:
+        for _ in range(frame_idx - position):
+            if not capture.grab():
+                return False
+        return True
+    capture.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+    return True
+
+class FrameReader:
+    """In-process reader of synchronized videos, decoding each frame when it is requested"""
+
+    def __init__(self, paths, frame_indices=None):
+        """
+        Args:
+            paths: Video paths
+            frame_indices: Increasing frame indices to read (default: all frames)
+        """
+        self.paths = list(paths)
+        self.frame_count, self.shapes = probe_videos(self.paths)
+        self.frame_indices = list(range(self.frame_count) if frame_indices is None else frame_indices)
+        self.failed_frame = None
+        self.captures = [cv2.VideoCapture(path) for path in self.paths]
+
+    def __iter__(self):
+        position = 0
+        for frame_idx in self.frame_indices:
+            frames = []
+            for capture in self.captures:
+                if not seek_capture(capture, position, frame_idx, video_params['reader_seek_gap']):
+                    break
+                ret, frame = capture.read()
+                if not ret:
+                    break
+                frames.append(frame)
+            if len(frames) < len(self.captures):
+                self.failed_frame = frame_idx
+                return
+            position = frame_idx + 1
+            yield frame_idx, frames
+
+    def close(self):
+        for capture in self.captures:
+            capture.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# (processes, ProcessPoolExecutor) running the ring decoders (see decoder_pool)
+_decoder_pool = None
+_decoder_pool_lock = threading.Lock()
+
+# Ring header (int64): stop request, frames decoded, failed frame, then (state, frame index) per slot
+RING_STOP, RING_DECODED, RING_FAILED, RING_SLOTS = 0, 1, 2, 3
+SLOT_FREE, SLOT_FILLED = 0, 1
+
+def decoder_pool(processes):
+    """
+    Persistent process pool running the ring decoders, started on first use.
+
+    Spawned processes import the main module of the run (the whole pipeline), so they are
+    started once and reused by all readers instead of one process per reader.
+    """
+    global _decoder_pool
+    with _decoder_pool_lock:
+        if _decoder_pool is None or _decoder_pool[0] != processes:
+            if _decoder_pool is not None:
+                _decoder_pool[1].shutdown()
+            # Not forked, the pipeline stages may be running on threads
+            context = multiprocessing.get_context("spawn")
+            _decoder_pool = (processes, ProcessPoolExecutor(max_workers=processes, mp_context=context))
+        return _decoder_pool[1]
+
+def shutdown_decoder_pool():
+    """
+    Stop the decoder processes.
+
+    Needed before a multiprocessing worker exits (e.g. a batch job): its exit joins the
+    child processes, and the pool processes only stop when the pool is shut down.
+    """
+    global _decoder_pool
+    with _decoder_pool_lock:
+        if _decoder_pool is not None:
+            _decoder_pool[1].shutdown()
+            _decoder_pool = None
+
+def ring_layout(shapes, slots):
+    """
+    Byte layout of a ring: header, then slots holding one frame of every video.
+
+    Returns:
+        (header_bytes, slot_bytes, total_bytes)
+    """
+    header_bytes = 8 * (RING_SLOTS + 2 * slots)
+    header_bytes = (header_bytes + 63) // 64 * 64
+    slot_bytes = sum(int(np.prod(shape)) for shape in shapes)
+    return header_bytes, slot_bytes, header_bytes + slots * slot_bytes
+
+def wait_for(condition, poll=0.0005, max_poll=0.01):
+    """Poll condition() with a growing sleep until it returns True"""
+    while not condition():
+        time.sleep(poll)
+        poll = min(poll * 2, max_poll)
+
+def _decode_into_ring(paths, frame_indices, shm_name, shapes, slots, seek_gap):
+    """
+    Decoder task of FrameRingReader: decode frames into the slots of the shared ring in turn.
+
+    A slot is written once the consumer marked it free, and marked filled after the frames.
+    The number of decoded frames and a failed read are reported in the ring header.
+    """
+    ring = shared_memory.SharedMemory(name=shm_name)
+    header_bytes, slot_bytes, _ = ring_layout(shapes, slots)
+    header = np.ndarray(RING_SLOTS + 2 * slots, dtype=np.int64, buffer=ring.buf)
+    captures = [cv2.VideoCapture(path) for path in paths]
+    decoded = 0
+    try:
+        position = 0
+        for frame_idx in frame_indices:
+            slot = decoded % slots
+            state = RING_SLOTS + 2 * slot
+            wait_for(lambda: header[state] == SLOT_FREE or header[RING_STOP])
+            if header[RING_STOP]:
+                break
+
+            offset = header_bytes + slot * slot_bytes
+            ok = True
+            for capture, shape in zip(captures, shapes):
+                view = np.ndarray(shape, dtype=np.uint8, buffer=ring.buf, offset=offset)
+                offset += view.nbytes
+                ok = seek_capture(capture, position, frame_idx, seek_gap)
+                if ok:
+                    # Decoded straight into the slot when the frame matches its shape
+                    ok, frame = capture.read(view)
+                    if ok and not np.shares_memory(frame, view):
+                        view[...] = frame
+                del view
+                if not ok:
+                    break
+
+            if not ok:
+                header[RING_FAILED] = frame_idx
+                break
+            position = frame_idx + 1
+            header[state + 1] = frame_idx
+            header[state] = SLOT_FILLED
+            decoded += 1
+    finally:
+        for capture in captures:
+            capture.release()
+        header[RING_DECODED] = decoded
+        del header
+        ring.close()
+    return decoded
+
+class FrameRingReader:
+    """
+    Reader of synchronized videos that decodes in a separate process, ahead of the consumer.
+
+    The decoder writes the frames into a shared-memory ring of reader_slots preallocated
+    slots, one frame of every video per slot, and runs on a persistent process pool (see
+    decoder_pool). Iterating yields NumPy views of a slot without copying; a slot is handed
+    back to the decoder when the next frame is requested, so the views must be copied if
+    they are needed for longer than one iteration. close unmaps the ring: callers must not
+    hold views past it, accessing them afterwards is undefined (it may crash). The decoder
+    waits when it is reader_slots frames ahead.
+    """
+
+    def __init__(self, paths, frame_indices=None, slots=None):
+        """
+        Args:
+            paths: Video paths
+            frame_indices: Increasing frame indices to read (default: all frames)
+            slots: Frames decoded ahead (default: video_params['reader_slots'])
+        """
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.frame_count, self.shapes = probe_videos(self.paths)
+        self.frame_indices = list(range(self.frame_count) if frame_indices is None else frame_indices)
+        self.slots = max(1, slots or video_params['reader_slots'])
+        self.failed_frame = None
+
+        header_bytes, slot_bytes, total_bytes = ring_layout(self.shapes, self.slots)
+        self.ring = shared_memory.SharedMemory(create=True, size=total_bytes)
+        self.header = np.ndarray(RING_SLOTS + 2 * self.slots, dtype=np.int64, buffer=self.ring.buf)
+        self.header[:] = 0
+        self.header[RING_DECODED] = -1
+        self.header[RING_FAILED] = -1
+
+        self.slot_views = []
+        for slot in range(self.slots):
+            offset = header_bytes + slot * slot_bytes
+            views = []
+            for shape in self.shapes:
+                views.append(np.ndarray(shape, dtype=np.uint8, buffer=self.ring.buf, offset=offset))
+                offset += views[-1].nbytes
+            self.slot_views.append(views)
+
+        self.future = decoder_pool(video_params['reader_processes']).submit(
+            _decode_into_ring, self.paths, self.frame_indices, self.ring.name, self.shapes, self.slots,
+            video_params['reader_seek_gap'])
+
+    def _wait_filled(self, count):
+        """Wait until the frame with the given position is decoded, False at the end of the frames"""
+        state = RING_SLOTS + 2 * (count % self.slots)
+        def ready():
+            if self.header[state] == SLOT_FILLED:
+                return True
+            if self.future.done():
+                # Raises the exception of a failed decoder
+                self.future.result()
+                return True
+            return False
+        wait_for(ready)
+        return self.header[state] == SLOT_FILLED
+
+    def __iter__(self):
+        for count in range(len(self.frame_indices)):
+            if not self._wait_filled(count):
+                break
+            slot = count % self.slots
+            state = RING_SLOTS + 2 * slot
+            yield int(self.header[state + 1]), tuple(self.slot_views[slot])
+            self.header[state] = SLOT_FREE
+
+        if self.header[RING_FAILED] >= 0:
+            self.failed_frame = int(self.header[RING_FAILED])
+
+    def close(self):
+        """Stop the decoder and free the shared memory, invalidating the yielded views"""
+        if self.future is None:
+            return
+
+        self.header[RING_STOP] = 1
+        self.future.exception()
+        self.future = None
+
+        self.slot_views = []
+        self.header = None
+        self.ring.close()
+        self.ring.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
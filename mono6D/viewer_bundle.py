@@ -0,0 +1,232 @@
+import os
+import json
+import cv2
+import numpy as np
+
+from compute_alpha import alpha_output_path
+from video_io import open_video_writer
+
+# Bundle parameters
+bundle_params = {
+    'image_format': 'png',     # atlas encoding, 'png' or 'webp' (lossless)
+    'mux': None,               # None, 'top_bottom' or 'side_by_side': depth and alpha in one video
+    'max_texture_size': 4096,  # the atlas is downscaled to fit this size (WebGL texture limit)
+    'keep_separate': True      # keep the individual background images next to the bundle
+}
+
+# Background images packed into the atlas: viewer file suffix -> (atlas row, channels).
+# Color images take a full row, the single-channel images share the RGB channels of the last row.
+atlas_regions = {
+    'BG': (0, 'rgb'),
+    'BG_inp': (1, 'rgb'),
+    'BGD': (2, 'r'),
+    'BGA': (2, 'g'),
+    'BGD_inp': (2, 'b')
+}
+
+# Texture channel -> index in an OpenCV BGR image
+channel_index = {'r': 2, 'g': 1, 'b': 0}
+
+def pack_atlas(images, max_texture_size=None):
+    """
+    Pack the background images into one texture.
+    
+    Args:
+        images: Dictionary viewer suffix (see atlas_regions) -> 8-bit image
+        max_texture_size: Maximum width and height of the atlas
+    
+    Returns:
+        (atlas, regions): BGR atlas and dictionary suffix -> {'rect': [x, y, w, h], 'channels': ...}
+    """
+    if max_texture_size is None:
+        max_texture_size = bundle_params['max_texture_size']
+    
+    # All regions use the size of the extrapolated color image
+    height, width = images['BG'].shape[:2]
+    rows = max(row for row, _ in atlas_regions.values()) + 1
+    scale = min(1.0, max_texture_size / width, max_texture_size / (rows * height))
+    width, height = int(round(width * scale)), int(round(height * scale))
+    
+    atlas = np.zeros((rows * height, width, 3), dtype=np.uint8)
+    regions = {}
+    for suffix, (row, channels) in atlas_regions.items():
+        image = images[suffix]
+        if image.shape[:2] != (height, width):
+            image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        
+        region = atlas[row * height:(row + 1) * height]
+        if channels == 'rgb':
+            region[:] = image if image.ndim == 3 else image[:, :, None]
+        else:
+            region[:, :, channel_index[channels]] = image if image.ndim == 2 else image[:, :, 0]
+        regions[suffix] = {'rect': [0, row * height, width, height], 'channels': channels}
+    
+    return atlas, regions
+
+def write_atlas(path, atlas, image_format=None):
+    """Write the atlas as PNG or lossless WebP"""
+    if image_format is None:
+        image_format = bundle_params['image_format']
+    
+    if image_format == 'webp':
+        # Quality above 100 selects lossless WebP, the packed depth channels must not be smeared
+        cv2.imwrite(path, atlas, [cv2.IMWRITE_WEBP_QUALITY, 101])
+    else:
+        cv2.imwrite(path, atlas, [cv2.IMWRITE_PNG_COMPRESSION, 9])
+
+def read_alpha_frames(viewer_dir, filename, alpha_format):
+    """Yield the frames of the exported alpha (video or PNG frames) as single-channel images"""
+    alpha_path = alpha_output_path(viewer_dir, filename, alpha_format)
+    
+    if alpha_format == 'png':
+        for name in sorted(os.listdir(alpha_path)):
+            if name.endswith('.png'):
+                yield cv2.imread(os.path.join(alpha_path, name), cv2.IMREAD_GRAYSCALE)
+        return
+    
+    video = cv2.VideoCapture(alpha_path)
+    while True:
+        ret, frame = video.read()
+        if not ret:
+            break
+        yield cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    video.release()
+
+def mux_depth_alpha(viewer_dir, filename, alpha_format, layout, fps=None):
+    """
+    Combine the depth and alpha videos into one video, so the viewer decodes a single stream.
+    
+    Args:
+        viewer_dir: Viewer folder containing the depth video and the alpha output
+        filename: Base filename
+        alpha_format: 'bgr', 'gray' or 'png'
+        layout: 'top_bottom' (depth above alpha) or 'side_by_side' (depth left of alpha)
+        fps: Frame rate (default: frame rate of the depth video)
+    
+    Returns:
+        (file name, frame size, depth rect, alpha rect) with the size as [w, h] and rects as
+        [x, y, w, h] in pixels, or None on failure
+    """
+    depth_video = cv2.VideoCapture(os.path.join(viewer_dir, f"{filename}_depth.mp4"))
+    width = int(depth_video.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(depth_video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    if fps is None:
+        fps = depth_video.get(cv2.CAP_PROP_FPS) or 30
+    
+    if layout == 'top_bottom':
+        frame_size = (width, 2 * height)
+        alpha_rect = [0, height, width, height]
+    else:
+        frame_size = (2 * width, height)
+        alpha_rect = [width, 0, width, height]
+    
+    muxed_name = f"{filename}_depth_alpha.mp4"
+    writer = open_video_writer(os.path.join(viewer_dir, muxed_name), fps, frame_size, fourccs=['avc1', 'mp4v'])
+    if writer is None:
+        depth_video.release()
+        print(f"Error: Could not create video writer for {muxed_name}")
+        return None
+    
+    frame = np.zeros((frame_size[1], frame_size[0], 3), dtype=np.uint8)
+    num_frames = 0
+    for alpha in read_alpha_frames(viewer_dir, filename, alpha_format):
+        ret, depth = depth_video.read()
+        if not ret:
+            break
+        if alpha.shape[:2] != (height, width):
+            alpha = cv2.resize(alpha, (width, height), interpolation=cv2.INTER_AREA)
+        
+        frame[:height, :width] = depth
+        frame[alpha_rect[1]:alpha_rect[1] + height, alpha_rect[0]:alpha_rect[0] + width] = alpha[:, :, None]
+        writer.write(frame)
+        num_frames += 1
+    
+    writer.release()
+    depth_video.release()
+    print(f"Muxed {num_frames} depth and alpha frames into {muxed_name}")
+    
+    return muxed_name, list(frame_size), [0, 0, width, height], alpha_rect
+
+def bundle_viewer_files(viewer_dir, filename, alpha_format='bgr', image_format=None, mux=None, keep_separate=None):
+    """
+    Pack the exported viewer files into an atlas with a JSON manifest.
+    
+    Reads the 8-bit background images written by copy_files_to_viewer and packs the
+    five images into one atlas texture. Optionally the depth and
+    alpha videos are muxed into one video.
+    
+    The web viewer (web_viewer/src/main.js) reads the manifest: it copies the atlas
+    regions into separate textures on the GPU and, with mux, the depth and alpha of
+    every frame out of the muxed video by their rects. Clips without a manifest are
+    loaded from the individual files.
+    
+    Args:
+        viewer_dir: Viewer folder of the clip (e.g. _vid2viewer/{filename})
+        filename: Base filename
+        alpha_format: 'bgr', 'gray' or 'png'
+        image_format: 'png' or 'webp' (default: bundle_params['image_format'])
+        mux: None, 'top_bottom' or 'side_by_side' (default: bundle_params['mux'])
+        keep_separate: Keep the individual background images (default: bundle_params['keep_separate'])
+    
+    Returns:
+        Path of the manifest
+    """
+    if image_format is None:
+        image_format = bundle_params['image_format']
+    if mux is None:
+        mux = bundle_params['mux']
+    if keep_separate is None:
+        keep_separate = bundle_params['keep_separate']
+    
+    image_paths = {suffix: os.path.join(viewer_dir, f"{filename}_{suffix}.png") for suffix in atlas_regions}
+    images = {}
+    for suffix, path in image_paths.items():
+        flags = cv2.IMREAD_COLOR if atlas_regions[suffix][1] == 'rgb' else cv2.IMREAD_GRAYSCALE
+        images[suffix] = cv2.imread(path, flags)
+        if images[suffix] is None:
+            raise ValueError(f"Could not read viewer image: {path}")
+    
+    atlas, regions = pack_atlas(images)
+    atlas_name = f"{filename}_atlas.{image_format}"
+    write_atlas(os.path.join(viewer_dir, atlas_name), atlas, image_format)
+    print(f"Packed {len(regions)} background images into {atlas_name} ({atlas.shape[1]}x{atlas.shape[0]})")
+    
+    alpha_name = os.path.basename(alpha_output_path(viewer_dir, filename, alpha_format))
+    videos = {
+        'rgb': {'file': f"{filename}.mp4"},
+        'depth': {'file': f"{filename}_depth.mp4"},
+        'alpha': {'file': alpha_name, 'frames': 'alpha_{:04d}.png'} if alpha_format == 'png' else {'file': alpha_name}
+    }
+    
+    if mux:
+        muxed = mux_depth_alpha(viewer_dir, filename, alpha_format, mux)
+        if muxed is not None:
+            muxed_name, size, depth_rect, alpha_rect = muxed
+            videos['depth'] = {'file': muxed_name, 'size': size, 'rect': depth_rect}
+            videos['alpha'] = {'file': muxed_name, 'size': size, 'rect': alpha_rect, 'channels': 'r'}
+    
+    manifest = {
+        'version': 1,
+        'name': filename,
+        'atlas': {
+            'file': atlas_name,
+            'width': atlas.shape[1],
+            'height': atlas.shape[0],
+            'origin': 'top-left',
+            'regions': regions
+        },
+        'videos': videos
+    }
+    
+    manifest_path = os.path.join(viewer_dir, f"{filename}_bundle.json")
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    
+    if not keep_separate:
+        for path in image_paths.values():
+            os.remove(path)
+    
+    print(f"Viewer bundle manifest saved to {manifest_path}")
+    return manifest_path
@@ -141,10 +141,6 @@ function onSwitchStart(event) {
 
 // Asset loading management for a specific filename
 async function loadAssetsForFilename(filename) {
-  const videoPath = `./video/${filename}.mp4`;
-  const depthVideoPath = `./video/${filename}_depth.mp4`;
-  const alphaVideoPath = `./video/${filename}_alphaproc.mp4`;
-
   const extrapolatedImagePath = `./video/${filename}_BG.png`;
   const extrapolatedDepthPath = `./video/${filename}_BGD.png`;
   const extrapolatedAlphaPath = `./video/${filename}_BGA.png`;
@@ -157,6 +153,9 @@ async function loadAssetsForFilename(filename) {
     videoElement: null,
     depthVideoElement: null,
     alphaVideoElement: null,
+    depthRegion: null,
+    alphaRegion: null,
+    segmentFollower: null,
     extrapolatedTexture: null,
     extrapolatedDepth: null,
     extrapolatedAlpha: null,
@@ -164,27 +163,36 @@ async function loadAssetsForFilename(filename) {
     inpaintDepth: null
   };
 
-  // Create video elements
-  assets.videoElement = document.createElement('video');
-  assets.videoElement.src = videoPath;
-  assets.videoElement.loop = true;
-  assets.videoElement.muted = true;
-  assets.videoElement.crossOrigin = 'anonymous';
-  assets.videoElement.preload = 'auto';
-  
-  assets.depthVideoElement = document.createElement('video');
-  assets.depthVideoElement.src = depthVideoPath;
-  assets.depthVideoElement.loop = true;
-  assets.depthVideoElement.muted = true;
-  assets.depthVideoElement.crossOrigin = 'anonymous';
-  assets.depthVideoElement.preload = 'auto';
-  
-  assets.alphaVideoElement = document.createElement('video');
-  assets.alphaVideoElement.src = alphaVideoPath;
-  assets.alphaVideoElement.loop = true;
-  assets.alphaVideoElement.muted = true;
-  assets.alphaVideoElement.crossOrigin = 'anonymous';
-  assets.alphaVideoElement.preload = 'auto';
+  // Clips exported with --bundle list their files in a manifest, depth and alpha may share one muxed video.
+  // Clips still being processed with --stream list their finished segments, which are played in turn.
+  const bundle = await loadBundleManifest(filename);
+  const segments = bundle ? null : await loadSegmentManifest(filename);
+  const streaming = segments !== null && !segments.complete && segments.segments.length > 0;
+  const videos = bundle ? bundle.videos : streaming ? segmentVideos(segments.segments[0]) : fullClipVideos(filename);
+
+  // Create video elements, one per file
+  const videoElements = {};
+  const loadVideo = (file) => {
+    if (!videoElements[file]) {
+      const element = document.createElement('video');
+      element.src = `./video/${file}`;
+      element.loop = true;
+      element.muted = true;
+      element.crossOrigin = 'anonymous';
+      element.preload = 'auto';
+      videoElements[file] = element;
+    }
+    return videoElements[file];
+  };
+  
+  assets.videoElement = loadVideo(videos.rgb.file);
+  assets.depthVideoElement = loadVideo(videos.depth.file);
+  assets.alphaVideoElement = loadVideo(videos.alpha.file);
+  assets.depthRegion = videos.depth.rect ? videos.depth : null;
+  assets.alphaRegion = videos.alpha.rect ? videos.alpha : null;
+  if (streaming) {
+    assets.segmentFollower = new SegmentFollower(filename, assets, segments);
+  }
   
   // Load all image textures
   const textureLoader = new THREE.TextureLoader();
@@ -198,13 +206,16 @@ async function loadAssetsForFilename(filename) {
     });
   };
   
-  const [extrapolatedTexture, extrapolatedDepth, extrapolatedAlpha, inpaintTexture, inpaintDepth] = await Promise.all([
-    loadTexture(extrapolatedImagePath),
-    loadTexture(extrapolatedDepthPath),
-    loadTexture(extrapolatedAlphaPath),
-    loadTexture(inpaintImagePath),
-    loadTexture(inpaintDepthPath)
-  ]);
+  // The atlas packs the five images into one texture (one request, one decode)
+  const [extrapolatedTexture, extrapolatedDepth, extrapolatedAlpha, inpaintTexture, inpaintDepth] = bundle
+    ? await loadAtlasTextures(bundle, ['BG', 'BGD', 'BGA', 'BG_inp', 'BGD_inp'])
+    : await Promise.all([
+      loadTexture(extrapolatedImagePath),
+      loadTexture(extrapolatedDepthPath),
+      loadTexture(extrapolatedAlphaPath),
+      loadTexture(inpaintImagePath),
+      loadTexture(inpaintDepthPath)
+    ]);
   
   assets.extrapolatedTexture = extrapolatedTexture;
   assets.extrapolatedDepth = extrapolatedDepth;
@@ -216,23 +227,187 @@ async function loadAssetsForFilename(filename) {
   return assets;
 }
 
+// Bundle manifest written by viewer_bundle.py, or null if the clip has none
+async function loadBundleManifest(filename) {
+  try {
+    const response = await fetch(`./video/${filename}_bundle.json`);
+    return response.ok ? await response.json() : null;
+  } catch (error) {
+    return null;
+  }
+}
+
+// Segment manifest written by streaming.py, or null if the clip has none
+async function loadSegmentManifest(filename) {
+  try {
+    // The manifest changes while the clip is processed
+    const response = await fetch(`./video/${filename}_segments.json`, { cache: 'no-store' });
+    return response.ok ? await response.json() : null;
+  } catch (error) {
+    return null;
+  }
+}
+
+// Video files of a clip in the layout of the bundle manifest
+function fullClipVideos(filename) {
+  return {
+    rgb: { file: `${filename}.mp4` },
+    depth: { file: `${filename}_depth.mp4` },
+    alpha: { file: `${filename}_alphaproc.mp4` }
+  };
+}
+
+function segmentVideos(segment) {
+  return {
+    rgb: { file: segment.video },
+    depth: { file: segment.depth },
+    alpha: { file: segment.alpha }
+  };
+}
+
+// Plays the segments of a clip still being processed in order, waits for segments that are not
+// finished yet and switches to the full clip once the manifest is complete
+class SegmentFollower {
+  constructor(filename, assets, manifest) {
+    this.filename = filename;
+    this.manifest = manifest;
+    this.index = 0;
+    this.elements = [assets.videoElement, assets.depthVideoElement, assets.alphaVideoElement];
+    for (const element of this.elements) {
+      element.loop = false;
+    }
+    assets.videoElement.addEventListener('ended', () => this.advance());
+  }
+  
+  async advance() {
+    const manifest = await loadSegmentManifest(this.filename);
+    if (manifest) {
+      this.manifest = manifest;
+    }
+    
+    const segments = this.manifest.segments;
+    if (this.index + 1 < segments.length) {
+      this.index += 1;
+      this.play(segmentVideos(segments[this.index]), 0, false);
+    } else if (this.manifest.complete) {
+      // Continue the full clip after the last segment played, and loop it from then on
+      const segment = segments[this.index];
+      this.play(fullClipVideos(this.filename), (segment.start_frame + segment.frames) / this.manifest.fps, true);
+    } else {
+      // The next segment is still being processed
+      setTimeout(() => this.advance(), 1000);
+    }
+  }
+  
+  play(videos, time, loop) {
+    const files = [videos.rgb.file, videos.depth.file, videos.alpha.file];
+    this.elements.forEach((element, i) => {
+      element.src = `./video/${files[i]}`;
+      element.loop = loop;
+      element.currentTime = time;
+      element.play();
+    });
+  }
+}
+
+// Copy every region of the atlas into its own texture on the GPU
+async function loadAtlasTextures(bundle, names) {
+  const image = await new THREE.ImageLoader().loadAsync(`./video/${bundle.atlas.file}`);
+  const atlas = new THREE.Texture(image);
+  atlas.minFilter = THREE.NearestFilter;
+  atlas.magFilter = THREE.NearestFilter;
+  atlas.generateMipmaps = false;
+  atlas.needsUpdate = true;
+  
+  const size = [bundle.atlas.width, bundle.atlas.height];
+  const textures = names.map((name) => {
+    const region = new TextureRegion(atlas, size, bundle.atlas.regions[name]);
+    region.update(renderer);
+    return region.texture;
+  });
+  atlas.dispose();
+  return textures;
+}
+
+// Shader copying a rect of a packed texture, single-channel regions are expanded to gray
+const regionVertexShader = `
+  varying vec2 vUv;
+  void main() {
+    vUv = uv;
+    gl_Position = vec4(position.xy, 0.0, 1.0);
+  }
+`;
+
+const regionFragmentShader = `
+  uniform sampler2D source;
+  uniform vec4 rect;     // x, y, width, height in texture coordinates
+  uniform vec4 channel;  // mask of the channel holding the region, zero for rgb regions
+  varying vec2 vUv;
+  void main() {
+    vec4 texel = texture2D(source, rect.xy + vUv * rect.zw);
+    vec3 color = dot(channel, channel) > 0.0 ? vec3(dot(texel, channel)) : texel.rgb;
+    gl_FragColor = vec4(color, 1.0);
+  }
+`;
+
+const channelMasks = { r: [1, 0, 0, 0], g: [0, 1, 0, 0], b: [0, 0, 1, 0] };
+const regionCamera = new THREE.OrthographicCamera(-1, 1, 1, -1, 0, 1);
+
+// Region of an atlas or muxed video ({rect: [x, y, w, h] from the top-left, channels}) rendered
+// into its own texture: once for the atlas, every frame for a video
+class TextureRegion {
+  constructor(source, size, region) {
+    const [x, y, width, height] = region.rect;
+    const [sourceWidth, sourceHeight] = size;
+    
+    this.target = new THREE.WebGLRenderTarget(width, height, {
+      minFilter: THREE.LinearFilter,
+      magFilter: THREE.LinearFilter,
+      depthBuffer: false
+    });
+    this.texture = this.target.texture;
+    
+    const material = new THREE.ShaderMaterial({
+      uniforms: {
+        source: { value: source },
+        // texture coordinates start at the bottom row
+        rect: { value: new THREE.Vector4(x / sourceWidth, 1 - (y + height) / sourceHeight,
+                                         width / sourceWidth, height / sourceHeight) },
+        channel: { value: new THREE.Vector4(...(channelMasks[region.channels] || [0, 0, 0, 0])) }
+      },
+      vertexShader: regionVertexShader,
+      fragmentShader: regionFragmentShader,
+      depthTest: false,
+      depthWrite: false
+    });
+    const quad = new THREE.Mesh(new THREE.PlaneGeometry(2, 2), material);
+    quad.frustumCulled = false;
+    this.scene = new THREE.Scene();
+    this.scene.add(quad);
+  }
+  
+  update(renderer) {
+    // The copy is a single pass, not one per eye
+    const xrEnabled = renderer.xr.enabled;
+    renderer.xr.enabled = false;
+    renderer.setRenderTarget(this.target);
+    renderer.render(this.scene, regionCamera);
+    renderer.setRenderTarget(null);
+    renderer.xr.enabled = xrEnabled;
+  }
+}
+
 // Main Layered Video Player class
 class RGBDVideoPlayer {
   constructor(assets) {
     this.assets = assets;
     
     // Create video textures
-    this.videoTexture = new THREE.VideoTexture(assets.videoElement);
-    this.videoTexture.minFilter = THREE.LinearFilter;
-    this.videoTexture.magFilter = THREE.LinearFilter;
-    
-    this.depthTexture = new THREE.VideoTexture(assets.depthVideoElement);
-    this.depthTexture.minFilter = THREE.LinearFilter;
-    this.depthTexture.magFilter = THREE.LinearFilter;
-    
-    this.alphaTexture = new THREE.VideoTexture(assets.alphaVideoElement);
-    this.alphaTexture.minFilter = THREE.LinearFilter;
-    this.alphaTexture.magFilter = THREE.LinearFilter;
+    this.sourceTextures = new Map();
+    this.videoRegions = [];
+    this.videoTexture = this.createVideoTexture(assets.videoElement, null);
+    this.depthTexture = this.createVideoTexture(assets.depthVideoElement, assets.depthRegion);
+    this.alphaTexture = this.createVideoTexture(assets.alphaVideoElement, assets.alphaRegion);
     
     // Create panoramic geometry for spherical viewing
     this.radius = 6;
@@ -249,6 +424,24 @@ class RGBDVideoPlayer {
     this.hasInitialPosition = false;
   }
   
+  // Texture of a video, or of a region of a muxed video ({rect, channels, size})
+  createVideoTexture(element, region) {
+    if (!this.sourceTextures.has(element)) {
+      const texture = new THREE.VideoTexture(element);
+      texture.minFilter = THREE.LinearFilter;
+      texture.magFilter = THREE.LinearFilter;
+      this.sourceTextures.set(element, texture);
+    }
+    
+    const texture = this.sourceTextures.get(element);
+    if (!region) {
+      return texture;
+    }
+    const videoRegion = new TextureRegion(texture, region.size, region);
+    this.videoRegions.push(videoRegion);
+    return videoRegion.texture;
+  }
+  
   setupLayers() {
     // Layer 1: Inpainted Layer
     this.bgSimpleMaterial = new THREE.ShaderMaterial({
@@ -349,6 +542,10 @@ class RGBDVideoPlayer {
   
   update(camera) {
     if (!camera) return;
+    // Copy the depth and alpha of the current frame out of the muxed video
+    for (const videoRegion of this.videoRegions) {
+      videoRegion.update(renderer);
+    }
     // Set initial position to head position on first update
     if (!this.hasInitialPosition) {
       const xrCamera = renderer.xr.getCamera();